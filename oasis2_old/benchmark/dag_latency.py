@@ -0,0 +1,171 @@
+"""
+End-to-end job latency of a synthetic task graph, polling manager vs event driven manager.
+
+Runs a real Manager and Worker in this process against the mysql and redis of the selected config
+(OASIS_ENV / OASIS_REGION, or conf/my_conf.ini), tables should exist, see init_db.py. Tasks of the
+graph only sleep --task-time seconds. Every run uses its own streams, manager members and cluster,
+rows and redis keys written are deleted after the run.
+
+polling: the manager checks all jobs every interval (sweep on every tick, no event watcher) and
+         workers sleep --worker-sleep seconds after every task, as before task events.
+events:  workers publish task events and the manager advances the job on them, the sweep runs
+         every sweep_interval as a safety net.
+
+    PYTHONPATH=. python benchmark/dag_latency.py --tasks 20 --task-time 1 --rounds 3
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from oasis.db.models import get_model_by_id
+from oasis.db.models.job import JobModel
+from oasis.db.models.task import TaskModel
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+from oasis.utils.generator import gen_uuid4
+from oasis.utils.logger import logger
+from oasis.worker import Worker
+from oasis.worker.manager import Manager
+from oasis.worker.planner import save_jobs
+from oasis.worker.scheduler import scheduler
+from oasis.worker.tasks import BaseTask
+from oasis.worker.tasks import RegisteredTasks
+from oasis.worker.tasks import check_rollback
+from oasis.worker.tasks import check_task
+from oasis.worker.tasks import del_job_context
+
+
+class TaskBenchmarkSleep(BaseTask):
+    context_keys = []
+
+    @check_task
+    async def run(self):
+        await asyncio.sleep(self.args.get('seconds', 0))
+        return {}
+
+    @check_rollback
+    async def rollback(self):
+        return True
+
+
+RegisteredTasks['TaskBenchmarkSleep'] = TaskBenchmarkSleep
+
+
+class PollingWorker(Worker):
+    """
+    Worker before task events, it slept after every task.
+    """
+
+    def __init__(self, name, worker_sleep, **conf):
+        super().__init__(name, **conf)
+        self.worker_sleep = worker_sleep
+
+    async def _consume(self, stream, msg_id, task_msg):
+        await super()._consume(stream, msg_id, task_msg)
+        await asyncio.sleep(self.worker_sleep)
+
+
+def gen_graph(task_count, fan_out, task_time):
+    """
+    Chain of tasks with a fan out level in the middle, task -> next tasks.
+    """
+    chain = [TaskModel(name='TaskBenchmarkSleep', args={'seconds': task_time}) for _ in range(task_count)]
+    graph = {task: [next_task] for task, next_task in zip(chain, chain[1:])}
+    graph[chain[-1]] = []
+
+    middle = task_count // 2
+    fan = [TaskModel(name='TaskBenchmarkSleep', args={'seconds': task_time}) for _ in range(fan_out)]
+    graph[chain[middle]] = fan
+    for task in fan:
+        graph[task] = [chain[middle + 1]]
+    return graph
+
+
+async def clean(job_id, keys):
+    job = await get_model_by_id(JobModel, job_id)
+    if job:
+        for task in job.tasks:
+            await task.delete(hard=True)
+        await job.delete(hard=True)
+    await scheduler.reset(job_id)
+    await del_job_context(job_id)
+    await redis_client.delete(*keys)
+
+
+async def run_job(mode, args):
+    run_id = gen_uuid4()
+    stream = f'benchmark_{run_id}'
+    # Worker reads its stream from config
+    config.set('worker', 'stream', stream)
+    polling = mode == 'polling'
+    manager = Manager(f'benchmark_manager_{run_id}', stream=stream,
+                      members_key=f'/oasis/benchmark/{run_id}/members',
+                      interval=args.interval,
+                      sweep_interval=0 if polling else args.sweep_interval)
+    worker_conf = dict(types=TaskModel.TYPE.ALL, concurrent=args.concurrent)
+    if polling:
+        worker = PollingWorker(f'benchmark_worker_{run_id}', args.worker_sleep, **worker_conf)
+    else:
+        worker = Worker(f'benchmark_worker_{run_id}', **worker_conf)
+    worker.enable = True
+
+    loops = [manager._keep_alive(), manager._start_manager(), *worker._standby()]
+    if not polling:
+        loops.append(manager._watch_events())
+    running = [asyncio.ensure_future(loop) for loop in loops]
+
+    job = JobModel(id=gen_uuid4(), name='benchmark', status=JobModel.STATUS.Doing,
+                   cluster_id=f'benchmark_{run_id}')
+    try:
+        while manager.name not in manager.members:
+            await asyncio.sleep(0.1)
+
+        start = time.perf_counter()
+        await save_jobs([(job, gen_graph(args.tasks, args.fan_out, args.task_time), None)])
+        while True:
+            job_model = await get_model_by_id(JobModel, job.id)
+            if job_model.status != JobModel.STATUS.Doing:
+                break
+            await asyncio.sleep(args.poll)
+        elapsed = time.perf_counter() - start
+        if job_model.status != JobModel.STATUS.Done:
+            raise Exception(f'Benchmark job {job.id} ended {job_model.status}')
+        return elapsed
+    finally:
+        manager.enable = False
+        worker.enable = False
+        for future in running:
+            future.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        # Consumer groups go with their streams
+        await clean(job.id, [*worker.streams, *[f'{s}_dead' for s in worker.streams], manager.members_key])
+
+
+async def main(args):
+    results = {}
+    for mode in ('polling', 'events'):
+        results[mode] = [await run_job(mode, args) for _ in range(args.rounds)]
+
+    busy = (args.tasks + args.fan_out) * args.task_time
+    print(f'graph: {args.tasks + args.fan_out} tasks, task time {args.task_time}s, sum of task time {busy:.0f}s, '
+          f'interval {args.interval}s, sweep interval {args.sweep_interval}s')
+    for mode, elapsed in results.items():
+        runs = ', '.join(f'{e:.1f}' for e in elapsed)
+        print(f'{mode:<10}median {statistics.median(elapsed):8.1f}s  runs {runs}')
+    print(f'speed up: {statistics.median(results["polling"]) / statistics.median(results["events"]):.2f}x')
+
+
+if __name__ == '__main__':
+    logger.init_logger('benchmark', 'benchmark')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--fan-out', type=int, default=4)
+    parser.add_argument('--task-time', type=float, default=1)
+    parser.add_argument('--interval', type=int, default=config.getint('manager', 'interval', fallback=10))
+    parser.add_argument('--sweep-interval', type=int, default=config.getint('manager', 'sweep_interval', fallback=60))
+    parser.add_argument('--worker-sleep', type=float, default=5)
+    parser.add_argument('--concurrent', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--poll', type=float, default=0.05, help='seconds between reads of the job status')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""
+Request latency against a local stand-in upstream, session per request vs shared session.
+
+Old: oasis.utils.http opened a new ClientSession for every request, so every request paid
+     DNS lookup, TCP connect (and TLS handshake for https upstreams), replayed here as it was.
+New: oasis.utils.http.get itself, sessions of SessionRegistry (settings of [http]) and the retry policy.
+
+The upstream is a local aiohttp server answering a small json, `--delay` ms is added to
+every response to model upstream work. Requests use `localhost`, so DNS lookup is included.
+
+    PYTHONPATH=. python benchmark/http_latency.py --requests 500 --concurrency 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+from oasis.utils import http
+from oasis.utils.http import http_sessions
+from oasis.utils.logger import logger
+
+
+async def start_upstream(delay):
+    async def handler(request):
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        return web.json_response({'Code': 200, 'RequestId': 'rrrr-eeee-qqqq-uuuu'})
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://localhost:{port}/'
+
+
+async def per_request_session(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as res:
+            return res.status, await res.json()
+
+
+async def registry_session(url):
+    return await http.get(url)
+
+
+async def run(request, url, total, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one():
+        async with semaphore:
+            start = time.perf_counter()
+            await request(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_one() for _ in range(total)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'rps': total / elapsed,
+    }
+
+
+async def main(args):
+    runner, url = await start_upstream(args.delay)
+    try:
+        # Warm up the server
+        await run(per_request_session, url, 20, 1)
+        old = await run(per_request_session, url, args.requests, args.concurrency)
+
+        new = await run(registry_session, url, args.requests, args.concurrency)
+    finally:
+        await http_sessions.close()
+        await runner.cleanup()
+
+    print(f'{args.requests} requests, concurrency {args.concurrency}, upstream delay {args.delay} ms')
+    for name, res in (('session per request', old), ('SessionRegistry', new)):
+        print(f'{name:<22}p50 {res["p50"]:7.2f} ms  p99 {res["p99"]:7.2f} ms  {res["rps"]:8.1f} req/s')
+    print(f'p50 speed up: {old["p50"] / new["p50"]:.2f}x')
+
+
+if __name__ == '__main__':
+    logger.init_logger('benchmark', 'benchmark')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,173 @@
+"""
+LaunchCluster persistence latency, row by row saves vs one transaction for the job and its sub jobs.
+
+Runs the real models against the mysql and redis of the selected config (OASIS_ENV / OASIS_REGION,
+or conf/my_conf.ini), tables should exist, see init_db.py. Upstream calls of LaunchCluster
+(price platform, IAM) are not part of this, only what the API writes before it returns:
+the launch_cluster job with its task graph and context, the bind_eip and replace_resources_tags
+sub jobs.
+
+Row by row: job.save(), every task.save() from tail to head so next task ids are known,
+            then job.save({'status': Doing}), as LaunchCluster did before save_jobs.
+save_jobs:  job contexts and schedules, then one transaction with one multi-row insert per table.
+
+Rows and redis keys written are deleted after every round.
+
+    PYTHONPATH=. python benchmark/launch_cluster_latency.py --rounds 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from oasis.db.models.job import JobModel
+from oasis.db.models.task import TaskModel
+from oasis.db.service.mysql import query_counter
+from oasis.utils.generator import gen_uuid4
+from oasis.utils.logger import logger
+from oasis.worker.planner import Planner
+from oasis.worker.planner import save_jobs
+from oasis.worker.scheduler import scheduler
+from oasis.worker.tasks import del_job_context
+from oasis.worker.tasks import set_job_context
+
+# Task graphs of LaunchCluster (KES), key -> (task name, next keys)
+LAUNCH_CLUSTER = {
+    'create_product': ('TaskCreateProduct', ['create_order']),
+    'create_order': ('TaskCreateOrder', ['init_cluster', 'notify_order', 'create_instance', 'create_ebs']),
+    'init_cluster': ('TaskInitClusterCreate', ['create_security_group', 'create_epc_key', 'send_feishu_init']),
+    'send_feishu_init': ('TaskSendFeishu', []),
+    'create_epc_key': ('TaskCreateSshKey', ['create_instance']),
+    'create_security_group': ('TaskCreateSecurityGroup',
+                              ['create_control_security_group', 'create_subnet', 'create_instance']),
+    'create_control_security_group': ('TaskCreateControlSecurityGroup',
+                                      ['create_subnet', 'provision_control_security_group']),
+    'create_subnet': ('TaskCreateSubnet', ['milestone_1']),
+    'milestone_1': ('TaskUpdateCluster', ['create_instance']),
+    'create_instance': ('TaskCreateInstance',
+                        ['create_inner_lb', 'install_gringotts_agent', 'config_hostname', 'add_instance_monitor',
+                         'provision_control_security_group', 'create_ebs', 'attach_ebs', 'mount_ebs']),
+    'create_inner_lb': ('TaskCreateInnerLB', ['provision_control_security_group']),
+    'provision_control_security_group': ('TaskProvisionControlSecurityGroup', ['check_instance_ready']),
+    'check_instance_ready': ('TaskCheckInstanceReady', ['create_ebs']),
+    'create_ebs': ('TaskCreateEbs', ['attach_ebs']),
+    'attach_ebs': ('TaskAttachEbs', ['mount_ebs']),
+    'mount_ebs': ('TaskMountEbs', ['milestone_2']),
+    'milestone_2': ('TaskUpdateCluster', ['config_hostname']),
+    'config_hostname': ('TaskConfigHostname', ['install_gringotts_agent']),
+    'install_gringotts_agent': ('TaskInstallGringottsAgent', ['milestone_3']),
+    'milestone_3': ('TaskUpdateCluster', ['notify_order', 'add_cluster_monitor', 'gringotts_launch_cluster']),
+    'notify_order': ('TaskNotifyOrder', ['milestone_4']),
+    'add_cluster_monitor': ('TaskAddClusterMonitor', ['add_instance_monitor']),
+    'add_instance_monitor': ('TaskAddInstanceMonitor', ['milestone_4']),
+    'gringotts_launch_cluster': ('TaskGringottsLaunchCluster', ['milestone_4']),
+    'milestone_4': ('TaskUpdateCluster', ['send_feishu_done']),
+    'send_feishu_done': ('TaskSendFeishu', []),
+}
+
+BIND_EIP = {
+    'send_feishu_init': ('TaskSendFeishu', []),
+    'create_eip': ('TaskCreateEIP', ['allocate_eip']),
+    'create_slb': ('TaskCreateSLB', ['allocate_eip']),
+    'allocate_eip': ('TaskAllocateEIP2SLB', ['send_feishu_done']),
+    'send_feishu_done': ('TaskSendFeishu', []),
+}
+
+REPLACE_RESOURCES_TAGS = {
+    'replace_resources_tags': ('TaskReplaceResourcesTags', []),
+}
+
+
+def gen_task_graph(graph, args):
+    tasks = {key: TaskModel(name=name, rollback_on_fail=True, args=dict(args)) for key, (name, _) in graph.items()}
+    return {tasks[key]: [tasks[next_key] for next_key in next_keys] for key, (_, next_keys) in graph.items()}
+
+
+def gen_jobs(args_size):
+    """
+    New jobs of one LaunchCluster call, [(job, task graph, context)].
+    """
+    # Request kwargs are copied into args of many tasks
+    args = {'cluster_name': 'benchmark', 'padding': 'x' * args_size}
+    context = {'cluster_id': 'benchmark', 'product_details': {'padding': 'x' * args_size}}
+    # Job ids are generated by LaunchCluster, sub jobs name their parent
+    job = JobModel(id=gen_uuid4(), name='launch_cluster', status=JobModel.STATUS.Doing)
+    job_1 = JobModel(id=gen_uuid4(), name='bind_eip', status=JobModel.STATUS.Init, parent_job=job.id)
+    job_2 = JobModel(id=gen_uuid4(), name='replace_resources_tags', status=JobModel.STATUS.Init,
+                     parent_job=job_1.id)
+    return [(job, gen_task_graph(LAUNCH_CLUSTER, args), context),
+            (job_1, gen_task_graph(BIND_EIP, args), None),
+            (job_2, gen_task_graph(REPLACE_RESOURCES_TAGS, args), None)]
+
+
+async def row_by_row(jobs):
+    for job, task_graph, context in jobs:
+        status = job.status
+        job.status = JobModel.STATUS.Init
+        await job.save()
+        if context is not None:
+            await set_job_context(job.id, context)
+
+        # Tail first, next task ids are known when a task is saved. Planner copies the graph, use id(task)
+        tmp_tasks = {id(task): task for task in task_graph}
+        arrangements = Planner({id(task): [id(next_task) for next_task in next_tasks]
+                                for task, next_tasks in task_graph.items()}).arrange_tasks()
+        for tmp_ids in reversed(arrangements):
+            for tmp_id in tmp_ids:
+                task = tmp_tasks[tmp_id]
+                task.job_id = job.id
+                task.next_tasks = [next_task.id for next_task in task_graph[task]]
+                await task.save()
+
+        if status == JobModel.STATUS.Doing:
+            await job.save({'status': status})
+
+
+async def clean(jobs):
+    for job, task_graph, _ in jobs:
+        for task in task_graph:
+            if task.id:
+                await task.delete(hard=True)
+        if job.id:
+            await job.delete(hard=True)
+            await del_job_context(job.id)
+            await scheduler.reset(job.id)
+
+
+async def measure(save, rounds, args_size):
+    latencies = []
+    queries = 0
+    for _ in range(rounds):
+        jobs = gen_jobs(args_size)
+        counter = {'queries': 0}
+        token = query_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            await save(jobs)
+            latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            query_counter.reset(token)
+            await clean(jobs)
+        queries = counter['queries']
+    return statistics.median(latencies), queries
+
+
+async def main(args):
+    # Warm up pools of mysql and redis
+    await measure(save_jobs, 1, args.args_size)
+    old, old_queries = await measure(row_by_row, args.rounds, args.args_size)
+    new, new_queries = await measure(save_jobs, args.rounds, args.args_size)
+
+    tasks = sum(len(task_graph) for _, task_graph, _ in gen_jobs(0))
+    print(f'jobs: 3, tasks: {tasks}, rounds: {args.rounds}, args size: {args.args_size} bytes')
+    print(f'{"row by row":<18}p50 {old:8.1f} ms {old_queries:4} mysql statements')
+    print(f'{"save_jobs":<18}p50 {new:8.1f} ms {new_queries:4} mysql statements')
+    print(f'speed up: {old / new:.2f}x')
+
+
+if __name__ == '__main__':
+    logger.init_logger('benchmark', 'benchmark')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--args-size', type=int, default=512, help='bytes of request kwargs copied into task args')
+    asyncio.run(main(parser.parse_args()))
@@ -10,6 +10,7 @@ from oasis.db.models.job import JobModel
 from oasis.db.models.task import TaskModel
 from oasis.db.service import redis_client
 from oasis.utils.generator import gen_cluster_lock
+from oasis.worker.scheduler import scheduler
 
 
 async def find_running_job_by_cluster(cluster_id):
@@ -69,10 +70,11 @@ async def retry_job(job_id):
         cprint(f'Retry failed, Job {job_id} is in status: {job.status}', 'red')
         return False
 
-    await job.save({'status': JobModel.STATUS.Doing})
+    await job.update_columns({'status': JobModel.STATUS.Doing})
     for task in job.tasks:
         if task.status == TaskModel.STATUS.Failed:
-            await task.save({'status': TaskModel.STATUS.Init})
+            await task.update_columns({'status': TaskModel.STATUS.Init})
+    await scheduler.reset(job_id)
 
     return True
 
@@ -83,10 +85,11 @@ async def rollback_job(job_id):
         cprint(f'Retry failed, Job {job_id} is in status: {job.status}', 'red')
         return False
 
-    await job.save({'status': JobModel.STATUS.Rolling})
+    await job.update_columns({'status': JobModel.STATUS.Rolling})
     for task in job.tasks:
         if task.status in [TaskModel.STATUS.RollFailed]:
-            await task.save({'status': TaskModel.STATUS.Failed})
+            await task.update_columns({'status': TaskModel.STATUS.Failed})
+    await scheduler.reset(job_id)
 
     return True
 
@@ -96,6 +99,7 @@ async def skip_task(task_id):
     job_id = task.job_id
     job = await get_model_by_id(JobModel, job_id)
 
-    await task.save({'status': TaskModel.STATUS.Done})
-    await job.save({'status': JobModel.STATUS.Doing})
+    await task.update_columns({'status': TaskModel.STATUS.Done})
+    await job.update_columns({'status': JobModel.STATUS.Doing})
+    await scheduler.reset(job_id)
     return job_id
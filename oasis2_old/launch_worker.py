@@ -8,11 +8,19 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', '--worker_name', help='Specify Unique Worker Name',
                         type=str, required=True)
+    parser.add_argument('-t', '--types', help='Task types to run, comma separated, e.g. poly,all',
+                        type=str, default=None)
+    parser.add_argument('-c', '--concurrent', help='Max tasks running at the same time',
+                        type=int, default=None)
 
     args = parser.parse_args()
     worker_name = args.worker_name
 
     worker_conf = {k: v for k, v in config['worker'].items()}
+    if args.types:
+        worker_conf['types'] = args.types
+    if args.concurrent:
+        worker_conf['concurrent'] = args.concurrent
     worker = Worker(worker_name, **worker_conf)
     logger.init_logger('worker', worker_name)
     logger.info(worker, f'start worker {worker_name}')
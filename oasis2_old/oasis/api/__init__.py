@@ -9,8 +9,6 @@ from aiohttp.web_response import Response
 from oasis.api.response import console_response
 from oasis.api.response import error_response
 from oasis.db.models import OasisBase
-from oasis.db.models import get_model_by_id
-from oasis.db.models.user import UserModel
 from oasis.utils.config import config
 from oasis.utils.convert import camel2snack
 from oasis.utils.convert import dict_camel2snake
@@ -23,6 +21,7 @@ from oasis.utils.generator import gen_uuid4
 from oasis.utils.logger import logger
 from oasis.utils.redlock import lock_request
 from oasis.utils.redlock import unlock_request
+from oasis.utils.sdk.iam import get_account
 from oasis.utils.sdk.iam import get_user_by_id
 from oasis.utils.validation import complete_params
 from oasis.utils.validation import validate_params
@@ -68,7 +67,7 @@ class BaseView(web.View, metaclass=abc.ABCMeta):
                 if not self.account_id:
                     return self.error_response(msg='Please specify account id', status=402)
 
-                account = await get_model_by_id(UserModel, self.account_id)
+                account = await get_account(self.account_id)
                 if not account:
                     return self.error_response(msg=f'Account {self.account_id} not found.', status=401)
 
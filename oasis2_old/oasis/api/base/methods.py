@@ -10,6 +10,7 @@ from oasis.db.models.job import JobModel
 from oasis.db.models.notification import NotificationModel
 from oasis.db.models.user import UserModel
 from oasis.utils.convert import replace_wildcards
+from oasis.utils.sdk.iam import get_account
 
 
 def slb_check_listener(listeners: list, db_listener: dict, instance_ids: list) -> bool:
@@ -249,7 +250,7 @@ async def op_list_clusters_from_db(filters, offset, limit, *,
                                    expired_after=None, expired_before=None, charge_type=None, account_id=None,
                                    company_alias=None,
                                    ):
-    user_model = await get_model_by_id(UserModel, account_id)
+    user_model = await get_account(account_id)
     account_role = user_model.role
 
     query = model_query(ClusterModel)
@@ -368,7 +369,7 @@ async def op_list_clusters_from_db(filters, offset, limit, *,
     f_clusters = []
     for cluster in clusters:
         company_alias = None
-        tmp = await get_model_by_id(UserModel, cluster.ksc_user_id)
+        tmp = await get_account(cluster.ksc_user_id)
         if tmp:
             company_alias = tmp.company_alias
         summary_cluster = OpClusterSummary(cluster).__dict__
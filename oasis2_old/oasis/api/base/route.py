@@ -69,6 +69,8 @@ def __app_routes():
     routes.append(('/OpControlHttpReferer', OperationView))
     routes.append(('/OpModifyCluster', OperationView))
     routes.append(('/OpStartInstance', OperationView))
+    routes.append(('/OpDescribeUpstreams', OperationView))
+    routes.append(('/OpDescribeJobQueries', OperationView))
 
     # Operation
     routes.append(('/BindTags', PlatformView))
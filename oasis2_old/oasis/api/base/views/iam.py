@@ -123,7 +123,7 @@ class IamView(BaseView):
                           kwargs.pop('order_id', None))
 
         job = JobModel(name='bind_internal_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -164,7 +164,7 @@ class IamView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -202,7 +202,7 @@ class IamView(BaseView):
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         job = JobModel(name='bind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -269,7 +269,7 @@ class IamView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -328,7 +328,7 @@ class IamView(BaseView):
         #                                 f'please contact administrator...')
 
         job = JobModel(name='unbind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -381,7 +381,7 @@ class IamView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -414,7 +414,7 @@ class IamView(BaseView):
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         job = JobModel(name='bind_private_slb', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -474,7 +474,7 @@ class IamView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -520,7 +520,7 @@ class IamView(BaseView):
         #                                 f'please contact administrator...')
 
         job = JobModel(name='unbind_private_slb', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -567,7 +567,7 @@ class IamView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -6,6 +6,8 @@ from oasis.db.models.task import TaskModel
 from oasis.utils.logger import logger
 from oasis.utils.sdk import feishu_client
 from oasis.worker import TaskSendFeishu
+from oasis.worker.lease import get_leases
+from oasis.worker.scheduler import scheduler
 
 
 class JobView(BaseView):
@@ -17,7 +19,18 @@ class JobView(BaseView):
         job_res = await get_model_by_id(JobModel, model_id=job_id)
 
         job = job_res.to_dict() if job_res else {}
-        job.setdefault('tasks', [task.to_dict() for task in job_res.tasks])
+        # Args and results show values kept as blob refs resolved
+        job.setdefault('tasks', [dict(task.to_dict(), args=await task.load_args(), results=await task.load_results())
+                                 for task in job_res.tasks])
+        # Running tasks show worker heartbeat and progress
+        running = [task['id'] for task in job['tasks']
+                   if task['status'] in (TaskModel.STATUS.Doing, TaskModel.STATUS.Rolling)]
+        leases = await get_leases(running)
+        for task in job['tasks']:
+            lease = leases.get(task['id'])
+            if lease:
+                lease.pop('task_msg', None)
+            task['lease'] = lease
         return {'job': job}
 
     async def retry_job(self, *args, **kwargs):
@@ -28,10 +41,12 @@ class JobView(BaseView):
         if job_res.status not in [JobModel.STATUS.Error]:
             return error_response(f'Can not retry job {job_id}, status is {job_res.status}')
         logger.info(self, f'start retry job, previous status {job_res.status}')
-        await job_res.save({'status': JobModel.STATUS.Doing})
+        await job_res.update_columns({'status': JobModel.STATUS.Doing})
         for task in job_res.tasks:
             if task.status == TaskModel.STATUS.Failed:
-                await task.save({'status': TaskModel.STATUS.Init})
+                await task.update_columns({'status': TaskModel.STATUS.Init})
+        # Manager rebuilds schedule from db
+        await scheduler.reset(job_id)
         await TaskSendFeishu(job_id=job_id, args={
             'cluster_id': job_res.cluster_id,
             'state': feishu_client.STATE.RETRY,
@@ -46,9 +61,10 @@ class JobView(BaseView):
         if job_res.status != JobModel.STATUS.Error:
             return error_response(f'Can not retry job {job_id}, status is {job_res.status}')
         logger.info(self, f'start rolling back job, previous status {job_res.status}')
-        await job_res.save({'status': JobModel.STATUS.Rolling})
+        await job_res.update_columns({'status': JobModel.STATUS.Rolling})
         for task in job_res.tasks:
             if task.status == TaskModel.STATUS.RollFailed:
-                await task.save({'status': TaskModel.STATUS.Failed})
+                await task.update_columns({'status': TaskModel.STATUS.Failed})
+        await scheduler.reset(job_id)
 
         return {'job': job_res.to_dict()}
@@ -20,10 +20,14 @@ from oasis.utils import sdk
 from oasis.utils.chaos import OP_CLUSTER_STATUS_CONVERT_MAP
 from oasis.utils.convert import str2datetime
 from oasis.utils.convert import translate_marker_str
+from oasis.utils.http import get_breaker_states
+from oasis.utils.http import retry_policies
 from oasis.utils.logger import logger
 from oasis.utils.sdk import charge_client
 from oasis.utils.sdk.iam import get_user_ak_sk_by_id
 from oasis.utils.sdk.iam import get_user_by_id
+from oasis.utils.sdk.iam import invalidate_account
+from oasis.worker.snapshot import get_job_queries
 
 
 class OperationView(BaseView):
@@ -115,6 +119,7 @@ class OperationView(BaseView):
             if count != 0:
                 raise Exception(f'User {k_id} has {count} clusters')
             await user_model.delete()
+            invalidate_account(k_id)
         return {
             'kuser_id': kuser_id,
         }
@@ -148,6 +153,7 @@ class OperationView(BaseView):
             user_dict.setdefault('total_disk_gb', total_disk_gb)
 
         user = await user.save(user_dict)
+        invalidate_account(kuser_id)
         return user
 
     async def op_describe_user(self, *args, **kwargs):
@@ -533,3 +539,23 @@ class OperationView(BaseView):
         res = await kec_client.start_instances(instance_ids=[instance_id], account_id=account_id)
 
         return res
+
+    async def op_describe_upstreams(self, *args, **kwargs):
+        """
+        Circuit breaker and retry budget of upstream hosts, local: this api process,
+        reported: latest state reported by any daemon when its breaker changed.
+        """
+        return {
+            'local': retry_policies.describe(),
+            'reported': await get_breaker_states(),
+        }
+
+    async def op_describe_job_queries(self, *args, **kwargs):
+        """
+        Database statements of a job run by workers, before: as if every task loaded the
+        cluster from the database, after: with the job scoped cluster snapshots.
+        """
+        job_id = kwargs.get('job_id', None)
+        if not job_id:
+            raise Exception(f'Please specify job id, got {job_id}')
+        return await get_job_queries(job_id)
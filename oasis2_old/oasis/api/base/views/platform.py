@@ -37,7 +37,7 @@ class PlatformView(BaseView):
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         job = JobModel(name='replace_resources_tags', status=JobModel.STATUS.Init, cluster_id=cluster_id)
-        await job.save()
+        await job.insert()
         job_id = job.id
 
         self.context = {
@@ -78,7 +78,7 @@ class PlatformView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
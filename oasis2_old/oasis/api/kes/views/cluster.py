@@ -26,6 +26,7 @@ from oasis.utils.sdk import gringotts_client
 from oasis.utils.sdk import gringotts_monitor_client
 from oasis.utils.sdk import price_client
 from oasis.utils.sdk.platform.tag import TagResource
+from oasis.worker.planner import save_jobs
 from oasis.worker.planner import save_task_graph
 from oasis.worker.tasks import set_job_context
 
@@ -219,7 +220,6 @@ class ClusterView(BaseView):
         if distribution not in DISTRIBUTION_SCHEMAS.get('KES', []):
             raise Exception(f'KES did not support distribution {distribution}')
 
-        # TODO cache
         product_details = await price_client.get_product_details(self.account_id, PRODUCT_GROUP_ID_MAP['KES'], '1')
         logger.info(self, f'==product_details: {product_details}')
         kwargs.setdefault('product_details', product_details)
@@ -246,8 +246,6 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
-
         self.context = {
             'product': self.product,
             'region': self.region,
@@ -262,8 +260,6 @@ class ClusterView(BaseView):
             'product_details': product_details,
         }
 
-        await set_job_context(job_id, self.context)
-
         task_send_feishu_init = TaskModel(
             name='TaskSendFeishu',
             args={
@@ -461,8 +457,9 @@ class ClusterView(BaseView):
             task_send_feishu_done: [],
         }
 
-        await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        # Job with its sub jobs, task graphs and context are saved at once
+        job.status = JobModel.STATUS.Doing
+        jobs = [(job, task_graph, self.context)]
 
         eip_line_id = kwargs.get('eip_line_id', None)
         allocation_id = kwargs.get('allocation_id', None)
@@ -473,7 +470,7 @@ class ClusterView(BaseView):
             # Move Create EIP into individual job
             job_1 = JobModel(name='bind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                              parent_job=job_id)
-            await job_1.save()
+            job_1.id = gen_uuid4()
             job_1_id = job_1.id
             tags_job_id = job_1_id
 
@@ -516,14 +513,12 @@ class ClusterView(BaseView):
                 task_allocate_eip: [task_eip_send_feishu_done],
                 task_eip_send_feishu_done: [],
             }
-            await save_task_graph(job_1_id, task_1_graph)
+            jobs.append((job_1, task_1_graph, None))
 
         tags = kwargs.get('tags', None) or []
 
         job_2 = JobModel(name='replace_resources_tags', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                          parent_job=tags_job_id)
-        await job_2.save()
-        job_2_id = job_2.id
 
         task_replace_resources_tags_bind_eip = TaskModel(name='TaskReplaceResourcesTags',
                                                          args={
@@ -533,7 +528,8 @@ class ClusterView(BaseView):
         task_2_graph = {
             task_replace_resources_tags_bind_eip: []
         }
-        await save_task_graph(job_2_id, task_2_graph)
+        jobs.append((job_2, task_2_graph, None))
+        await save_jobs(jobs)
 
         return {
             'cluster_id': cluster_id,
@@ -645,7 +641,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -750,14 +746,14 @@ class ClusterView(BaseView):
         task_graph.setdefault(task_send_feishu_done, [])
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         # region 释放EIP
         if need_disassociate_eip:
             # Move Unbind EIP into individual job
             job_1 = JobModel(name='unbind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                              parent_job=parent_job_id)
-            await job_1.save()
+            await job_1.insert()
             job_1_id = job_1.id
             parent_job_id = job_1.id
 
@@ -798,7 +794,7 @@ class ClusterView(BaseView):
         # region 释放集群默认标签
         job_2 = JobModel(name='delete_cluster_default_tag', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                          parent_job=parent_job_id)
-        await job_2.save()
+        await job_2.insert()
         job_2_id = job_2.id
         parent_job_id = job_2.id
 
@@ -838,7 +834,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -897,7 +893,7 @@ class ClusterView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -928,7 +924,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -987,7 +983,7 @@ class ClusterView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
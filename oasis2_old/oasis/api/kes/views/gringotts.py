@@ -92,7 +92,7 @@ class GringottsView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -136,7 +136,7 @@ class GringottsView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -165,7 +165,7 @@ class GringottsView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -209,7 +209,7 @@ class GringottsView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -237,7 +237,7 @@ class GringottsView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -281,7 +281,7 @@ class GringottsView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -309,7 +309,7 @@ class GringottsView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -353,7 +353,7 @@ class GringottsView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -382,7 +382,7 @@ class GringottsView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -426,7 +426,7 @@ class GringottsView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
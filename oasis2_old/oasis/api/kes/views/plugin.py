@@ -224,7 +224,7 @@ class PluginView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -322,7 +322,7 @@ class PluginView(BaseView):
         logger.info(self, f'====install_user_plugin: {task_graph}')
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -372,7 +372,7 @@ class PluginView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -456,7 +456,7 @@ class PluginView(BaseView):
                 task_graph.setdefault(task_tuple[2], [task_send_feishu_done])
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -506,7 +506,7 @@ class PluginView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -603,7 +603,7 @@ class PluginView(BaseView):
                 # task_graph.setdefault(task_tuple[2], [task_send_feishu_done])
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
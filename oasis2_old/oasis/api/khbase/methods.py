@@ -10,6 +10,7 @@ from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.user import UserModel
 from oasis.utils.convert import replace_wildcards
 from oasis.utils.generator import get_url_suffix
+from oasis.utils.sdk.iam import get_account
 
 
 async def describe_cluster_from_db(cluster_id, account_id=None):
@@ -39,7 +40,7 @@ async def list_clusters_from_db(filters, offset, limit, *,
                                 cluster_status=None, created_after=None, created_before=None,
                                 account_id=None,
                                 ):
-    user_model = await get_model_by_id(UserModel, account_id)
+    user_model = await get_account(account_id)
     if not user_model:
         raise Exception(f'User not found, id {account_id}')
     account_role = user_model.role
@@ -23,6 +23,7 @@ from oasis.utils.redlock import lock_cluster
 from oasis.utils.sdk import feishu_client
 from oasis.utils.sdk import gringotts_client
 from oasis.utils.sdk import price_client
+from oasis.worker.planner import save_jobs
 from oasis.worker.planner import save_task_graph
 from oasis.worker.tasks import set_job_context
 
@@ -210,7 +211,6 @@ class ClusterView(BaseView):
         if distribution not in DISTRIBUTION_SCHEMAS.get('KHBASE', []):
             raise Exception(f'KHBASE did not support distribution {distribution}')
 
-        # TODO cache
         product_details = await price_client.get_product_details(
             self.account_id, PRODUCT_GROUP_ID_MAP[cluster_type], '1')
         logger.info(self, f'==product_details: {product_details}')
@@ -238,8 +238,6 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
-
         self.context = {
             'product': self.product,
             'region': self.region,
@@ -254,8 +252,6 @@ class ClusterView(BaseView):
             'product_details': product_details,
         }
 
-        await set_job_context(job_id, self.context)
-
         task_send_feishu_init = TaskModel(
             name='TaskSendFeishu',
             args={
@@ -453,8 +449,9 @@ class ClusterView(BaseView):
             task_send_feishu_done: [],
         }
 
-        await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        # Job with its sub jobs, task graphs and context are saved at once
+        job.status = JobModel.STATUS.Doing
+        jobs = [(job, task_graph, self.context)]
 
         eip_line_id = kwargs.get('eip_line_id', None)
         allocation_id = kwargs.get('allocation_id', None)
@@ -464,8 +461,6 @@ class ClusterView(BaseView):
             # Move Create EIP into individual job
             job_1 = JobModel(name='bind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                              parent_job=job_id)
-            await job_1.save()
-            job_1_id = job_1.id
 
             task_eip_send_feishu_init = TaskModel(
                 name='TaskSendFeishu',
@@ -506,7 +501,9 @@ class ClusterView(BaseView):
                 task_allocate_eip: [task_eip_send_feishu_done],
                 task_eip_send_feishu_done: [],
             }
-            await save_task_graph(job_1_id, task_1_graph)
+            jobs.append((job_1, task_1_graph, None))
+
+        await save_jobs(jobs)
 
         return {
             'cluster_id': cluster_id,
@@ -612,7 +609,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -706,13 +703,13 @@ class ClusterView(BaseView):
         task_graph.setdefault(task_send_feishu_done, [])
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         if need_disassociate_eip:
             # Move Unbind EIP into individual job
             job_1 = JobModel(name='unbind_eip', status=JobModel.STATUS.Init, cluster_id=cluster_id,
                              parent_job=job_id)
-            await job_1.save()
+            await job_1.insert()
             job_1_id = job_1.id
 
             task_eip_send_feishu_init = TaskModel(
@@ -774,7 +771,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -832,7 +829,7 @@ class ClusterView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -863,7 +860,7 @@ class ClusterView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -921,7 +918,7 @@ class ClusterView(BaseView):
         }
 
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
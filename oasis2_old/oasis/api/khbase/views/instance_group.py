@@ -73,7 +73,6 @@ class InstanceGroupView(BaseView):
         if charge_type == 'FreeTrial' and purchase_time <= 0:
             raise Exception(f'Can not scale out cluster with purchase_time {purchase_time}')
 
-        # TODO cache
         product_details = await price_client.get_product_details(
             self.account_id, PRODUCT_GROUP_ID_MAP[cluster.cluster_type], '1')
 
@@ -121,7 +120,7 @@ class InstanceGroupView(BaseView):
         if not lock_res:
             raise Exception(f'Cluster has other tasks, please wait...')
 
-        await job.save()
+        await job.insert()
 
         self.context = {
             'product': self.product,
@@ -339,7 +338,7 @@ class InstanceGroupView(BaseView):
             task_send_scale_notification: [],
         }
         await save_task_graph(job_id, task_graph)
-        await job.save({'status': JobModel.STATUS.Doing})
+        await job.update_columns({'status': JobModel.STATUS.Doing})
 
         return {
             'cluster_id': cluster_id,
@@ -1,6 +1,8 @@
 from aiohttp import web
 
 from oasis.api.base.route import BASE_ROUTES
+from oasis.utils.http import http_sessions
+from oasis.utils.remote import ssh_pool
 
 
 class WebService:
@@ -10,6 +12,7 @@ class WebService:
         self.conf = conf
         self.version = self.conf.pop('version', 'v1')
         self.init_route(routes)
+        self.app.on_cleanup.append(self.close_sessions)
 
     def init_route(self, routes):
         # POST Mode
@@ -21,6 +24,11 @@ class WebService:
         #     print(f'/{self.app_name}/{self.version}{route}', handler)
         self.app.add_routes(web_routes)
 
+    @staticmethod
+    async def close_sessions(app):
+        await http_sessions.close()
+        await ssh_pool.close()
+
     def run(self, port=None):
         port = port or int(self.conf.pop('port', 18080))
         web.run_app(self.app,
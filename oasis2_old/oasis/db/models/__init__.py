@@ -1,7 +1,9 @@
+from copy import deepcopy
 from datetime import datetime
 
 from sqlalchemy import Column
 from sqlalchemy import DateTime
+from sqlalchemy import JSON
 from sqlalchemy import String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.future import select
@@ -9,6 +11,7 @@ from sqlalchemy.orm import attributes
 from sqlalchemy.sql import functions
 
 from oasis.db.service import mysql_client
+from oasis.db.service import redis_client
 from oasis.utils.convert import datetime2str
 from oasis.utils.generator import gen_uuid4
 
@@ -38,23 +41,106 @@ class ModelBase(TimestampMixin):
             db_value = await get_model_by_id(self.__class__, self.id)
         if db_value:
             if not values:
-                values = self.to_dict()
+                # Only columns changed on this object
+                values = self.dirty_values()
+                if values:
+                    await mysql_client.update_one(self, values)
+                self._mark_clean()
             else:
                 values = {k: v for k, v in values.items()
                           if hasattr(self.__table__.columns, k)}
-            await mysql_client.update_one(self, values)
+                await mysql_client.update_one(self, values)
+            await self._written()
             res = await get_model_by_id(self.__class__, self.id)
         else:
             res = await mysql_client.insert_one(self)
+            self._mark_clean()
+            await self._written()
         return res
 
+    async def insert(self, reload=False):
+        """Insert this object by one statement, id is generated on client."""
+        self.id = self.id or gen_uuid4()
+        await mysql_client.insert_one(self)
+        self._mark_clean()
+        await self._written()
+        if reload:
+            return await get_model_by_id(self.__class__, self.id)
+        return self
+
+    async def update_columns(self, values=None, reload=False):
+        """Write values, or changed columns if not given, by one UPDATE statement.
+
+        Unlike save(), the row is neither read before nor after the write, values
+        are set on this object. update() is the dict-like setter, it writes nothing.
+        """
+        if values is None:
+            values = self.dirty_values()
+        else:
+            values = {k: v for k, v in values.items()
+                      if hasattr(self.__table__.columns, k)}
+        if values:
+            await mysql_client.update_one(self, values)
+            for k, v in values.items():
+                attributes.set_committed_value(self, k, v)
+            await self._written()
+        if reload:
+            return await get_model_by_id(self.__class__, self.id)
+        return self
+
+    @classmethod
+    async def update_all(cls, ids, values):
+        """Write the same values into rows of ids by one UPDATE statement, rows are not read."""
+        values = {k: v for k, v in values.items()
+                  if hasattr(cls.__table__.columns, k)}
+        if not ids or not values:
+            return
+        await mysql_client.update_all(cls.__table__, list(ids), values)
+        for model_id in ids:
+            model = cls()
+            model.id = model_id
+            await model._written()
+
+    def dirty_values(self):
+        """Columns changed since loaded or last written.
+
+        In-place changes of JSON values could not be tracked, JSON columns
+        are always included.
+        """
+        state = attributes.instance_state(self)
+        values = {}
+        for col in self.__table__.columns:
+            if col.name in state.unloaded:
+                continue
+            if isinstance(col.type, JSON) or state.attrs[col.name].history.has_changes():
+                values[col.name] = getattr(self, col.name)
+        return values
+
+    def _mark_clean(self):
+        state = attributes.instance_state(self)
+        for col in self.__table__.columns:
+            if col.name not in state.unloaded:
+                attributes.set_committed_value(self, col.name, getattr(self, col.name))
+
     async def delete(self, hard=False):
         if hard or not hasattr(self.__table__.columns, 'status'):
-            return await mysql_client.delete_one(self)
+            res = await mysql_client.delete_one(self)
+            await self._written()
+            return res
         values = {
             'status': self.STATE.DELETED,
         }
         await mysql_client.update_one(self, values)
+        await self._written()
+
+    async def aggregate_cluster_id(self):
+        """Cluster whose aggregate (cluster, instance groups, instances, plugins) holds this row."""
+        return None
+
+    async def _written(self):
+        cluster_id = await self.aggregate_cluster_id()
+        if cluster_id:
+            await bump_cluster_version(cluster_id)
 
     def __setitem__(self, key, value):
         setattr(self, key, value)
@@ -82,6 +168,18 @@ class ModelBase(TimestampMixin):
                  if not k[0] == '_'}
         return local.items()
 
+    def to_row(self):
+        """All columns of a new row, python side defaults are applied here,
+        so rows of one table could be inserted by one multi-row insert."""
+        row = {}
+        for col in self.__table__.columns:
+            val = getattr(self, col.name)
+            if val is None and col.default is not None:
+                val = col.default.arg(None) if col.default.is_callable else deepcopy(col.default.arg)
+                setattr(self, col.name, val)
+            row[col.name] = val
+        return row
+
     def to_dict(self, **kwargs):
         """sqlalchemy based automatic to_dict method."""
         d = {}
@@ -199,6 +297,22 @@ async def get_model_by_id(model, model_id, account_id=None):
     return await query.query_one()
 
 
+def _cluster_version_key(cluster_id):
+    return f'/oasis/cluster/version/{cluster_id}'
+
+
+async def bump_cluster_version(cluster_id):
+    """Every write of a cluster aggregate through the model layer bumps its version,
+    cached copies loaded at an older version are stale."""
+    await redis_client.incr(_cluster_version_key(cluster_id))
+
+
+async def get_cluster_version(cluster_id):
+    """Current version of the cluster aggregate, None if it could not be read."""
+    # INCRBY 0 reads the version and creates it as 0 if not bumped yet
+    return await redis_client.incrby(_cluster_version_key(cluster_id), 0)
+
+
 OasisBase = declarative_base(cls=ModelBase)
 
 
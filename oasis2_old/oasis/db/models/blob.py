@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+import time
+
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Text
+from sqlalchemy import cast
+from sqlalchemy import or_
+from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.future import select
+
+from oasis.db.models import OasisBase
+from oasis.db.models import model_query
+from oasis.db.service import mysql_client
+from oasis.utils.blob import BlobStore
+from oasis.utils.blob import REF_FIELD
+from oasis.utils.config import config
+
+# Held by the manager sweeping blobs, for sweep_interval
+BLOB_SWEEP_KEY = '/oasis/blob_sweep/'
+
+
+class BlobModel(OasisBase):
+    """
+    Large JSON values of task args and results, one row per content, see TaskBlobStore.
+    """
+    __tablename__ = 'blob'
+
+    # sha256 of data
+    id = Column(String(64), primary_key=True)
+    data = Column(LONGTEXT)
+
+
+class TaskBlobStore(BlobStore):
+    """
+    Blobs of task args and results, kept in table blob.
+
+    A put of an existing blob writes its updated_at again. Rows no task references any more
+    (results written again, a task write failed after its blobs were put) are deleted by
+    sweep() once they were not put for sweep_grace seconds, so a blob about to be referenced
+    is never deleted.
+
+    [blob]
+    sweep_interval = 86400
+    sweep_grace = 86400
+    sweep_limit = 10000
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sweep_interval = config.getint('blob', 'sweep_interval', fallback=24 * 3600)
+        self.sweep_grace = config.getint('blob', 'sweep_grace', fallback=24 * 3600)
+        self.sweep_limit = config.getint('blob', 'sweep_limit', fallback=10000)
+        self.sweep_page = 500
+        # digest -> monotonic time this process put it, least recently put first
+        self._put_at = OrderedDict()
+
+    async def put_many(self, blobs):
+        # Put by this process within half of the grace, updated_at keeps it from the sweep
+        now = time.monotonic()
+        blobs = {digest: data for digest, data in blobs.items()
+                 if digest not in self._put_at or now - self._put_at[digest] >= self.sweep_grace / 2}
+        if not blobs:
+            return
+        await mysql_client.insert_all([BlobModel(id=digest, data=data) for digest, data in blobs.items()],
+                                      on_duplicate=('updated_at',))
+        for digest, data in blobs.items():
+            self._put_at[digest] = now
+            self._put_at.move_to_end(digest)
+            self._remember(digest, data)
+        while len(self._put_at) > self.cache_size:
+            self._put_at.popitem(last=False)
+
+    async def _fetch(self, digests):
+        rows = await model_query(BlobModel).where(BlobModel.id.in_(digests)).query_all()
+        data = {row.id: row.data for row in rows}
+        return [data.get(digest) for digest in digests]
+
+    async def sweep(self):
+        """
+        Delete up to sweep_limit blobs no task references and not put for sweep_grace seconds.
+
+        :return: count of blobs deleted
+        """
+        # Task model packs its values here
+        from oasis.db.models.task import TaskModel
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.sweep_grace)
+        stale = set(await mysql_client.query_all(
+            select(BlobModel.id).where(BlobModel.updated_at < cutoff).limit(self.sweep_limit)))
+
+        # Only tasks with refs, by pages in id order
+        ref_like = f'%"{REF_FIELD}"%'
+        last_id = ''
+        while stale:
+            tasks = await model_query(TaskModel) \
+                .filter(TaskModel.id > last_id) \
+                .filter(or_(cast(TaskModel.args, Text).like(ref_like), cast(TaskModel.results, Text).like(ref_like))) \
+                .order_by(TaskModel.id) \
+                .query_all(limit=self.sweep_page)
+            for task in tasks:
+                for values in (task.args, task.results):
+                    if isinstance(values, dict):
+                        stale.difference_update(value[REF_FIELD] for value in values.values() if self.is_ref(value))
+            if len(tasks) < self.sweep_page:
+                break
+            last_id = tasks[-1].id
+
+        stale = sorted(stale)
+        for i in range(0, len(stale), self.sweep_page):
+            # Put again since the scan, it is about to be referenced
+            await mysql_client.delete_all(BlobModel.__table__, stale[i:i + self.sweep_page],
+                                          where=BlobModel.updated_at < cutoff)
+        for digest in stale:
+            self._cache.pop(digest, None)
+            self._put_at.pop(digest, None)
+        return len(stale)
+
+
+task_blobs = TaskBlobStore()
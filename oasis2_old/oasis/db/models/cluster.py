@@ -84,3 +84,6 @@ class ClusterModel(OasisBase):
                               'EsPluginModel.status!=4)')
     tags = Column(JSON)
     tag_keys = Column(Text)
+
+    async def aggregate_cluster_id(self):
+        return self.id
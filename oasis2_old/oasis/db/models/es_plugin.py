@@ -59,3 +59,6 @@ class EsPluginModel(OasisBase):
     status = Column(Integer, nullable=False)
     description = Column(Text)
     ks3_address = Column(Text, nullable=False)
+
+    async def aggregate_cluster_id(self):
+        return self.cluster_id
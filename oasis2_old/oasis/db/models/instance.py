@@ -10,9 +10,13 @@ from oasis.db.models import OasisBase
 from oasis.db.models import get_model_by_id
 from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.instance_group import InstanceGroupModel
+from oasis.utils.cache import AsyncCache
 from oasis.utils.config import config
 from oasis.utils.remote import Remote
 
+# Parsed management keys of clusters, and instance group -> cluster, both never change
+_ssh_keys = AsyncCache(ttl=3600, refresh_ahead=0, maxsize=2000, name='ssh keys')
+
 
 class InstanceModel(OasisBase):
     """An OpenStack instance created for the cluster."""
@@ -49,10 +53,27 @@ class InstanceModel(OasisBase):
     allocate_address_id = Column(String(36))
 
     async def remote(self):
-        instance_group_id = self.instance_group_id
-        instance_group = await get_model_by_id(InstanceGroupModel, instance_group_id)
-        cluster_id = instance_group.cluster_id
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
-        pri_key = asyncssh.import_private_key(cluster.management_private_key)
+        cluster_id = await _group_cluster_id(self.instance_group_id)
+
+        async def _load_key():
+            cluster = await get_model_by_id(ClusterModel, cluster_id)
+            return asyncssh.import_private_key(cluster.management_private_key)
+
+        pri_key = await _ssh_keys.get(('cluster', cluster_id), _load_key)
         ssh_port = config.getint('vpc', 'ssh_port')
         return Remote(self.inner_eip, ssh_port, pri_key, instance_name=self.instance_name, cluster_id=cluster_id)
+
+    async def aggregate_cluster_id(self):
+        instance_group_id = self.instance_group_id
+        if not instance_group_id:
+            instance = await get_model_by_id(InstanceModel, self.id)
+            instance_group_id = instance.instance_group_id if instance else None
+        return await _group_cluster_id(instance_group_id) if instance_group_id else None
+
+
+async def _group_cluster_id(instance_group_id):
+    async def _load_cluster_id():
+        instance_group = await get_model_by_id(InstanceGroupModel, instance_group_id)
+        return instance_group.cluster_id
+
+    return await _ssh_keys.get(('instance_group', instance_group_id), _load_cluster_id)
@@ -7,6 +7,7 @@ from sqlalchemy import UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from oasis.db.models import OasisBase
+from oasis.db.models import get_model_by_id
 
 
 class InstanceGroupModel(OasisBase):
@@ -47,3 +48,9 @@ class InstanceGroupModel(OasisBase):
                              lazy='joined',
                              primaryjoin='and_(InstanceGroupModel.id==InstanceModel.instance_group_id, '
                                          'InstanceModel.status!="Deleted")')
+
+    async def aggregate_cluster_id(self):
+        if self.cluster_id:
+            return self.cluster_id
+        instance_group = await get_model_by_id(InstanceGroupModel, self.id)
+        return instance_group.cluster_id if instance_group else None
@@ -25,3 +25,11 @@ class JobModel(OasisBase):
                          cascade='all,delete',
                          backref='job',
                          lazy='joined')
+
+    async def _written(self):
+        await super()._written()
+        if self.status in (self.STATUS.Doing, self.STATUS.Rolling):
+            # Managers advance the job at once instead of at the next sweep
+            from oasis.worker.events import EVENT
+            from oasis.worker.events import publish_job_event
+            await publish_job_event(EVENT.JobStarted, self.id, cluster_id=self.cluster_id)
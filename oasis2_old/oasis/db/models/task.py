@@ -6,6 +6,7 @@ from sqlalchemy import String
 from sqlalchemy import Text
 
 from oasis.db.models import OasisBase
+from oasis.db.models.blob import task_blobs
 
 
 class TaskModel(OasisBase):
@@ -22,8 +23,8 @@ class TaskModel(OasisBase):
 
     class TYPE:
         """
-        For now, different type of tasks will not send to different workers
-        This is prepared for the future
+        Tasks are routed to stream of their type, see gen_task_stream
+        Workers subscribe to the types they serve, see launch_worker.py
         wuhsh
         """
 
@@ -38,7 +39,35 @@ class TaskModel(OasisBase):
     type = Column(String(10), default=TYPE.ALL)
     job_id = Column(String(36), ForeignKey('job.id', ondelete='CASCADE'))
     next_tasks: list = Column(JSON)
+    # Values larger than [blob] inline_limit are refs into table blob, see pack() and load_args()
     args: dict = Column(JSON, default={})
     results: dict = Column(JSON, default={})
     rollback_on_fail = Column(Boolean, default=0)
     info = Column(Text)
+
+    @staticmethod
+    async def pack(values):
+        """
+        Args or results to write into a task row, large values are put into table blob and referenced.
+        """
+        return await task_blobs.save(values)
+
+    @staticmethod
+    async def pack_all(tasks):
+        """
+        Pack args of new tasks, blobs of all of them are put by one insert.
+        """
+        blobs = {}
+        for task in tasks:
+            task.args, args_blobs = task_blobs.pack(task.args)
+            blobs.update(args_blobs)
+        await task_blobs.put_many(blobs)
+
+    async def load_args(self):
+        """
+        Args with referenced values resolved, they are read only when the task runs.
+        """
+        return await task_blobs.unpack(self.args)
+
+    async def load_results(self):
+        return await task_blobs.unpack(self.results)
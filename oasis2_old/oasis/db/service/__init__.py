@@ -11,3 +11,11 @@ mysql_client = MysqlClient(**_mysql_conf)
 
 mq_client = RedisClient(**_redis_conf)
 competition_mq = CMPTMQ(mq_client)
+
+
+def new_blocking_client():
+    """
+    Dedicated connection for blocking stream reads,
+    blocked reads should not hold connections of the shared pool.
+    """
+    return RedisClient(**dict(_redis_conf, maxsize=1))
@@ -34,6 +34,16 @@ class CMPTMQ:
         while True:
             yield await self.pool.xread([stream_id])
 
+    async def xread_from(self, *, stream_id, latest_id='$', count=None, timeout=None, pool=None):
+        pool = pool or self.pool
+        messages = await pool.xread([stream_id], timeout=timeout or 0,
+                                         count=count, latest_ids=[latest_id])
+        if not messages:
+            return
+
+        for m in messages:
+            yield m
+
     async def xgroup_create(self, stream_id, group, last_id='$', mk_stream=False):
         return await self.pool.execute('XGROUP', 'create', stream_id, group, last_id,
                                        'MKSTREAM' if mk_stream else '')
@@ -45,10 +55,13 @@ class CMPTMQ:
         return await self.pool.execute('XGROUP', 'DELCONSUMER', stream_id, group, consumer)
 
     async def xread_group(self, *, stream_id, group, consumer, latest_ids='>',
-                          count=None, timeout=None):
+                          count=None, timeout=None, pool=None):
         # while True:
-        messages = await self.pool.xread_group(group, consumer, [stream_id],
-                                               latest_ids=[latest_ids], count=count,
+        # stream_id could be a list, count is applied to every stream
+        stream_ids = list(stream_id) if isinstance(stream_id, (list, tuple)) else [stream_id]
+        pool = pool or self.pool
+        messages = await pool.xread_group(group, consumer, stream_ids,
+                                               latest_ids=[latest_ids] * len(stream_ids), count=count,
                                                timeout=timeout)
         if not messages:
             return
@@ -56,12 +69,42 @@ class CMPTMQ:
         for m in messages:
             yield m
 
-    async def xadd(self, stream_id, fields):
-        return await self.pool.xadd(stream_id, fields)
+    async def xadd(self, stream_id, fields, max_len=None):
+        return await self.pool.xadd(stream_id, fields, max_len=max_len)
+
+    async def xadd_many(self, messages, max_len=None):
+        """
+        Add [(stream_id, fields), ...] in order by one pipelined round trip.
+        Return message ids, or the exception of every message not added.
+        """
+        redis = await self.pool._get_pool()
+        pipe = redis.pipeline()
+        for stream_id, fields in messages:
+            pipe.xadd(stream_id, fields, max_len=max_len)
+        return await pipe.execute(return_exceptions=True)
 
     async def xack(self, stream_id, group, *ids):
         return await self.pool.xack(stream_id, group, *ids)
 
+    async def xpending(self, stream_id, group, count=100, consumer=None):
+        """
+        Return [(msg_id, consumer, idle_ms, delivery_count), ...]
+        """
+        return await self.pool.xpending(stream_id, group, start='-', stop='+',
+                                        count=count, consumer=consumer) or []
+
+    async def xclaim(self, stream_id, group, consumer, min_idle_time, *ids):
+        """
+        Return [(msg_id, fields), ...], fields is None if message already trimmed
+        """
+        return await self.pool.xclaim(stream_id, group, consumer, min_idle_time, *ids) or []
+
+    async def xrange_one(self, stream_id, msg_id):
+        messages = await self.pool.xrange(stream_id, start=msg_id, stop=msg_id, count=1)
+        if not messages:
+            return None
+        return messages[0][1]
+
     async def xdel(self, stream_id, msg_id):
         return await self.pool.execute('XDEL', stream_id, msg_id)
 
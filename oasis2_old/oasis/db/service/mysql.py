@@ -1,13 +1,25 @@
 import asyncio
+from contextvars import ContextVar
 
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 
 from oasis.utils.logger import logger
 
+# Counter of statements run by the current worker task, see oasis.worker.snapshot
+query_counter = ContextVar('query_counter', default=None)
+
+
+def _count_query():
+    counter = query_counter.get()
+    if counter is not None:
+        counter['queries'] += 1
+
 
 def get_conn(func):
     async def _inner(self, *args, **kwargs):
+        _count_query()
         pool = await self._get_pool()
         async with pool.begin() as conn:
             return await func(self, conn=conn, *args, **kwargs)
@@ -17,6 +29,7 @@ def get_conn(func):
 
 def get_session(func):
     async def _inner(self, *args, **kwargs):
+        _count_query()
         pool = await self._get_pool()
         try:
             async with AsyncSession(pool) as session:
@@ -80,6 +93,27 @@ class MysqlClient:
         model.id = res.inserted_primary_key[0]
         return model
 
+    @get_conn
+    async def insert_all(self, models, conn, ignore=False, on_duplicate=None):
+        """
+        Insert new models in one transaction, models of one table by one multi-row insert.
+        Primary keys should be generated by caller, they are not read back.
+        Rows whose primary key exists are skipped if ignore, or get the inserted values
+        of on_duplicate columns.
+        """
+        tables = {}
+        for model in models:
+            tables.setdefault(model.__table__, []).append(model.to_row())
+        # Tables are inserted in order of first appearance, parents first
+        for table, rows in tables.items():
+            if on_duplicate:
+                insert = mysql_insert(table)
+                insert = insert.on_duplicate_key_update(**{col: insert.inserted[col] for col in on_duplicate})
+            else:
+                insert = table.insert().prefix_with('IGNORE') if ignore else table.insert()
+            await conn.execute(insert, rows)
+        return models
+
     @get_conn
     async def update_one(self, model, values, conn):
         model_id = model.id
@@ -88,6 +122,23 @@ class MysqlClient:
                            .values(**values))
         return model
 
+    @get_conn
+    async def update_all(self, table, ids, values, conn):
+        """
+        Write the same values into rows of ids by one UPDATE ... WHERE id IN (...).
+        """
+        await conn.execute(table.update()
+                           .where(table.c.id.in_(ids))
+                           .values(**values))
+
+    @get_conn
+    async def delete_all(self, table, ids, conn, where=None):
+        """
+        Delete rows of ids by one DELETE ... WHERE id IN (...), only those matching where if given.
+        """
+        delete = table.delete().where(table.c.id.in_(ids))
+        await conn.execute(delete if where is None else delete.where(where))
+
     @get_conn
     async def delete_one(self, model, conn):
         await conn.execute(model.__table__.delete()
@@ -0,0 +1,221 @@
+from collections import OrderedDict
+import hashlib
+import json
+import re
+
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+
+BLOB_PREFIX = '/oasis/blob/'
+BLOB_HOLDERS_PREFIX = '/oasis/blob/holders/'
+REF_FIELD = '$blob'
+
+# KEYS - blob key and holders key of every blob, ARGV[1] - holder
+# Return count of blobs missing
+HOLD_SCRIPT = """
+    local missing = 0
+    for i = 1, #KEYS, 2 do
+        if redis.call('PERSIST', KEYS[i]) == 0 and redis.call('EXISTS', KEYS[i]) == 0 then
+            missing = missing + 1
+        end
+        redis.call('SADD', KEYS[i + 1], ARGV[1])
+    end
+    return missing"""
+
+# Same KEYS and ARGV as HOLD_SCRIPT, ARGV[2] - ttl of blobs no one holds any more
+RELEASE_SCRIPT = """
+    for i = 1, #KEYS, 2 do
+        redis.call('SREM', KEYS[i + 1], ARGV[1])
+        if redis.call('SCARD', KEYS[i + 1]) == 0 then
+            redis.call('EXPIRE', KEYS[i], ARGV[2])
+        end
+    end
+    return 1"""
+
+
+class BlobStore:
+    """
+    Large immutable JSON values stored once in redis, keyed by the sha256 of their JSON.
+
+    Where such a value is kept (e.g. the job context) it is replaced by a small ref
+    {'$blob': digest}, the same value written by many jobs is stored once. A blob expires
+    ttl seconds after its last write, unless it is held: holders (e.g. job ids of contexts
+    referencing it) are kept in a set next to the blob, a held blob never expires and
+    gets its ttl again when the last holder releases it. Blobs never change, resolved
+    ones are kept in process. Subclasses keep blobs elsewhere by overriding put_many()
+    and _fetch(), holding is for blobs in redis only.
+
+        data, blob = blob_store.dumps(value)
+        if blob:
+            await blob_store.put(*blob)
+        value = (await blob_store.loads_many([data]))[0]
+
+        packed = await blob_store.save({'product_details': {...}})
+        values = await blob_store.unpack(packed)
+
+    [blob]
+    inline_limit = 4096
+    ttl = 2592000
+    cache_size = 256
+    """
+
+    def __init__(self):
+        self.inline_limit = config.getint('blob', 'inline_limit', fallback=4096)
+        self.ttl = config.getint('blob', 'ttl', fallback=30 * 24 * 3600)
+        self.cache_size = config.getint('blob', 'cache_size', fallback=256)
+        # digest -> JSON, least recently used first
+        self._cache = OrderedDict()
+        self._script_sha1 = {}
+
+    @staticmethod
+    def is_ref(value):
+        return isinstance(value, dict) and len(value) == 1 and REF_FIELD in value
+
+    def dumps(self, value):
+        """
+        JSON of value, or of a ref to it when larger than inline_limit.
+
+        :return: (JSON, (digest, JSON of value) to put, or None when value is inline)
+        """
+        data = json.dumps(value)
+        if len(data) <= self.inline_limit or self.is_ref(value):
+            return data, None
+        digest = hashlib.sha256(data.encode()).hexdigest()
+        return json.dumps({REF_FIELD: digest}), (digest, data)
+
+    def refs(self, values):
+        """
+        Digests referenced by JSON values written by dumps().
+        """
+        digests = []
+        for data in values:
+            # Only a ref starts like that, skip parsing inline values
+            if data.startswith(f'{{"{REF_FIELD}"'):
+                value = json.loads(data)
+                if self.is_ref(value):
+                    digests.append(value[REF_FIELD])
+        return digests
+
+    def pack(self, values):
+        """
+        Replace values of a dict larger than inline_limit by refs.
+
+        :return: (packed dict, {digest: JSON} to put)
+        """
+        if not values or not isinstance(values, dict):
+            return values, {}
+        packed, blobs = {}, {}
+        for k, v in values.items():
+            data, blob = self.dumps(v)
+            if blob:
+                digest, blobs[digest] = blob
+                packed[k] = {REF_FIELD: digest}
+            else:
+                packed[k] = v
+        return packed, blobs
+
+    async def save(self, values):
+        """
+        Pack a dict and put its blobs, return the packed dict.
+        """
+        packed, blobs = self.pack(values)
+        await self.put_many(blobs)
+        return packed
+
+    async def unpack(self, values):
+        """
+        Resolve the refs of a packed dict, with one fetch of the blobs not cached.
+        """
+        if not values or not isinstance(values, dict):
+            return values
+        refs = {k: v[REF_FIELD] for k, v in values.items() if self.is_ref(v)}
+        if not refs:
+            return values
+        blobs = await self.get_many(list(refs.values()))
+        return dict(values, **{k: json.loads(blobs[digest]) for k, digest in refs.items()})
+
+    async def put(self, digest, data):
+        await self.put_many({digest: data})
+
+    async def put_many(self, blobs):
+        for digest, data in blobs.items():
+            key = f'{BLOB_PREFIX}{digest}'
+            # Content addressed, an existing blob only has to live longer
+            if not await redis_client.set(key, data, expire=self.ttl, exist='SET_IF_NOT_EXIST') \
+                    and not await redis_client.expire(key, self.ttl):
+                raise Exception(f'Put blob {digest} failed')
+            self._remember(digest, data)
+
+    async def _eval(self, script, digests, *args):
+        keys = []
+        for digest in sorted(set(digests)):
+            keys.extend([f'{BLOB_PREFIX}{digest}', f'{BLOB_HOLDERS_PREFIX}{digest}'])
+        # Loaded again if redis lost it
+        for _ in range(2):
+            if script not in self._script_sha1:
+                self._script_sha1[script] = await redis_client.script_load(
+                    re.sub(r'^\s+', '', script, flags=re.M).strip())
+            res = await redis_client.evalsha(self._script_sha1[script], keys=keys, args=list(args))
+            if res is not None:
+                return res
+            self._script_sha1.pop(script, None)
+        raise Exception(f'Run blob script failed, blobs {digests}')
+
+    async def hold(self, holder, digests):
+        """
+        Keep blobs from expiring until holder releases them, raise if any blob is missing.
+        """
+        if not digests:
+            return
+        missing = await self._eval(HOLD_SCRIPT, digests, holder)
+        if missing:
+            raise Exception(f'Hold blobs {digests} by {holder} failed, {missing} not found')
+
+    async def release(self, holder, digests):
+        """
+        Blobs no one holds any more expire ttl seconds later.
+        """
+        if digests:
+            await self._eval(RELEASE_SCRIPT, digests, holder, self.ttl)
+
+    async def _fetch(self, digests):
+        """
+        :return: JSON of every digest, None if missing
+        """
+        return await redis_client.mget(*[f'{BLOB_PREFIX}{digest}' for digest in digests]) or [None] * len(digests)
+
+    async def get_many(self, digests):
+        """
+        :return: {digest: JSON}, raise if any blob is missing
+        """
+        blobs = {digest: self._cache[digest] for digest in digests if digest in self._cache}
+        for digest in blobs:
+            self._cache.move_to_end(digest)
+        missing = [digest for digest in set(digests) if digest not in blobs]
+        if missing:
+            for digest, data in zip(missing, await self._fetch(missing)):
+                if data is None:
+                    raise Exception(f'Blob {digest} not found')
+                self._remember(digest, data)
+                blobs[digest] = data
+        return blobs
+
+    async def loads_many(self, values):
+        """
+        Decode JSON values written by dumps(), resolving refs with one fetch.
+        """
+        values = [json.loads(data) for data in values]
+        digests = [value[REF_FIELD] for value in values if self.is_ref(value)]
+        if not digests:
+            return values
+        blobs = await self.get_many(digests)
+        return [json.loads(blobs[value[REF_FIELD]]) if self.is_ref(value) else value for value in values]
+
+    def _remember(self, digest, data):
+        self._cache[digest] = data
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+blob_store = BlobStore()
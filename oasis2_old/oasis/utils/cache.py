@@ -0,0 +1,84 @@
+import asyncio
+from collections import OrderedDict
+import time
+
+from oasis.utils.logger import logger
+
+
+class AsyncCache:
+    """
+    In-process cache of async loaders.
+
+    TTL:           entries older than ttl seconds are loaded again.
+    Refresh ahead: entries older than ttl * refresh_ahead are returned at once and
+                   reloaded in background, so hot keys never block on the loader.
+    Single flight: concurrent misses of one key share one loader call.
+    LRU:           least recently used entries are dropped beyond maxsize (0 unlimited).
+
+        cache = AsyncCache(ttl=300)
+        value = await cache.get(key, lambda: load(key))
+    """
+
+    def __init__(self, ttl, refresh_ahead=0.8, maxsize=0, name='cache'):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.maxsize = maxsize
+        self.name = name
+        # key -> (loaded_at, value)
+        self._entries = OrderedDict()
+        # key -> future of the running loader
+        self._loading = {}
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+
+    async def get(self, key, loader, fresh=False):
+        """
+        :param loader: coroutine function without args, falsy results are returned but not cached
+        :param fresh: skip the cached entry, still shares the running loader
+        """
+        entry = None if fresh else self._entries.get(key)
+        if entry:
+            loaded_at, value = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                self._entries.move_to_end(key)
+                if self.refresh_ahead and age >= self.ttl * self.refresh_ahead and key not in self._loading:
+                    self.stats['refreshes'] += 1
+                    self._load(key, loader).add_done_callback(self._log_refresh_error)
+                return value
+
+        self.stats['misses'] += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader):
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run_loader(key, loader))
+            self._loading[key] = future
+        return future
+
+    async def _run_loader(self, key, loader):
+        try:
+            value = await loader()
+            if value:
+                self.set(key, value)
+            return value
+        finally:
+            self._loading.pop(key, None)
+
+    def _log_refresh_error(self, future):
+        if not future.cancelled() and future.exception():
+            # Keep serving the cached entry until it expires
+            logger.error(f'Refresh {self.name} failed, Error: {future.exception()}')
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        if self.maxsize and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
@@ -0,0 +1,62 @@
+import json
+import re
+
+
+class DiskLayout:
+    """
+    Block devices, mounts and fstab of a node, collected by one remote call of PROBE_CMD.
+
+        _, stdout = await conn.execute(DiskLayout.PROBE_CMD)
+        layout = DiskLayout.parse(stdout)
+    """
+
+    MARKER = '@@OASIS_DISK'
+    # lsblk of old util-linux (CentOS 7) has no -J, fall back to key="value" pairs
+    PROBE_CMD = (f'cat /proc/partitions; echo {MARKER}; cat /proc/mounts; echo {MARKER}; cat /etc/fstab; '
+                 f'echo; echo {MARKER}; lsblk -J -p -o NAME,FSTYPE 2>/dev/null || lsblk -P -p -o NAME,FSTYPE')
+
+    def __init__(self, partitions, mounts, fstab, fstypes):
+        # ['vda', 'vda1', 'vdb']
+        self.partitions = partitions
+        # [(device, mount point)]
+        self.mounts = mounts
+        # lines of /etc/fstab
+        self.fstab = fstab
+        # device -> file system type or None
+        self.fstypes = fstypes
+
+    @classmethod
+    def parse(cls, stdout):
+        sections = (stdout + '\n').split(f'{cls.MARKER}\n')
+        if len(sections) != 4:
+            raise Exception(f'Unexpected disk layout: {stdout}')
+        partitions_out, mounts_out, fstab_out, lsblk_out = sections
+
+        partitions = [line.split()[3] for line in partitions_out.splitlines()[1:] if len(line.split()) == 4]
+        mounts = [tuple(line.split()[:2]) for line in mounts_out.splitlines() if len(line.split()) >= 2]
+        # Drop the newline echoed after a fstab without one at the end
+        fstab = fstab_out.rstrip('\n').splitlines()
+
+        fstypes = {}
+        lsblk_out = lsblk_out.strip()
+        if lsblk_out.startswith('{'):
+            devices = json.loads(lsblk_out).get('blockdevices', [])
+            while devices:
+                device = devices.pop()
+                fstypes[device['name']] = device.get('fstype')
+                devices.extend(device.get('children', []))
+        else:
+            for line in lsblk_out.splitlines():
+                values = dict(re.findall(r'(\w+)="([^"]*)"', line))
+                if 'NAME' in values:
+                    fstypes[values['NAME']] = values.get('FSTYPE') or None
+        return cls(partitions, mounts, fstab, fstypes)
+
+    def mount_point(self, device):
+        """
+        Mount point of device, or of a partition of it, None when not mounted.
+        """
+        for source, mount_point in self.mounts:
+            if source.startswith(device):
+                return mount_point
+        return None
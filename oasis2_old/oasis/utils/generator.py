@@ -33,6 +33,15 @@ def gen_request_lock(request_id, action):
     return f'/oasis/lock/request/{action}/{request_id}'
 
 
+def gen_task_stream(stream, task_type=None, lane=None):
+    # Untyped tasks of normal priority stay on the default stream
+    if task_type and task_type != 'all':
+        stream = f'{stream}_{task_type}'
+    if lane and lane != 'normal':
+        stream = f'{stream}_{lane}'
+    return stream
+
+
 def sign(key, msg):
     return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
 
@@ -1,30 +1,47 @@
+import bisect
 import hashlib
 
 
 class HashRing:
-    def __init__(self, nodes, n_num=3):
-        self.hash_dict = {}
+    def __init__(self, nodes=None, n_num=3):
+        """
+        :param nodes: initial nodes
+        :param n_num: virtual nodes per node, more virtual nodes spread keys more evenly
+        """
         self.n_num = n_num
-        for node in nodes:
+        self.hash_dict = {}
+        self._keys = []
+        for node in nodes or []:
             self.add_node(node)
 
+    @staticmethod
+    def _hash(key):
+        return hashlib.md5(key.encode('utf8')).hexdigest()
+
+    @property
+    def nodes(self):
+        return set(self.hash_dict.values())
+
     def add_node(self, *nodes):
         for node in nodes:
             for i in range(self.n_num):
-                key = hashlib.md5(f'{node}-{i}'.encode('utf8')).hexdigest()
-                self.hash_dict.setdefault(key, node)
-        self.hash_dict = {k: self.hash_dict.get(k) for k in sorted(self.hash_dict.keys())}
+                key = self._hash(f'{node}-{i}')
+                if key in self.hash_dict:
+                    continue
+                self.hash_dict[key] = node
+                bisect.insort(self._keys, key)
 
     def remove_node(self, node):
         rm_keys = [k for k, v in self.hash_dict.items() if v == node]
         for rm_key in rm_keys:
             self.hash_dict.pop(rm_key)
+        self._keys = sorted(self.hash_dict.keys())
 
     def get_node(self, job_id):
-        get_key = hashlib.md5(job_id.encode('utf8')).hexdigest()
-        default_k = None
-        for k in self.hash_dict.keys():
-            if get_key <= k:
-                return self.hash_dict.get(k)
-            default_k = k
-        return self.hash_dict.get(default_k)
+        if not self._keys:
+            return None
+        get_key = self._hash(job_id)
+        index = bisect.bisect_left(self._keys, get_key)
+        if index == len(self._keys):
+            index = 0
+        return self.hash_dict.get(self._keys[index])
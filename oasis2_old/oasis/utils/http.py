@@ -1,32 +1,277 @@
+import asyncio
 from asyncio import sleep
 import json
+import random
+import time
+from urllib.parse import urlsplit
 
 import aiohttp
 
+from oasis.db.service import redis_client
+from oasis.utils.config import config
 from oasis.utils.generator import gen_aws_auth_header
 from oasis.utils.logger import logger
 
 
+class SessionRegistry:
+    """
+    Long lived client sessions, one per upstream host, so connections, TLS sessions
+    and DNS results are reused between requests.
+
+    [http]
+    limit = 100              # connections of all hosts of one session, 0 unlimited
+    limit_per_host = 20
+    keepalive_timeout = 30   # seconds an idle connection is kept
+    dns_ttl = 300            # seconds DNS results are cached
+    timeout = 300            # default total timeout of a request
+    connect_timeout = 10
+    timeouts = kec.api.ksyun.com:60, iam.api.ksyun.com:10    # total timeout per host
+
+    Daemons should call close() on shutdown.
+    """
+
+    def __init__(self):
+        self.limit = config.getint('http', 'limit', fallback=100)
+        self.limit_per_host = config.getint('http', 'limit_per_host', fallback=20)
+        self.keepalive_timeout = config.getfloat('http', 'keepalive_timeout', fallback=30)
+        self.dns_ttl = config.getint('http', 'dns_ttl', fallback=300)
+        self.timeout = config.getfloat('http', 'timeout', fallback=300)
+        self.connect_timeout = config.getfloat('http', 'connect_timeout', fallback=10)
+        timeouts = config.get('http', 'timeouts', fallback='')
+        items = [item.rsplit(':', 1) for item in timeouts.split(',') if ':' in item]
+        self.host_timeouts = {host.strip(): float(timeout) for host, timeout in items}
+        # host -> (loop, session)
+        self._sessions = {}
+
+    def _new_session(self, host):
+        connector = aiohttp.TCPConnector(limit=self.limit,
+                                         limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout,
+                                         use_dns_cache=True,
+                                         ttl_dns_cache=self.dns_ttl)
+        timeout = aiohttp.ClientTimeout(total=self.host_timeouts.get(host, self.timeout),
+                                        sock_connect=self.connect_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def get(self, url):
+        host = urlsplit(url).hostname or ''
+        loop = asyncio.get_event_loop()
+        session_loop, session = self._sessions.get(host, (None, None))
+        # Sessions are bound to the loop which created them, e.g. cli runs a loop per command
+        if session is None or session.closed or session_loop is not loop:
+            session = self._new_session(host)
+            self._sessions[host] = (loop, session)
+            logger.debug(f'New http session of host {host}')
+        return session
+
+    async def close(self):
+        loop = asyncio.get_event_loop()
+        sessions, self._sessions = self._sessions, {}
+        for session_loop, session in sessions.values():
+            # Sessions of closed loops are gone with their loop
+            if session_loop is loop and not session.closed:
+                await session.close()
+        # Let connections close gracefully, see aiohttp docs of graceful shutdown
+        await sleep(0.25)
+
+
+http_sessions = SessionRegistry()
+
+
 def _get_session(func):
     async def _inner(*args, **kwargs):
-        async with aiohttp.ClientSession() as session:
-            return await func(session=session, *args, **kwargs)
+        session = http_sessions.get(args[0])
+        return await func(session=session, *args, **kwargs)
 
     return _inner
 
 
+class CircuitOpenError(Exception):
+    pass
+
+
+# Connection refused / reset, DNS failure, timeout, worth another try
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+# Retry statuses are retried for these methods only, unless the call passes idempotent=True.
+# A 502 / 504 may come after the upstream handled the request, e.g. created an order.
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+class RetryPolicy:
+    """
+    Retry and circuit breaker state of one upstream host.
+
+    Statuses: retry_statuses are retried for GET / HEAD, or calls passing idempotent=True,
+              other methods get the response back at once.
+    Backoff:  full jitter exponential, random(0, min(backoff_cap, backoff_base * 2 ** attempt)).
+    Budget:   token bucket, every retry takes a token, tokens come back with time
+              (retry_budget_rate per second) and requests (retry_budget_ratio per request),
+              so retries could not multiply load on an upstream which is already failing.
+    Breaker:  opens after breaker_failures failures in a row, requests fail fast while open,
+              one probe request is let through after breaker_reset seconds (half open),
+              and its result closes or opens the breaker again.
+
+    Settings are read from [http:<host>] then [http].
+    """
+
+    class STATE:
+        CLOSED = 'closed'
+        OPEN = 'open'
+        HALF_OPEN = 'half_open'
+
+    def __init__(self, host):
+        self.host = host
+
+        def _get(key, fallback):
+            return config.get(f'http:{host}', key, fallback=config.get('http', key, fallback=fallback))
+
+        self.retry_times = int(_get('retry_times', 3))
+        self.backoff_base = float(_get('backoff_base', 1))
+        self.backoff_cap = float(_get('backoff_cap', 30))
+        self.retry_statuses = {int(status) for status in str(_get('retry_statuses', '429, 502, 503, 504')).split(',')
+                               if status.strip()}
+        self.budget = float(_get('retry_budget', 10))
+        self.budget_rate = float(_get('retry_budget_rate', 0.5))
+        self.budget_ratio = float(_get('retry_budget_ratio', 0.1))
+        self.failure_threshold = int(_get('breaker_failures', 5))
+        self.reset_timeout = float(_get('breaker_reset', 30))
+
+        self.tokens = self.budget
+        self._refilled_at = time.monotonic()
+        self.state = self.STATE.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'budget_exhausted': 0}
+
+    def backoff(self, attempt, cap=None):
+        cap = self.backoff_cap if cap is None else cap
+        return random.uniform(0, min(cap, self.backoff_base * 2 ** attempt))
+
+    def allow_request(self):
+        if self.state == self.STATE.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.stats['rejected'] += 1
+                return False
+            self._transition(self.STATE.HALF_OPEN)
+        if self.state == self.STATE.HALF_OPEN:
+            if self._probing:
+                self.stats['rejected'] += 1
+                return False
+            self._probing = True
+
+        self.stats['requests'] += 1
+        self.tokens = min(self.budget, self.tokens + self.budget_ratio)
+        return True
+
+    def acquire_retry(self):
+        now = time.monotonic()
+        self.tokens = min(self.budget, self.tokens + (now - self._refilled_at) * self.budget_rate)
+        self._refilled_at = now
+        if self.tokens < 1:
+            self.stats['budget_exhausted'] += 1
+            return False
+        self.tokens -= 1
+        self.stats['retries'] += 1
+        return True
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        if self.state != self.STATE.CLOSED:
+            self._transition(self.STATE.CLOSED)
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        self.stats['failures'] += 1
+        if self.state == self.STATE.HALF_OPEN or \
+                (self.state == self.STATE.CLOSED and self.failures >= self.failure_threshold):
+            self._transition(self.STATE.OPEN)
+
+    def record_other(self):
+        """
+        Request failed by itself, e.g. invalid url, tells nothing about the upstream.
+        """
+        self._probing = False
+
+    def _transition(self, state):
+        logger.error(f'Circuit breaker of {self.host}: {self.state} -> {state}, failures {self.failures}')
+        self.state = state
+        self.opened_at = time.monotonic() if state == self.STATE.OPEN else self.opened_at
+        try:
+            asyncio.ensure_future(self._publish())
+        except RuntimeError:
+            # No running loop
+            pass
+
+    async def _publish(self):
+        # Breakers live in every daemon process, keep the latest state of every host for monitoring
+        try:
+            await redis_client.hset(BREAKERS_KEY, self.host, json.dumps(self.describe()))
+        except Exception as e:
+            logger.error(f'Publish circuit breaker state of {self.host} failed, Error: {e}')
+
+    def describe(self):
+        return {
+            'host': self.host,
+            'state': self.state,
+            'failures': self.failures,
+            'open_seconds': round(time.monotonic() - self.opened_at, 1)
+            if self.state != self.STATE.CLOSED and self.opened_at else 0,
+            'retry_tokens': round(self.tokens, 2),
+            'updated_at': time.time(),
+            **self.stats,
+        }
+
+
+class RetryPolicies:
+    def __init__(self):
+        # host -> RetryPolicy
+        self._policies = {}
+
+    def get(self, url):
+        host = urlsplit(url).hostname or ''
+        if host not in self._policies:
+            self._policies[host] = RetryPolicy(host)
+        return self._policies[host]
+
+    def describe(self):
+        """
+        Breaker states of this process.
+        """
+        return [policy.describe() for policy in self._policies.values()]
+
+
+retry_policies = RetryPolicies()
+BREAKERS_KEY = '/oasis/http/breakers/'
+
+
+async def get_breaker_states():
+    """
+    Latest breaker states of all daemons, {host: state dict}.
+    """
+    states = await redis_client.hgetall(BREAKERS_KEY) or {}
+    return {host: json.loads(state) for host, state in states.items()}
+
+
 def retry(func):
     async def _inner(*args, **kwargs):
-        retry_times = kwargs.pop('retry_times', 3)
+        url = args[0]
+        policy = retry_policies.get(url)
+        retry_times = kwargs.pop('retry_times', policy.retry_times)
         if type(retry_times) is not int or retry_times < 0:
             raise Exception(f'Error retry_times, got {retry_times}')
-        interval = kwargs.pop('interval', 30)
+        # Max seconds between two attempts
+        interval = kwargs.pop('interval', None)
 
         headers = kwargs.get('headers', {})
         aws_headers = kwargs.get('aws_headers', {})
         params = kwargs.get('params', {})
         data = kwargs.get('data', {})
         method = func.__name__.upper()
+        idempotent = kwargs.pop('idempotent', method in IDEMPOTENT_METHODS)
 
         if aws_headers:
             aws_header = gen_aws_auth_header(method=method, params=params, **aws_headers)
@@ -40,19 +285,52 @@ def retry(func):
             data_str = str(data).replace('\'', '"')
             kwargs_str += f' -d \'{data_str}\''
 
-        url = args[0]
+        ret = None
+        attempts = 0
         for i in range(retry_times):
+            if not policy.allow_request():
+                raise CircuitOpenError(f'Circuit breaker of {policy.host} is open, '
+                                       f'fail fast. {method} {url}{kwargs_str}.')
+            attempts += 1
             try:
                 logger.info(f'Request send. {method} {url}{kwargs_str}.')
                 ret = await func(*args, **kwargs)
-                logger.info(f'Request back. {method} {url}{kwargs_str}. Return {ret}.')
-                return ret
-            except Exception as e:
-                logger.error(f'Request failed, retry {i + 1}/{retry_times}. {method} {url}{kwargs_str}. Error: {e}')
-                if i < retry_times - 1:
-                    await sleep(interval)
-
-        raise Exception(f'Request failed {retry_times} times. {method} {url}{kwargs_str}.')
+            except RETRYABLE_EXCEPTIONS as e:
+                # Response of an earlier attempt is stale now
+                ret = None
+                policy.record_failure()
+                logger.error(f'Request failed, retry {i + 1}/{retry_times}. {method} {url}{kwargs_str}. '
+                             f'Error: {type(e).__name__} {e}')
+            except BaseException:
+                # Cancelled too, the half open probe must not stay taken
+                policy.record_other()
+                raise
+            else:
+                status = ret[0] if type(ret) is tuple else None
+                if status not in policy.retry_statuses:
+                    policy.record_success()
+                    logger.info(f'Request back. {method} {url}{kwargs_str}. Return {ret}.')
+                    return ret
+                policy.record_failure()
+                if not idempotent:
+                    # Upstream may have handled it, sending it again could duplicate e.g. an order
+                    logger.error(f'Request back with status {status}, not retried, {method} is not idempotent. '
+                                 f'{method} {url}{kwargs_str}. Return {ret}.')
+                    return ret
+                logger.error(f'Request back with status {status}, retry {i + 1}/{retry_times}. '
+                             f'{method} {url}{kwargs_str}. Return {ret}.')
+
+            if i == retry_times - 1:
+                break
+            if not policy.acquire_retry():
+                logger.error(f'Retry budget of {policy.host} exhausted. {method} {url}{kwargs_str}.')
+                break
+            await sleep(policy.backoff(i, interval))
+
+        if ret is not None:
+            # Retryable status, let caller handle the response as before
+            return ret
+        raise Exception(f'Request failed {attempts} times. {method} {url}{kwargs_str}.')
 
     return _inner
 
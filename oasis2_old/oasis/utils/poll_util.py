@@ -4,6 +4,7 @@ def wait_until_complete(timeout=600, interval=10):
             from asyncio import sleep
             from datetime import datetime
             from oasis.utils.logger import logger
+            from oasis.worker.lease import report_progress
             start_time = datetime.now()
 
             duration = 0
@@ -22,6 +23,7 @@ def wait_until_complete(timeout=600, interval=10):
                     f'Args: {args}, Kwargs: {kwargs}.')
                 await sleep(interval)
                 duration = int((datetime.now() - start_time).total_seconds())
+                report_progress(f'Wait {func.__name__}, {duration} / {timeout} s, last result: {res}')
 
             raise Exception(f'Wait {func.__name__} timeout.'
                             f'Duration: {duration} / {timeout} s.'
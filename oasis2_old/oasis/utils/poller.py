@@ -0,0 +1,188 @@
+import asyncio
+import time
+
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+
+
+class Waiter:
+    def __init__(self, ids, describe, check, timeout, interval, name):
+        from oasis.worker.lease import current_lease
+        self.ids = list(ids)
+        self.describe = describe
+        self.check = check
+        self.timeout = timeout
+        self.max_interval = interval
+        self.name = name
+        self.started_at = time.monotonic()
+        self.due_at = self.started_at
+        # Describe calls failed in a row
+        self.errors = 0
+        self.future = asyncio.get_event_loop().create_future()
+        # Poll loop runs in its own asyncio task, keep the lease of the waiting task to report progress
+        self.lease = current_lease.get()
+
+    def report(self, elapsed, res):
+        if self.lease:
+            self.lease.progress = f'Wait {self.name}, {int(elapsed)} / {self.timeout} s, last result: {res}'
+
+
+class ResourcePoller:
+    """
+    Shared poll loops of cloud resources.
+
+    Every task used to run its own sleep-and-describe loop, so concurrent jobs sent many
+    describe calls for the same account and api. Waits are grouped by (api, scope), scope is
+    the account id or token the describe call is sent with, and one loop per group describes
+    the resources of all its waits with one multi id call (split by batch_size), then wakes
+    every wait whose resources reached the target state.
+
+    Poll interval adapts to how long the same kind of wait took before (moving average):
+    sparse polls far from the expected completion, dense polls near it, backing off after it,
+    and never sparser than the interval of the old loop.
+
+    A failed describe call is retried with the next poll, a wait fails only after max_errors
+    failed calls in a row or when its timeout passes, so one transient error of a group does
+    not fail the waits of every job sharing it.
+
+    [poller]
+    min_interval = 2    # seconds between two describe calls of a group
+    batch_size = 100    # resource ids of one describe call
+    max_errors = 3      # failed describe calls in a row a wait survives
+    """
+
+    def __init__(self):
+        self.min_interval = config.getfloat('poller', 'min_interval', fallback=2)
+        self.batch_size = config.getint('poller', 'batch_size', fallback=100)
+        self.max_errors = config.getint('poller', 'max_errors', fallback=3)
+        # (api, scope) -> [Waiter]
+        self._waiters = {}
+        # (api, scope) -> (poll loop task, wakeup event)
+        self._loops = {}
+        # wait name -> seconds the wait took, moving average
+        self._expected = {}
+
+    async def wait(self, api, scope, ids, describe, check, *, timeout=600, interval=10, name=None):
+        """
+        :param api: describe api, waits of the same api and scope share describe calls
+        :param scope: account id or token the describe call is sent with
+        :param describe: async describe(ids) -> {id: resource}, resources not found are left out
+        :param check: check({id: resource or None}) -> truthy result when done, falsy to keep
+                      waiting, raise to fail the wait
+        :param interval: max seconds between two polls
+        """
+        waiter = Waiter(ids, describe, check, timeout, interval, name or api)
+        key = (api, scope)
+        self._waiters.setdefault(key, []).append(waiter)
+
+        loop_task, wakeup = self._loops.get(key, (None, None))
+        if not loop_task or loop_task.done():
+            wakeup = asyncio.Event()
+            self._loops[key] = (asyncio.ensure_future(self._run(key, wakeup)), wakeup)
+        else:
+            wakeup.set()
+
+        try:
+            return await waiter.future
+        finally:
+            self._remove(key, waiter)
+
+    def _remove(self, key, waiter):
+        waiters = self._waiters.get(key, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            self._waiters.pop(key, None)
+
+    async def _run(self, key, wakeup):
+        last_polled = 0
+        while self._waiters.get(key):
+            now = time.monotonic()
+            due_at = min(waiter.due_at for waiter in self._waiters[key])
+            delay = max(due_at, last_polled + self.min_interval) - now
+            if delay > 0:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            last_polled = now
+            try:
+                await self._poll(key, list(self._waiters[key]))
+            except Exception as e:
+                logger.error(f'Poll {key[0]} failed, Error: {e}')
+        self._loops.pop(key, None)
+
+    async def _poll(self, key, waiters):
+        api, _ = key
+        ids = list(dict.fromkeys(resource_id for waiter in waiters for resource_id in waiter.ids))
+        logger.info(f'Poll {api}, {len(ids)} resources of {len(waiters)} waits.')
+
+        resources = {}
+        try:
+            for i in range(0, len(ids), self.batch_size):
+                resources.update(await waiters[0].describe(ids[i:i + self.batch_size]))
+        except Exception as e:
+            now = time.monotonic()
+            for waiter in waiters:
+                waiter.errors += 1
+                elapsed = now - waiter.started_at
+                if waiter.errors >= self.max_errors or elapsed >= waiter.timeout:
+                    self._finish(waiter, error=e)
+                else:
+                    logger.error(f'Describe of wait {waiter.name} failed {waiter.errors} / {self.max_errors} '
+                                 f'times, poll again. Error: {e}')
+                    waiter.due_at = now + self._next_interval(waiter, elapsed)
+            return
+
+        now = time.monotonic()
+        for waiter in waiters:
+            if waiter.future.done():
+                continue
+            waiter.errors = 0
+            elapsed = now - waiter.started_at
+            try:
+                res = waiter.check({resource_id: resources.get(resource_id) for resource_id in waiter.ids})
+            except Exception as e:
+                self._finish(waiter, error=e)
+                continue
+
+            if res:
+                logger.info(f'Wait {waiter.name} to be done. Duration: {int(elapsed)} / {waiter.timeout} s. '
+                            f'Resources: {waiter.ids}.')
+                self._learn(waiter.name, elapsed)
+                self._finish(waiter, result=res)
+            elif elapsed >= waiter.timeout:
+                self._finish(waiter, error=Exception(f'Wait {waiter.name} timeout. '
+                                                     f'Duration: {int(elapsed)} / {waiter.timeout} s. '
+                                                     f'Resources: {waiter.ids}.'))
+            else:
+                waiter.due_at = now + self._next_interval(waiter, elapsed)
+                waiter.report(elapsed, res)
+
+    @staticmethod
+    def _finish(waiter, result=None, error=None):
+        if waiter.future.done():
+            return
+        if error:
+            waiter.future.set_exception(error)
+        else:
+            waiter.future.set_result(result)
+
+    def _learn(self, name, elapsed):
+        expected = self._expected.get(name)
+        self._expected[name] = elapsed if expected is None else expected * 0.7 + elapsed * 0.3
+
+    def _next_interval(self, waiter, elapsed):
+        expected = self._expected.get(waiter.name)
+        if expected is None:
+            interval = waiter.max_interval
+        else:
+            # Half way to the expected completion, or half of the time overdue
+            interval = abs(expected - elapsed) / 2
+        return min(waiter.max_interval, max(self.min_interval, interval))
+
+
+resource_poller = ResourcePoller()
@@ -1,8 +1,256 @@
+import asyncio
+import base64
+from hashlib import sha1
+import re
+import time
+
 import asyncssh
 
+from oasis.utils.config import config
 from oasis.utils.logger import logger
 
 
+class _PoolClient(asyncssh.SSHClient):
+    def __init__(self):
+        self.closed = False
+
+    def connection_lost(self, exc):
+        # Keepalive failures and remote disconnects close the connection
+        self.closed = True
+
+
+class PooledConnection:
+    def __init__(self, key, conn, client):
+        self.key = key
+        self.conn = conn
+        self.client = client
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def closed(self):
+        return self.client.closed
+
+    def close(self):
+        self.client.closed = True
+        self.conn.close()
+
+
+class SSHPool:
+    """
+    Worker wide pool of ssh connections, keyed by (ip, port, key fingerprint).
+
+    Tasks of one job usually run on the same nodes one after another, e.g. install agent,
+    config hostname, mount ebs, so connections are kept after use and reused.
+
+    Keepalive:     connections send keepalives and are dropped when the node stops answering.
+    Health check:  connections idle longer than check_after run `true` before reuse.
+    Idle expiry:   unused connections are closed after idle_timeout.
+    Channel cap:   concurrent commands / sftp sessions per host, under sshd MaxSessions.
+
+    [ssh]
+    connect_timeout = 30
+    keepalive_interval = 30
+    keepalive_count = 3
+    idle_timeout = 300
+    check_after = 60
+    max_channels = 8
+    """
+
+    def __init__(self):
+        self.connect_timeout = config.getint('ssh', 'connect_timeout', fallback=30)
+        self.keepalive_interval = config.getint('ssh', 'keepalive_interval', fallback=30)
+        self.keepalive_count = config.getint('ssh', 'keepalive_count', fallback=3)
+        self.idle_timeout = config.getint('ssh', 'idle_timeout', fallback=300)
+        self.check_after = config.getint('ssh', 'check_after', fallback=60)
+        self.max_channels = config.getint('ssh', 'max_channels', fallback=8)
+        # key -> PooledConnection
+        self._conns = {}
+        # key -> lock, only one connect per key at a time
+        self._locks = {}
+        # (ip, port) -> semaphore of channels
+        self._channels = {}
+        self._reaper = None
+
+    async def acquire(self, ip, port, private_key):
+        key = (ip, int(port), private_key.get_fingerprint())
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pooled = self._conns.get(key)
+            if pooled and not await self._healthy(pooled):
+                self._discard(pooled)
+                pooled = None
+            if not pooled:
+                pooled = PooledConnection(key, *await self._connect(ip, port, private_key))
+                self._conns[key] = pooled
+            pooled.refs += 1
+            pooled.last_used = time.monotonic()
+
+        if not self._reaper:
+            # Timer instead of a task, shutdown waits for all tasks
+            self._reaper = asyncio.get_event_loop().call_later(min(self.idle_timeout, 60), self._reap)
+        return pooled
+
+    def release(self, pooled, broken=False):
+        pooled.refs -= 1
+        pooled.last_used = time.monotonic()
+        if broken or pooled.closed:
+            self._discard(pooled)
+
+    def channel(self, ip, port):
+        key = (ip, int(port))
+        if key not in self._channels:
+            self._channels[key] = asyncio.Semaphore(self.max_channels)
+        return self._channels[key]
+
+    async def _connect(self, ip, port, private_key):
+        logger.info(f'SSH connect to {ip}:{port}.')
+        conn, client = await asyncio.wait_for(
+            asyncssh.create_connection(_PoolClient, ip, port, username='root', client_keys=[private_key],
+                                       known_hosts=None, keepalive_interval=self.keepalive_interval,
+                                       keepalive_count_max=self.keepalive_count),
+            timeout=self.connect_timeout)
+        return conn, client
+
+    async def _healthy(self, pooled):
+        if pooled.closed:
+            return False
+        if pooled.refs or time.monotonic() - pooled.last_used < self.check_after:
+            return True
+        try:
+            res = await pooled.conn.run('true', timeout=10)
+            return res.exit_status == 0
+        except Exception as e:
+            logger.warn(f'SSH connection to {pooled.key[0]}:{pooled.key[1]} is broken, Error: {e}')
+            return False
+
+    def _discard(self, pooled):
+        if self._conns.get(pooled.key) is pooled:
+            self._conns.pop(pooled.key)
+        if not pooled.refs:
+            pooled.close()
+
+    def _reap(self):
+        self._reaper = None
+        now = time.monotonic()
+        for pooled in list(self._conns.values()):
+            if pooled.closed or (not pooled.refs and now - pooled.last_used > self.idle_timeout):
+                self._discard(pooled)
+        if self._conns:
+            self._reaper = asyncio.get_event_loop().call_later(min(self.idle_timeout, 60), self._reap)
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        for pooled in list(self._conns.values()):
+            pooled.close()
+            await pooled.conn.wait_closed()
+        self._conns = {}
+
+
+ssh_pool = SSHPool()
+
+
+class ScriptBundle:
+    """
+    Steps of a remote provisioning, run by Remote.run_bundle with one ssh channel.
+
+    Every step runs in its own subshell, like one Remote.execute call. Succeeded steps leave
+    a marker under STATE_DIR/<bundle id>/, keyed by step index and command hash, so running
+    the same bundle again, e.g. the task is retried, resumes at the failed step.
+
+        bundle = ScriptBundle(f'{task_id}-{instance.id}-install-agent')
+        bundle.file('etc-hosts', hosts)
+        bundle.step('set hostname', f'sudo hostname {fqdn}')
+        bundle.step('restart collector', '...', raise_when_error=False)
+        await conn.run_bundle(bundle)
+    """
+
+    STATE_DIR = '/tmp/oasis-bundles'
+    MARKER = '@@OASIS_STEP'
+
+    RUNNER = r"""
+        STATE_DIR={state_dir}
+        mkdir -p "$STATE_DIR"
+        __now() {{ echo $(( $(date +%s%N) / 1000000 )); }}
+        __run() {{
+            local index=$1 key=$2 strict=$3 name=$4
+            if [ -f "$STATE_DIR/$key.done" ]; then
+                echo "{marker} $index skipped 0 0 $name"
+                return 0
+            fi
+            local start=$(__now)
+            # Script itself comes from stdin, steps must not read it
+            ( step_$index ) < /dev/null > "$STATE_DIR/$key.out" 2> "$STATE_DIR/$key.err"
+            local code=$? status=ok
+            if [ $code -eq 0 ]; then
+                touch "$STATE_DIR/$key.done"
+            else
+                status=failed
+                tail -n 20 "$STATE_DIR/$key.err" >&2
+            fi
+            echo "{marker} $index $status $code $(( $(__now) - start )) $name"
+            if [ $code -ne 0 ] && [ $strict = 1 ]; then
+                exit $code
+            fi
+        }}
+    """
+
+    def __init__(self, bundle_id):
+        self.bundle_id = re.sub(r'[^\w.-]', '_', bundle_id)
+        # [(name, cmd, raise_when_error)]
+        self.steps = []
+
+    def step(self, name, cmd, raise_when_error=True):
+        self.steps.append((re.sub(r'[^\w.-]', '_', name), cmd, raise_when_error))
+        return self
+
+    def file(self, dest_path, data, name=None):
+        """
+        Write data to dest_path, replaces a Remote.write_file call.
+        """
+        encoded = base64.b64encode(data.encode()).decode()
+        return self.step(name or f'write {dest_path}',
+                         f"base64 -d > {dest_path} << 'OASIS_EOF'\n{encoded}\nOASIS_EOF")
+
+    def render(self):
+        runner = re.sub(r'^ {8}', '', self.RUNNER, flags=re.M).strip()
+        script = [runner.format(state_dir=f'{self.STATE_DIR}/{self.bundle_id}', marker=self.MARKER)]
+        for index, (name, cmd, raise_when_error) in enumerate(self.steps, 1):
+            key = f'{index}-{sha1(cmd.encode()).hexdigest()[:12]}'
+            script.append(f'step_{index}() {{\n{cmd}\n}}')
+            script.append(f'__run {index} {key} {int(raise_when_error)} {name}')
+        return '\n'.join(script) + '\n'
+
+    @classmethod
+    def parse(cls, stdout):
+        """
+        Return [{'index', 'name', 'status', 'exit_status', 'seconds'}] of steps run.
+        """
+        steps = []
+        for line in (stdout or '').splitlines():
+            if not line.startswith(cls.MARKER):
+                continue
+            _, index, status, code, ms, name = line.split(' ', 5)
+            steps.append({
+                'index': int(index),
+                'name': name,
+                'status': status,
+                'exit_status': int(code),
+                'seconds': int(ms) / 1000,
+            })
+        return steps
+
+
+async def tcp_check(ip, port, timeout=5):
+    """
+    Raise when ip:port does not accept tcp connections, much cheaper than a failed ssh handshake.
+    """
+    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+    writer.close()
+
+
 class Remote:
     def __init__(self, ip, port, private_key, **kwargs):
         self.conn = None
@@ -10,22 +258,26 @@ class Remote:
         self.port = port
         self.private_key = private_key
         self.kwargs = kwargs
+        self._pooled = None
 
     async def __aenter__(self):
-        self.conn = await asyncssh.connect(self.ip, self.port, username='root',
-                                           client_keys=[self.private_key],
-                                           known_hosts=None).__aenter__()
+        self._pooled = await ssh_pool.acquire(self.ip, self.port, self.private_key)
+        self.conn = self._pooled.conn
         return self
 
-    async def __aexit__(self, *exc_info):
-        await self.conn.__aexit__(*exc_info)
+    async def __aexit__(self, exc_type, exc, tb):
+        # Connection stays in the pool for the next task on this node
+        broken = exc_type is not None and issubclass(exc_type, (asyncssh.DisconnectError, OSError))
+        ssh_pool.release(self._pooled, broken=broken)
+        self._pooled = None
 
     async def execute(self, *args, **kwargs):
         timeout = kwargs.pop('timeout', 180)
         raise_when_error = kwargs.pop('raise_when_error', True)
         logger.info(f'Remote execute cmd on {self.ip}:{self.port} ({self.kwargs}), '
                     f'Args:{args}, Kwargs:{kwargs}')
-        res = await self.conn.run(timeout=timeout, *args, **kwargs)
+        async with ssh_pool.channel(self.ip, self.port):
+            res = await self.conn.run(timeout=timeout, *args, **kwargs)
         logger.info(f'Remote execute cmd on {self.ip}:{self.port} ({self.kwargs}), '
                     f'Args:{args}, Kwargs:{kwargs}, Res: {res}')
         if raise_when_error and res.exit_status:
@@ -35,6 +287,26 @@ class Remote:
         return res.exit_status, res.stdout
 
     async def write_file(self, dest_path, data):
-        async with self.conn.start_sftp_client() as sftp:
-            async with sftp.open(dest_path, 'w+') as file:
-                await file.write(data)
+        async with ssh_pool.channel(self.ip, self.port):
+            async with self.conn.start_sftp_client() as sftp:
+                async with sftp.open(dest_path, 'w+') as file:
+                    await file.write(data)
+
+    async def run_bundle(self, bundle, timeout=1800, raise_when_error=True):
+        """
+        Send the bundle script through stdin of one `bash -s`, return (exit status, step results).
+        """
+        logger.info(f'Remote run bundle {bundle.bundle_id} on {self.ip}:{self.port} ({self.kwargs}), '
+                    f'{len(bundle.steps)} steps.')
+        async with ssh_pool.channel(self.ip, self.port):
+            res = await self.conn.run('bash -s', input=bundle.render(), timeout=timeout)
+        steps = ScriptBundle.parse(res.stdout)
+        logger.info(f'Remote run bundle {bundle.bundle_id} on {self.ip}:{self.port} ({self.kwargs}), '
+                    f'exit status {res.exit_status}, steps: '
+                    + ', '.join(f'{step["name"]} {step["status"]} {step["seconds"]}s' for step in steps))
+        if raise_when_error and res.exit_status:
+            failed = steps[-1]['name'] if steps else None
+            raise Exception(f'Remote run bundle {bundle.bundle_id} failed at step {failed}, '
+                            f'{self.ip}:{self.port} ({self.kwargs}), '
+                            f'Exit status: {res.exit_status}, Error: {res.stderr}')
+        return res.exit_status, steps
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import base64
 
+from conf.charge_conf import PRODUCT_GROUP_ID_MAP
 from conf.infra_conf import VOLUME_TYPE_MAP
 from oasis.db.models import get_model_by_id
 from oasis.db.models.cluster import ClusterModel
@@ -181,6 +182,11 @@ async def form_node_group_items(product_details, instance_group, basic_items, us
     '''
     !!! 有变化记得修改 form_node_group_items_for_upgrade !!!
     '''
+    if not product_details:
+        # Task args without product details, catalog is cached by price_client
+        product_details = await price_client.get_product_details(
+            user_id, PRODUCT_GROUP_ID_MAP[cluster_type.upper()], '1')
+
     product_items = {}
     group_price = 0.0
 
@@ -315,6 +321,11 @@ async def form_node_group_items_for_upgrade(product_details, instance_group, bas
     else:
         product_items[service_type] = [res]
     '''
+    if not product_details:
+        # Task args without product details, catalog is cached by price_client
+        product_details = await price_client.get_product_details(
+            user_id, PRODUCT_GROUP_ID_MAP[cluster_type.upper()], '1')
+
     product_items = {}
     group_price = 0.0
     is_upgrade_kec = False
@@ -1,19 +1,38 @@
+from copy import deepcopy
+
 from oasis.utils import http
+from oasis.utils.cache import AsyncCache
 from oasis.utils.config import config
 
 
 class PriceClient:
     def __init__(self):
         self.endpoint = config.get('charge', 'price_uri')
+        # Product catalog changes rarely, every launch / scale out / upgrade request used to fetch it
+        self.product_cache = AsyncCache(
+            ttl=config.getint('charge', 'product_cache_ttl', fallback=300),
+            refresh_ahead=config.getfloat('charge', 'product_cache_refresh', fallback=0.8),
+            maxsize=config.getint('charge', 'product_cache_size', fallback=1000),
+            name='product details',
+        )
 
-    async def get_product_details(self, account_id, product_group_id, operate_type):
+    async def get_product_details(self, account_id, product_group_id, operate_type, fresh=False):
         """
+        Cached by (account_id, product_group_id, operate_type), see product_cache.
 
         :param account_id:
         :param product_group_id:
         :param operate_type:
+        :param fresh: bypass the cache
         :return: {"KES_EPC":{}, "KES_EBS":{"ES.basic.4C4G": {}}}
         """
+        key = (str(account_id), str(product_group_id), str(operate_type))
+        product_details = await self.product_cache.get(
+            key, lambda: self._get_product_details(*key), fresh=fresh)
+        # Callers put it into job context and task args, do not share the cached dict
+        return deepcopy(product_details)
+
+    async def _get_product_details(self, account_id, product_group_id, operate_type):
         product_details = {}
         params = {
             'userId': account_id,
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+import asyncio
+
 from oasis.utils import http
 from oasis.utils.config import config
 from oasis.utils.logger import logger
 from oasis.utils.convert import dict_snake2camel
 from oasis.utils.generator import gen_uuid4
-from oasis.utils.poll_util import wait_until_complete
+from oasis.utils.poller import resource_poller
 
 
 def _prepare(func):
@@ -306,21 +308,29 @@ class GringottsClient:
                 return op_id
         raise Exception(f'Gringotts snapshot on failed, return: {ret}')
 
-    @wait_until_complete(timeout=1800, interval=30)
     async def wait_gg_op_active(self, operation_id, token=None):
-        ret = await self.describe_operation(operation_id, token=token)
-        logger.info(self, f'wait gg op active... ret: {ret}')
-        
-        if ret:
-            # Pending - begin
-            # Running - execute
-            # Succeed - ok
-            # Faild - error
-            # Status: 'Faild,Succeed,Running,Pending',
-
-            status = ret.get('Operation', {}).get('Status', 'Unknown')
-            if 'SUCCEEDED' == status:
-                return True
-            elif 'FAILED' == status:
-                raise Exception(f'gg run task failed msg: {ret}')
-        return False
+        async def _describe(operation_ids):
+            # DescribeOperation takes one id, waits of the same operation still share calls
+            rets = await asyncio.gather(*[self.describe_operation(op_id, token=token) for op_id in operation_ids])
+            return dict(zip(operation_ids, rets))
+
+        def _check(operations):
+            ret = operations[operation_id]
+            logger.info(self, f'wait gg op active... ret: {ret}')
+
+            if ret:
+                # Pending - begin
+                # Running - execute
+                # Succeed - ok
+                # Faild - error
+                # Status: 'Faild,Succeed,Running,Pending',
+
+                status = ret.get('Operation', {}).get('Status', 'Unknown')
+                if 'SUCCEEDED' == status:
+                    return True
+                elif 'FAILED' == status:
+                    raise Exception(f'gg run task failed msg: {ret}')
+            return False
+
+        return await resource_poller.wait('gringotts.DescribeOperation', token, [operation_id], _describe, _check,
+                                          timeout=1800, interval=30, name='wait_gg_op_active')
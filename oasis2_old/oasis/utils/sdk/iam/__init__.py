@@ -5,6 +5,7 @@ import json
 
 from oasis.db.service import redis_client
 from oasis.utils import http
+from oasis.utils.cache import AsyncCache
 from oasis.utils.config import config
 from oasis.utils.generator import gen_uuid4
 
@@ -28,23 +29,55 @@ def _prepare(func):
     return _inner
 
 
+# Redis tier, shared by all processes
+CACHE_EXPIRE = config.getint('oasis', 'cache_expire', fallback=86400)
+
+# In-process tier in front of redis, short ttl so changes of other processes show up soon,
+# accounts (UserModel) are cached here as well, every api request looks both up
+identity_cache = AsyncCache(
+    ttl=config.getint('oasis', 'identity_cache_ttl', fallback=30),
+    refresh_ahead=0,
+    maxsize=config.getint('oasis', 'identity_cache_size', fallback=10000),
+    name='identity',
+)
+
+
 def _cache(func):
     async def _inner(user_id, product, *args, **kwargs):
-        cache_expire = int(config.get('oasis', 'cache_expire'))
         cache_key = f'/oasis/user/{product}/{user_id}/'
-        user = await redis_client.get(cache_key)
-        if user:
-            await redis_client.expire(cache_key, cache_expire)
-            return json.loads(user)
-
-        res = await func(user_id, product, *args, **kwargs)
-        if res:
-            await redis_client.set(cache_key, res, expire=cache_expire)
-        return res
+
+        async def _load():
+            user = await redis_client.get(cache_key)
+            if user:
+                return json.loads(user)
+
+            res = await func(user_id, product, *args, **kwargs)
+            if res:
+                await redis_client.set(cache_key, json.dumps(res), expire=CACHE_EXPIRE)
+            return res
+
+        return await identity_cache.get(('iam', product, user_id), _load)
 
     return _inner
 
 
+async def get_account(account_id):
+    """
+    UserModel of the account, from identity_cache, None if not found.
+    Shared by requests, do not modify it.
+    """
+    from oasis.db.models import get_model_by_id
+    from oasis.db.models.user import UserModel
+
+    if not account_id:
+        return None
+    return await identity_cache.get(('account', account_id), lambda: get_model_by_id(UserModel, account_id))
+
+
+def invalidate_account(account_id):
+    identity_cache.invalidate(('account', account_id))
+
+
 @_prepare
 async def get_user_ak_sk_by_id(account_id, product, headers=None, params=None):
     super_ak = config.get('iam', f'{product}_ak')
@@ -8,6 +8,7 @@ from oasis.utils.exceptions import EbsRequestException
 from oasis.utils.generator import gen_uuid4
 from oasis.utils.logger import logger
 from oasis.utils.poll_util import wait_until_complete
+from oasis.utils.poller import resource_poller
 from oasis.utils.sdk.infra.mock import mock_request_fail
 
 
@@ -115,17 +116,35 @@ class EbsClient(object):
         if volume_status in ['available', 'error', 'recycling']:
             return await self._delete_volume(volume_id, account_id=account_id)
 
-    @wait_until_complete(timeout=240, interval=5)
     async def wait_ebs_status(self, volume_id, expect_status: list,
                               unexpect_status: list = None,
                               account_id=None):
-        volume_status = await self._get_ebs_status(volume_id, account_id=account_id)
-        if volume_status in expect_status:
-            logger.info(f'Volume {volume_id} status is {volume_status}.')
-            return volume_status
-        elif unexpect_status and volume_status in unexpect_status:
-            raise Exception(f'Volume {volume_id} in unexpected status {volume_status}.')
-        return False
+        """
+        :param volume_id: volume id, or list of volume ids to wait for together, then
+                          {volume id: status} is returned
+        """
+        volume_ids = volume_id if isinstance(volume_id, list) else [volume_id]
+        if not volume_ids:
+            return {}
+
+        async def _describe(volume_ids):
+            volumes = await self.describe_volumes(volume_ids, account_id=account_id)
+            return {volume['VolumeId']: volume for volume in volumes}
+
+        def _check(volumes):
+            statuses = {}
+            for _volume_id, volume in volumes.items():
+                volume_status = (volume or {}).get('VolumeStatus', None)
+                if unexpect_status and volume_status in unexpect_status:
+                    raise Exception(f'Volume {_volume_id} in unexpected status {volume_status}.')
+                if volume_status not in expect_status:
+                    return False
+                statuses[_volume_id] = volume_status
+            logger.info(f'Volume {volume_id} status is {statuses}.')
+            return statuses if isinstance(volume_id, list) else statuses[volume_id]
+
+        return await resource_poller.wait(f'{self.product}.DescribeVolumes', account_id, volume_ids,
+                                          _describe, _check, timeout=240, interval=5, name='ebs.wait_ebs_status')
 
     @wait_until_complete(timeout=600, interval=10)
     async def wait_ebs_upgrade(self, volume_id, upgrade_volume_size,
@@ -217,6 +236,19 @@ class EbsClient(object):
             return volumes[0].get('VolumeStatus', None)
         return None
 
+    @_prepare
+    async def describe_volumes(self, volume_ids, *,
+                               account_id=None, params: dict = None, headers: dict = None):
+        params.setdefault('Action', 'DescribeVolumes')
+        if len(volume_ids) > 5:
+            params.setdefault('MaxResults', len(volume_ids))
+        params.update(list2dict('VolumeId', volume_ids))
+
+        code, ret = await http.get(self.endpoint, params=params, headers=headers)
+        if 199 < code < 300:
+            return ret.get('Volumes', None) or []
+        raise EbsRequestException(f'Describe volumes failed, volume ids: {volume_ids}, return: {ret}')
+
     @_prepare
     async def _get_ebs_info(self, volume_id, *,
                             account_id=None, params: dict = None, headers: dict = None):
@@ -4,7 +4,7 @@ from oasis.utils.config import config
 from oasis.utils.convert import list2dict
 from oasis.utils.exceptions import EpcRequestException
 from oasis.utils.generator import gen_uuid4
-from oasis.utils.poll_util import wait_until_complete
+from oasis.utils.poller import resource_poller
 
 
 def _prepare(func):
@@ -167,16 +167,36 @@ class EpcClient:
 
         return _ac_lst
 
-    @wait_until_complete(timeout=1800, interval=60)
+    def _describer(self, account_id):
+        async def _describe(instance_ids):
+            hosts = await self.describe_instances(instance_ids, account_id=account_id)
+            return {host['HostId']: host for host in hosts}
+
+        return _describe
+
     async def wait_create_active(self, instance_ids, account_id=None, flag_state='Running'):
         if not instance_ids:
             return True
-        ac_lst = await self.check_create_active(instance_ids, flag_state=flag_state, account_id=account_id)
-        return len(instance_ids) == len(ac_lst)
 
-    @wait_until_complete(timeout=1800, interval=60)
+        def _check(hosts):
+            for host in filter(None, hosts.values()):
+                if "InstallFailed" == host.get("HostStatus"):
+                    _errmsg = "Node %s has error status, epc HostId: %s" % (
+                        host.get("HostName", ""), host.get("HostId"))
+                    raise EpcRequestException(_errmsg)
+            return all(host and host.get('HostStatus') == flag_state for host in hosts.values())
+
+        return await resource_poller.wait(f'{self.product}.DescribeEpcs', account_id, instance_ids,
+                                          self._describer(account_id), _check,
+                                          timeout=1800, interval=60, name='epc.wait_create_active')
+
     async def wait_instances_delete(self, instance_ids, account_id=None):
         if not instance_ids:
             return True
-        _pinstances = await self.describe_instances(instance_ids, account_id=account_id)
-        return len(_pinstances) == 0
+
+        def _check(hosts):
+            return not any(hosts.values())
+
+        return await resource_poller.wait(f'{self.product}.DescribeEpcs', account_id, instance_ids,
+                                          self._describer(account_id), _check,
+                                          timeout=1800, interval=60, name='epc.wait_instances_delete')
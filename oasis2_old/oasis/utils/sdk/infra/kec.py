@@ -6,6 +6,7 @@ from oasis.utils.exceptions import KecRequestException
 from oasis.utils.generator import gen_uuid4
 from oasis.utils.logger import logger
 from oasis.utils.poll_util import wait_until_complete
+from oasis.utils.poller import resource_poller
 
 
 def _prepare(func):
@@ -267,19 +268,38 @@ class KecClient:
                 raise KecRequestException(_errmsg)
         return _ac_lst
 
-    @wait_until_complete()
+    def _describer(self, account_id):
+        async def _describe(instance_ids):
+            instances = await self.describe_instances(instance_ids, account_id=account_id)
+            return {instance['InstanceId']: instance for instance in instances}
+
+        return _describe
+
     async def wait_create_active(self, instance_ids, account_id=None, flag_state='active'):
         if not instance_ids:
             return True
-        ac_lst = await self.check_create_active(instance_ids, account_id=account_id, flag_state=flag_state)
-        return len(instance_ids) == len(ac_lst)
 
-    @wait_until_complete()
+        def _check(instances):
+            for instance in filter(None, instances.values()):
+                if 'error' == instance.get('InstanceState'):
+                    _errmsg = 'Node %s has error status, kec instance_id: %s' % (
+                        instance.get('InstanceName', ''), instance.get('InstanceId'))
+                    logger.warning(_errmsg)
+                    raise KecRequestException(_errmsg)
+            return all(instance and instance.get('InstanceState') == flag_state for instance in instances.values())
+
+        return await resource_poller.wait(f'{self.product}.DescribeInstances', account_id, instance_ids,
+                                          self._describer(account_id), _check, name='kec.wait_create_active')
+
     async def wait_instances_delete(self, instance_ids, account_id=None):
         if not instance_ids:
             return True
-        _pinstances = await self.describe_instances(instance_ids, account_id=account_id)
-        return len(_pinstances) == 0
+
+        def _check(instances):
+            return not any(instances.values())
+
+        return await resource_poller.wait(f'{self.product}.DescribeInstances', account_id, instance_ids,
+                                          self._describer(account_id), _check, name='kec.wait_instances_delete')
 
     @wait_until_complete()
     async def wait_instance_upgrade(self, instance_id, upgrade_instance_type, account_id=None):
@@ -3,6 +3,7 @@ from asyncio.exceptions import CancelledError
 from datetime import datetime
 import json
 import signal
+import time
 import traceback
 
 from oasis.db.models import get_model_by_id
@@ -11,11 +12,26 @@ from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.job import JobModel
 from oasis.db.models.task import TaskModel
 from oasis.db.service import competition_mq
+from oasis.db.service import new_blocking_client
+from oasis.db.service import redis_client
 from oasis.utils.config import config
+from oasis.utils.generator import gen_task_stream
+from oasis.utils.http import http_sessions
 from oasis.utils.logger import logger
 from oasis.utils.redlock import redlock
 from oasis.utils.redlock import unlock_cluster
+from oasis.utils.remote import ssh_pool
 from oasis.utils.sdk import feishu_client
+from oasis.worker.admission import LANE
+from oasis.worker.admission import admission
+from oasis.worker.events import EVENT
+from oasis.worker.events import publish_task_event
+from oasis.worker.lease import TaskLease
+from oasis.worker.lease import current_lease
+from oasis.worker.lease import fail_running_task
+from oasis.worker.lease import get_leases
+from oasis.worker.scheduler import scheduler
+from oasis.worker.snapshot import count_job_queries
 from oasis.worker.tasks import RegisteredTasks
 from oasis.worker.tasks import fill_task_args
 from oasis.worker.tasks.notify import TaskSendFeishu
@@ -25,14 +41,32 @@ class Worker:
     def __init__(self, name, **conf):
         self.name = name
         self.stream = config.get('worker', 'stream', fallback='default_stream')
+        # Task types subscribed, every type has its own stream, see gen_task_stream
+        types = conf.get('types') or config.get('worker', 'types', fallback=','.join([
+            TaskModel.TYPE.ALL, TaskModel.TYPE.POLY, TaskModel.TYPE.INNER, TaskModel.TYPE.PUBLIC]))
+        self.types = [t.strip() for t in types.split(',') if t.strip()]
+        # Streams of higher priority lanes are read first
+        self.lane_streams = [[gen_task_stream(self.stream, t, lane) for t in self.types] for lane in LANE.ALL]
+        self.streams = [stream for streams in self.lane_streams for stream in streams]
         self.group = config.get('worker', 'group', fallback='group')
         self.consumer_list = []
         self.timeout = config.getint('worker', 'timeout', fallback=3600)
-        self.concurrent = config.getint('worker', 'concurrent', fallback=5)
+        self.concurrent = int(conf.get('concurrent') or config.getint('worker', 'concurrent', fallback=5))
+        self.prefetch = config.getint('worker', 'prefetch', fallback=self.concurrent)
+        self.consumer = None
+        self._task_slots = None
+        self._prefetched = None
+        self._queue_space = None
+        self._running = set()
         self.lock_key = f'/oasis/lock/worker/{self.name}'
         self.lock_timeout = config.getint('worker', 'lock_timeout', fallback=120)
         self.lock_iden = None
         self.enable = False
+        self.stream_maxlen = config.getint('worker', 'stream_maxlen', fallback=100000)
+        self.reclaim_interval = config.getint('worker', 'reclaim_interval', fallback=10)
+        self.reclaim_idle = config.getint('worker', 'reclaim_idle', fallback=self.timeout)
+        self.reclaim_count = config.getint('worker', 'reclaim_count', fallback=100)
+        self.max_deliveries = config.getint('worker', 'max_deliveries', fallback=3)
 
     async def _doing_task(self, task_msg):
         task_dict = json.loads(task_msg.get('task_msg'))
@@ -40,7 +74,7 @@ class Worker:
         task_type = task_dict.get('task_type')
         task_model = await get_model_by_id(TaskModel, task_id)
         job_id = task_model.job_id
-        await task_model.save({'worker': self.name})
+        await task_model.update_columns({'worker': self.name})
 
         # Refresh job model status
         job_model = await get_model_by_id(JobModel, model_id=job_id)
@@ -56,8 +90,9 @@ class Worker:
                     raise Exception(
                         f'Could not find task {task_model.name}, job id {job_id}, task id {task_id}')
 
-                results = await task_clazz(task_id=task_id, job_id=job_id,
-                                           args=task_model.args).run()
+                async with count_job_queries(job_id, task_model.name):
+                    results = await task_clazz(task_id=task_id, job_id=job_id,
+                                               args=await task_model.load_args()).run()
             except Exception as e:
                 cluster_id = job_model.cluster_id
 
@@ -69,9 +104,9 @@ class Worker:
                                                      'delete_cluster', ]:
                     cluster = await get_model_by_id(ClusterModel, cluster_id)
                     if cluster:
-                        await cluster.save({'status': ClusterModel.STATUS.ERROR})
-                await task_model.save({'info': f'{e}, {traceback.format_exc()}',
-                                       'status': TaskModel.STATUS.Failed})
+                        await cluster.update_columns({'status': ClusterModel.STATUS.ERROR})
+                await task_model.update_columns({'info': f'{e}, {traceback.format_exc()}',
+                                                 'status': TaskModel.STATUS.Failed})
                 try:
                     await TaskSendFeishu(job_id=job_id, args={
                         'state': feishu_client.STATE.ERROR,
@@ -103,23 +138,29 @@ class Worker:
                 if new_status:
                     job_model = JobModel()
                     job_model.id = job_id
-                    await job_model.save({'status': new_status})
+                    await job_model.update_columns({'status': new_status})
 
+                await publish_task_event(EVENT.TaskFailed, job_id, task_id, cluster_id=cluster_id)
                 return
 
+            # Large results are written once as blobs, next tasks get refs
+            results = await TaskModel.pack(results)
+
             # write required results into next tasks args
             next_task_ids = task_model.next_tasks
             next_task_query = model_query(TaskModel).where(TaskModel.id.in_(next_task_ids))
             next_task_models = await next_task_query.query_all()
             for next_task in next_task_models:
                 if next_task.args:
-                    await next_task.save({'args': fill_task_args(next_task.args, results)})
+                    await next_task.update_columns({'args': fill_task_args(next_task.args, results)})
 
             task_model.status = TaskModel.STATUS.Done
-            await task_model.save({
+            await task_model.update_columns({
                 'status': TaskModel.STATUS.Done,
                 'results': results,
             })
+            await scheduler.finish(job_id, scheduler.DIRECTION.Exec, task_id)
+            await publish_task_event(EVENT.TaskDone, job_id, task_id, cluster_id=cluster_id)
 
         elif task_type == 'rollback' and task_model.status == TaskModel.STATUS.Rolling:
             try:
@@ -127,13 +168,15 @@ class Worker:
                     raise Exception(f'Could not find rolling back task {task_model.name}, '
                                     f'job id {job_id}, task id {task_id}')
 
-                results = await task_clazz(task_id=task_id, job_id=job_id,
-                                           args=task_model.args, results=task_model.results).rollback()
+                async with count_job_queries(job_id, task_model.name):
+                    results = await task_clazz(task_id=task_id, job_id=job_id,
+                                               args=await task_model.load_args(),
+                                               results=await task_model.load_results()).rollback()
             except Exception as e:
                 logger.info(self, f'Task Rollback Failed, Error: {e}, '
                                   f'result {task_model.info}.\n'
                                   f'{traceback.format_exc()}')
-                await task_model.save({
+                await task_model.update_columns({
                     'status': TaskModel.STATUS.RollFailed,
                     'info': str(e),
                 })
@@ -141,54 +184,263 @@ class Worker:
                 if new_status:
                     job_model = JobModel()
                     job_model.id = job_id
-                    await job_model.save({'status': new_status})
+                    await job_model.update_columns({'status': new_status})
                     await unlock_cluster(cluster_id, job_id)
 
+                await publish_task_event(EVENT.TaskRollFailed, job_id, task_id, cluster_id=cluster_id)
                 return
 
-            await task_model.save({
+            await task_model.update_columns({
                 'status': TaskModel.STATUS.Rolled,
-                'results': results,
+                'results': await TaskModel.pack(results),
             })
+            await scheduler.finish(job_id, scheduler.DIRECTION.Rollback, task_id)
+            await publish_task_event(EVENT.TaskRolled, job_id, task_id, cluster_id=cluster_id)
 
-        await asyncio.sleep(5)
+    async def _consume(self, stream, msg_id, task_msg):
+        lease = None
+        try:
+            task_dict = json.loads(task_msg.get('task_msg'))
+            lease = TaskLease(task_dict.get('task_id'), worker=self.name, consumer=self.consumer,
+                              stream=stream, msg_id=msg_id, task_msg=task_msg.get('task_msg'),
+                              attempt=task_dict.get('attempt', 0))
+            if not await lease.acquire():
+                # Another delivery of the task is running, the message is left to its lease
+                logger.info(self, f'Lease of task {lease.task_id} is held by another worker, '
+                                  f'skip msg_id: [{msg_id}]')
+                return
+            lease.start()
+            current_lease.set(lease)
+
+            await self._doing_task(task_msg)
+        except Exception as e:
+            # Not acked, lease expires and manager requeues the message
+            logger.info(self, f'Run into exception, msg_id: [{msg_id}], Error: {e}.\n'
+                              f'{traceback.format_exc()}')
+            if lease:
+                lease.stop()
+            return
+        # Task status is committed now
+        await competition_mq.xack(stream, self.group, msg_id)
+        await lease.release()
+        await admission.release([lease.task_id])
 
     def _standby(self):
-        async def _run(seq):
-            consumer = f'{self.name}_{seq}_{datetime.utcnow()}'
-            self.consumer_list.append(consumer)
-            logger.info(self, f'Started , stream: {self.stream} , consumer: {consumer}')
+        self.consumer = f'{self.name}_{datetime.utcnow()}'
+        self.consumer_list.append(self.consumer)
+        self._task_slots = asyncio.Semaphore(self.concurrent)
+        # Read count applies to every stream, so the queue could exceed prefetch by one read per stream
+        self._prefetched = asyncio.Queue(maxsize=self.prefetch * len(self.streams))
+        self._queue_space = asyncio.Event()
+        return [self._read_stream(), self._dispatch(), self._reclaim()]
+
+    async def _read_stream(self):
+        """
+        Single reader fetches batches into a bounded local queue.
+        Blocking read uses a dedicated connection, shared pool is left for job context and locks.
+        """
+        logger.info(self, f'Started , streams: {self.streams} , consumer: {self.consumer}, '
+                          f'concurrent: {self.concurrent}, prefetch: {self.prefetch}')
+        for stream in self.streams:
             try:
-                await competition_mq.xgroup_create(stream_id=self.stream,
+                await competition_mq.xgroup_create(stream_id=stream,
                                                    group=self.group,
                                                    last_id='0',
                                                    mk_stream=True)
             except:
                 pass
+        await self._keep_consumers_alive()
+
+        blocking_client = new_blocking_client()
+        while self.enable:
+            free = self.prefetch - self._prefetched.qsize()
+            if free <= 0:
+                self._queue_space.clear()
+                await self._queue_space.wait()
+                continue
+
+            # Backlog of higher lanes first, then block on all streams
+            received = 0
+            for streams in self.lane_streams:
+                if received >= free:
+                    break
+                received += await self._read_group(streams, free - received, None, blocking_client)
+            if not received:
+                await self._read_group(self.streams, free, self.timeout, blocking_client)
+
+        # Wake up dispatcher, prefetched messages stay pending and will be reclaimed
+        if not self._prefetched.full():
+            self._prefetched.put_nowait(None)
+
+    async def _read_group(self, streams, count, timeout, pool):
+        received = 0
+        async for new_task in competition_mq.xread_group(stream_id=streams,
+                                                         group=self.group,
+                                                         consumer=self.consumer,
+                                                         count=count,
+                                                         timeout=timeout,
+                                                         pool=pool):
+            if not new_task:
+                continue
+
+            stream_id, msg_id, task_msg = new_task
+            logger.info(self,
+                        f'Receive task from stream: [{stream_id}], msg_id: [{msg_id}], task_msg: {task_msg}')
+            self._prefetched.put_nowait((stream_id, msg_id, task_msg))
+            received += 1
+        return received
+
+    async def _dispatch(self):
+        while True:
+            await self._task_slots.acquire()
+            new_task = await self._prefetched.get() if self.enable else None
+            self._queue_space.set()
+            if new_task is None:
+                self._task_slots.release()
+                break
+            # Run task
+            stream, msg_id, task_msg = new_task
+            self._submit(stream, msg_id, task_msg)
+
+        await self._wait_running()
+
+    def _submit(self, stream, msg_id, task_msg):
+        """
+        Run task in background, caller should hold a task slot.
+        """
+        future = asyncio.ensure_future(self._consume(stream, msg_id, task_msg))
+        self._running.add(future)
+
+        def _done(f):
+            self._running.discard(f)
+            self._task_slots.release()
+
+        future.add_done_callback(_done)
+
+    async def _wait_running(self):
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _keep_consumers_alive(self):
+        for consumer in self.consumer_list:
+            await redis_client.set(f'/oasis/worker/consumer/{consumer}', self.name,
+                                   expire=self.lock_timeout)
+
+    async def _is_consumer_alive(self, consumer):
+        if consumer in self.consumer_list:
+            return True
+        return await redis_client.exists(f'/oasis/worker/consumer/{consumer}')
+
+    async def _reclaim(self):
+        """
+        Deliver again messages which are never acked.
+        Consumer is dead: claim after reclaim_interval.
+        Consumer is alive: claim after reclaim_idle of the task class, the task may hang.
+        Tasks holding an unexpired lease are never claimed, their worker is still beating.
+        """
+        while self.enable:
+            await asyncio.sleep(self.reclaim_interval)
+            try:
+                for stream in self.streams:
+                    await self._reclaim_pending(stream)
+            except Exception as e:
+                logger.error(self, f'Reclaim pending tasks failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+
+    async def _reclaim_pending(self, stream):
+        pending = await competition_mq.xpending(stream, self.group, count=self.reclaim_count)
+        for msg_id, owner, idle, delivery_count in pending:
+            if self._task_slots.locked():
+                break
+            if owner in self.consumer_list or idle < self.reclaim_interval * 1000:
+                continue
+
+            fields = await competition_mq.xrange_one(stream, msg_id)
+            if await self._is_leased(fields):
+                # Running with a live heartbeat, a stopped one is requeued by manager
+                continue
+
+            if await self._is_consumer_alive(owner):
+                min_idle = await self._get_reclaim_idle(fields) * 1000
+                if idle < min_idle:
+                    continue
+                logger.info(self, f'Task msg {msg_id} of consumer {owner} idle {idle} ms, reclaim it.')
+            else:
+                min_idle = self.reclaim_interval * 1000
+                logger.info(self, f'Consumer {owner} is dead, reclaim task msg {msg_id}.')
+
+            if delivery_count >= self.max_deliveries:
+                await self._dead_letter(stream, msg_id, fields,
+                                        f'Delivered {delivery_count} times, last consumer {owner}')
+                continue
+
+            claimed = await competition_mq.xclaim(stream, self.group, self.consumer, min_idle, msg_id)
+            for claimed_id, task_msg in claimed:
+                if not task_msg:
+                    # Message trimmed from stream, nothing to run
+                    await competition_mq.xack(stream, self.group, claimed_id)
+                    continue
+                logger.info(self, f'Reclaimed task from stream: [{stream}], msg_id: [{claimed_id}], '
+                                  f'task_msg: {task_msg}')
+                await self._task_slots.acquire()
+                self._submit(stream, claimed_id, task_msg)
+
+    @staticmethod
+    async def _is_leased(task_msg):
+        """
+        True if the task of the message holds a lease which is not expired.
+        """
+        if not task_msg or not task_msg.get('task_msg'):
+            return False
+        task_id = json.loads(task_msg.get('task_msg')).get('task_id')
+        lease = (await get_leases([task_id])).get(task_id)
+        return bool(lease) and lease.get('expire_at', 0) > time.time()
+
+    async def _get_reclaim_idle(self, task_msg):
+        task_clazz = None
+        if task_msg:
+            task_dict = json.loads(task_msg.get('task_msg'))
+            task_model = await get_model_by_id(TaskModel, task_dict.get('task_id'))
+            task_clazz = RegisteredTasks.get(task_model.name) if task_model else None
+        reclaim_idle = getattr(task_clazz, 'reclaim_idle', None)
+        return reclaim_idle or self.reclaim_idle
+
+    async def _dead_letter(self, stream, msg_id, task_msg, reason):
+        """
+        Poison message, route it to dead letter stream and fail the task, so job will not hang.
+        """
+        task_msg = task_msg or {}
+        dead_stream = f'{stream}_dead'
+        logger.error(self, f'Task msg {msg_id} go to dead letter stream {dead_stream}, '
+                           f'reason: {reason}, task_msg: {task_msg}')
+        await competition_mq.xadd(dead_stream, {
+            b'task_msg': (task_msg.get('task_msg') or '').encode('utf8'),
+            b'msg_id': msg_id.encode('utf8'),
+            b'reason': reason.encode('utf8'),
+        }, max_len=self.stream_maxlen)
+        await competition_mq.xack(stream, self.group, msg_id)
+        if not task_msg.get('task_msg'):
+            return
 
-            while self.enable:
-                async for new_task in competition_mq.xread_group(stream_id=self.stream,
-                                                                 group=self.group,
-                                                                 consumer=consumer,
-                                                                 count=1,
-                                                                 timeout=self.timeout):
-                    if not new_task:
-                        continue
-
-                    try:
-                        # Run task
-                        stream_id, msg_id, task_msg = new_task
-                        logger.info(self,
-                                    f'Receive task from stream: [{stream_id}], msg_id: [{msg_id}], task_msg: {task_msg}')
-                        await asyncio.gather(self._doing_task(task_msg))
-
-                    except Exception as e:
-                        logger.info(self, f'Run into exception, Error: {e}.\n'
-                                          f'{traceback.format_exc()}')
-
-        return [_run(seq) for seq in range(self.concurrent)]
+        task_dict = json.loads(task_msg.get('task_msg'))
+        task_model = await get_model_by_id(TaskModel, task_dict.get('task_id'))
+        if task_model:
+            await fail_running_task(task_model, f'Dead letter, {reason}')
+
+    async def _clean_consumers(self):
+        """
+        Deleting a consumer drops its pending messages, only delete consumers without pending.
+        """
+        for stream in self.streams:
+            consumers = await competition_mq.xgroup_get_consumers(stream, self.group) or []
+            for consumer_info in consumers:
+                consumer_info = dict(zip(consumer_info[::2], consumer_info[1::2]))
+                consumer_id = consumer_info.get('name')
+                if consumer_id in self.consumer_list and not int(consumer_info.get('pending', 0)):
+                    await competition_mq.xgroup_del_consumer(stream, self.group, consumer_id)
 
     async def _watch_dog(self):
+        standby = None
         while True:
             if self.lock_iden:
                 ttl = await redlock.get_lock_ttl(self.lock_key, self.lock_iden)
@@ -200,12 +452,14 @@ class Worker:
                 await redlock.acquire_lock(self.lock_key, self.lock_timeout, self.lock_iden)
                 if not self.enable:
                     break
+                await self._keep_consumers_alive()
                 logger.debug(self, f'{self.name} is working hard...')
             elif not await redlock.is_locked(self.lock_key):
                 logger.info(self, f'{self.name} starts working...')
                 self.lock_iden = await redlock.acquire_lock(self.lock_key, self.lock_timeout)
                 self.enable = True
-                await asyncio.gather(*self._standby())
+                # Keep watching, lock and consumers should be renewed while working
+                standby = asyncio.ensure_future(asyncio.gather(*self._standby()))
             else:
                 sleep_time = self.lock_timeout
                 logger.debug(self, f'Worker {self.name} already in use, '
@@ -214,12 +468,12 @@ class Worker:
 
             await asyncio.sleep(self.lock_timeout / 2)
 
+        if standby:
+            await standby
+
     async def _shutdown(self, sig, loop):
         logger.info(self, f'Start shutdown worker {self.name}, signal {sig.name}')
         self.enable = False
-        xgroup_del_tasks = [competition_mq.xgroup_del_consumer(self.stream, self.group, consumer_id)
-                            for consumer_id in self.consumer_list]
-        await asyncio.gather(*xgroup_del_tasks)
         remain_tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
         for task in remain_tasks:
             logger.debug(self, f'Remain task {task.get_coro().__name__}')
@@ -228,6 +482,9 @@ class Worker:
         remain_tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
 
         await asyncio.gather(*remain_tasks, return_exceptions=True)
+        await self._clean_consumers()
+        await http_sessions.close()
+        await ssh_pool.close()
         if self.lock_iden:
             await asyncio.gather(redlock.release_lock(self.lock_key, self.lock_iden))
             logger.debug(self, f'Unlock worker lock {self.lock_key}')
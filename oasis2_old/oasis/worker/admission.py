@@ -0,0 +1,197 @@
+import re
+import time
+
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+
+
+def _prepare(func):
+    async def __inner(self, *args, **kwargs):
+        if not self._admit_sha1:
+            script = self.ADMIT_SCRIPT
+            script = re.sub(r'^\s+', '', script, flags=re.M).strip()
+            self._admit_sha1 = await redis_client.script_load(script)
+
+            script = self.RELEASE_SCRIPT
+            script = re.sub(r'^\s+', '', script, flags=re.M).strip()
+            self._release_sha1 = await redis_client.script_load(script)
+
+            script = self.DEFER_SCRIPT
+            script = re.sub(r'^\s+', '', script, flags=re.M).strip()
+            self._defer_sha1 = await redis_client.script_load(script)
+
+        res = await func(self, *args, **kwargs)
+        return res
+
+    return __inner
+
+
+def _parse_map(value):
+    """
+    'a:1, b:2' -> {'a': '1', 'b': '2'}
+    """
+    items = [item.split(':', 1) for item in (value or '').split(',') if ':' in item]
+    return {k.strip(): v.strip() for k, v in items}
+
+
+class LANE:
+    HIGH = 'high'
+    NORMAL = 'normal'
+    LOW = 'low'
+
+    # Dispatch order
+    ALL = [HIGH, NORMAL, LOW]
+
+
+class Admission:
+    """
+    Decide which ready tasks could be sent to workers now.
+
+    Priority lane: job name -> lane, tasks of every lane go to their own stream, workers
+                   read higher lanes first.
+    In-flight cap: tasks sent and not finished yet, per account (ksc_user_id) and per cluster.
+                   Tasks over the cap are put back into the ready set of the job.
+    Fair queuing:  jobs with deferred tasks wait in a queue per lane, ordered by the finish tag
+                   of weighted fair queuing over accounts, so one account launching many clusters
+                   could not starve the others. Manager drains waiting jobs before new ones.
+    """
+
+    # KEYS[1] - account in-flight zset, KEYS[2] - cluster in-flight zset, KEYS[3] - task owner hash
+    # ARGV[1] - now, ARGV[2] - stale before, ARGV[3] - account cap, ARGV[4] - cluster cap (0 unlimited)
+    # ARGV[5..] - task ids
+    # Return admitted task ids
+    ADMIT_SCRIPT = """
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+        redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+        local account_cap = tonumber(ARGV[3])
+        local cluster_cap = tonumber(ARGV[4])
+        local owner = cjson.encode({KEYS[1], KEYS[2]})
+        local admitted = {}
+        for i = 5, #ARGV do
+            local task_id = ARGV[i]
+            local account_full = account_cap > 0 and redis.call('ZCARD', KEYS[1]) >= account_cap
+            local cluster_full = cluster_cap > 0 and redis.call('ZCARD', KEYS[2]) >= cluster_cap
+            if account_full or cluster_full then
+                break
+            end
+            redis.call('ZADD', KEYS[1], ARGV[1], task_id)
+            redis.call('ZADD', KEYS[2], ARGV[1], task_id)
+            redis.call('HSET', KEYS[3], task_id, owner)
+            table.insert(admitted, task_id)
+        end
+        return admitted"""
+
+    # KEYS[1] - task owner hash
+    # ARGV[1..] - task ids
+    RELEASE_SCRIPT = """
+        for _, task_id in ipairs(ARGV) do
+            local owner = redis.call('HGET', KEYS[1], task_id)
+            if owner then
+                for _, key in ipairs(cjson.decode(owner)) do
+                    redis.call('ZREM', key, task_id)
+                end
+                redis.call('HDEL', KEYS[1], task_id)
+            end
+        end
+        return redis.status_reply('OK')"""
+
+    # KEYS[1] - waiting jobs zset of the lane, KEYS[2] - account finish tag hash of the lane
+    # ARGV[1] - job id, ARGV[2] - account, ARGV[3] - cost / weight
+    # Return finish tag of the job
+    DEFER_SCRIPT = """
+        local existing = redis.call('ZSCORE', KEYS[1], ARGV[1])
+        if existing then
+            return existing
+        end
+        local virtual_time = 0
+        local head = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+        if head[2] then
+            virtual_time = tonumber(head[2])
+        else
+            redis.call('DEL', KEYS[2])
+        end
+        local finish = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or 0)
+        local tag = math.max(virtual_time, finish) + tonumber(ARGV[3])
+        redis.call('HSET', KEYS[2], ARGV[2], tostring(tag))
+        redis.call('ZADD', KEYS[1], tag, ARGV[1])
+        return tostring(tag)"""
+
+    OWNER_KEY = '/oasis/admission/owner/'
+
+    def __init__(self):
+        self.account_cap = config.getint('manager', 'account_inflight', fallback=0)
+        self.cluster_cap = config.getint('manager', 'cluster_inflight', fallback=0)
+        # Sent tasks never released, e.g. worker crashed while failing the task
+        self.stale_timeout = config.getint('manager', 'inflight_timeout', fallback=7200)
+        self.job_lanes = _parse_map(config.get('manager', 'job_lanes', fallback=''))
+        self.account_weights = {k: float(v) for k, v in
+                                _parse_map(config.get('manager', 'account_weights', fallback='')).items()}
+        self._admit_sha1 = None
+        self._release_sha1 = None
+        self._defer_sha1 = None
+
+    def get_lane(self, job_name):
+        lane = self.job_lanes.get(job_name, LANE.NORMAL)
+        return lane if lane in LANE.ALL else LANE.NORMAL
+
+    @staticmethod
+    def _waiting_keys(lane):
+        return f'/oasis/admission/waiting/{lane}/', f'/oasis/admission/finish_tag/{lane}/'
+
+    @_prepare
+    async def admit(self, account, cluster_id, task_ids):
+        """
+        Return task ids could be sent now, in the given order.
+        """
+        if not task_ids:
+            return []
+        now = time.time()
+        res = await redis_client.evalsha(
+            self._admit_sha1,
+            keys=[f'/oasis/admission/account/{account}/', f'/oasis/admission/cluster/{cluster_id}/',
+                  self.OWNER_KEY],
+            args=[now, now - self.stale_timeout, self.account_cap, self.cluster_cap, *task_ids],
+        )
+        return list(res or [])
+
+    @_prepare
+    async def release(self, task_ids):
+        """
+        Task finished or failed, free its in-flight slots.
+        """
+        if not task_ids:
+            return
+        await redis_client.evalsha(self._release_sha1, keys=[self.OWNER_KEY], args=list(task_ids))
+
+    @_prepare
+    async def defer(self, job_id, lane, account, cost):
+        """
+        Queue the job until in-flight slots are freed, return its finish tag.
+        """
+        weight = self.account_weights.get(account, 1) or 1
+        res = await redis_client.evalsha(
+            self._defer_sha1,
+            keys=list(self._waiting_keys(lane)),
+            args=[job_id, account, cost / weight],
+        )
+        logger.debug(f'Job {job_id} of account {account} waits in lane {lane}, tag {res}')
+        return float(res)
+
+    async def get_waiting(self, count=100):
+        """
+        Return [(lane, job_id)], higher lanes and smaller finish tags first.
+        """
+        waiting = []
+        for lane in LANE.ALL:
+            waiting_key, _ = self._waiting_keys(lane)
+            job_ids = await redis_client.zrange(waiting_key, 0, count - 1) or []
+            waiting.extend((lane, job_id) for job_id in job_ids)
+        return waiting
+
+    async def done_waiting(self, job_id, lane):
+        waiting_key, _ = self._waiting_keys(lane)
+        await redis_client.zrem(waiting_key, job_id)
+
+
+admission = Admission()
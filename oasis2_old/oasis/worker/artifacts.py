@@ -0,0 +1,224 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import asyncssh
+
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+from oasis.worker.fanout import FanOut
+
+ARTIFACT_METRICS_KEY = '/oasis/artifacts/metrics/'
+ARTIFACT_TIMEOUT = config.getint('gringotts', 'artifact_timeout', fallback=1800)
+ARTIFACT_CONCURRENCY = config.getint('gringotts', 'artifact_concurrency', fallback=20)
+
+
+class Artifact:
+    def __init__(self, name, url, dest_path):
+        self.name = name
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = f'{dest_path}.part'
+        # Reference checksum and size, set by the first download
+        self.checksum = None
+        self.size = 0
+
+
+class ArtifactDistributor:
+    """
+    Artifacts of a provisioning, fetched from the repo once per subnet and pushed node to node
+    over the pooled ssh connections, instead of every node downloading from the repo.
+
+    Seed:     one node per subnet downloads the artifact. The download is checked against
+              `<url>.sha256` when the repo has one, the first download is the reference
+              checksum every other copy is checked against.
+    Tree:     every node holding the artifact pushes it to one node without it, so sources
+              double every round. The source node copies the file with scp to the internal ip
+              of the target, data never passes through the worker. The target checks the
+              checksum before moving the file in place, and downloads from the repo itself
+              when the push fails.
+    Key:      nodes authenticate each other with a key pair generated for this distribution,
+              the management key never leaves the worker. Every node gets the key pair when
+              it is probed, both are removed from every node when the distribution ends.
+    Skip:     nodes which already have the file with the reference checksum get nothing.
+    Metrics:  repo bytes saved compared with every node downloading, per artifact in the
+              return value and summed up in redis ARTIFACT_METRICS_KEY.
+
+        distributor = ArtifactDistributor(self, [Artifact('jdk', f'{repo}jdk.tar.gz', '/tmp/jdk.tar.gz')])
+        metrics = await distributor.distribute([(instance, ig.vpc_subnet_id), ...])
+    """
+
+    def __init__(self, task, artifacts):
+        self.task = task
+        self.artifacts = artifacts
+        # host key -> instance
+        self.instances = {}
+        # host key -> {dest path: checksum}
+        self.checksums = {}
+        self._transfers = asyncio.Semaphore(ARTIFACT_CONCURRENCY)
+        # Comment of the public key in authorized_keys and name of the private key file on nodes
+        self._key_name = f'oasis-artifacts-{uuid4().hex}'
+        self._key_path = f'~/.ssh/{self._key_name}'
+        self._key = asyncssh.generate_private_key('ssh-ed25519', comment=self._key_name)
+
+    async def _remote(self, host):
+        # A Remote holds one pooled connection at a time, every transfer takes its own
+        return await self.instances[host].remote()
+
+    async def distribute(self, instance_subnets):
+        """
+        :param instance_subnets: [(instance, subnet id)]
+        :return: {artifact name: metrics}
+        """
+        subnets = {}
+        for instance, subnet_id in instance_subnets:
+            self.instances[instance.id] = instance
+            subnets.setdefault(subnet_id, []).append(instance.id)
+        if not self.instances:
+            return {}
+
+        try:
+            self.checksums = await FanOut(self.task, 'probe_artifacts', retry_failed=False).run(
+                list(self.instances), self._probe)
+
+            metrics = await asyncio.gather(*[self._distribute(artifact, list(subnets.values()))
+                                             for artifact in self.artifacts])
+        finally:
+            await asyncio.gather(*[self._revoke(host) for host in self.instances])
+        return {artifact.name: artifact_metrics for artifact, artifact_metrics in zip(self.artifacts, metrics)}
+
+    async def _probe(self, host):
+        """
+        Install the key pair of this distribution on host, return checksums of artifacts it already has.
+        """
+        paths = ' '.join(artifact.dest_path for artifact in self.artifacts)
+        dirs = ' '.join(sorted({os.path.dirname(artifact.dest_path) for artifact in self.artifacts}))
+        public_key = self._key.export_public_key().decode().strip()
+        remote = await self._remote(host)
+        async with remote as conn:
+            _, stdout = await conn.execute(
+                f'mkdir -p {dirs} && (umask 077 && mkdir -p ~/.ssh && cat > {self._key_path} '
+                f'&& echo "{public_key}" >> ~/.ssh/authorized_keys) '
+                f'&& (sha256sum {paths} 2>/dev/null; true)',
+                input=self._key.export_private_key().decode())
+        checksums = {}
+        for line in (stdout or '').splitlines():
+            checksum, _, path = line.partition('  ')
+            checksums[path.strip()] = checksum
+        return checksums
+
+    async def _distribute(self, artifact, subnets):
+        metrics = {'fetched': 0, 'pushed': 0, 'skipped': 0}
+
+        # First seed sets the reference checksum
+        first_seed = subnets[0][0]
+        await self._fetch(artifact, first_seed)
+        metrics['fetched'] += 1
+
+        async def _subnet(hosts):
+            holders = [host for host in hosts
+                       if self.checksums[host].get(artifact.dest_path) == artifact.checksum]
+            metrics['skipped'] += len([host for host in holders if host != first_seed])
+            pending = [host for host in hosts if host not in holders]
+            if not holders:
+                seed = pending.pop(0)
+                await self._fetch(artifact, seed)
+                metrics['fetched'] += 1
+                holders = [seed]
+            await self._tree(artifact, holders, pending, metrics)
+
+        await asyncio.gather(*[_subnet(hosts) for hosts in subnets])
+
+        metrics.update({
+            'size': artifact.size,
+            'checksum': artifact.checksum,
+            'bytes_fetched': artifact.size * metrics['fetched'],
+            'bytes_pushed': artifact.size * metrics['pushed'],
+            'bytes_saved': artifact.size * (metrics['pushed'] + metrics['skipped']),
+        })
+        logger.info(self.task, f'Distribute artifact {artifact.name}, {metrics}.')
+        for field in ('bytes_fetched', 'bytes_pushed', 'bytes_saved', 'skipped'):
+            await redis_client.hincrby(ARTIFACT_METRICS_KEY, field, metrics[field])
+        return metrics
+
+    async def _tree(self, artifact, holders, pending, metrics):
+        sources = asyncio.Queue()
+        for host in holders:
+            sources.put_nowait(host)
+
+        async def _receive(target):
+            source = await sources.get()
+            try:
+                async with self._transfers:
+                    await self._push(artifact, source, target)
+                metrics['pushed'] += 1
+            except Exception as e:
+                logger.warn(self.task, f'Push artifact {artifact.name} from {source} to {target} failed, '
+                                       f'download from repo, Error: {e}')
+                await self._fetch(artifact, target)
+                metrics['fetched'] += 1
+            finally:
+                sources.put_nowait(source)
+            sources.put_nowait(target)
+
+        results = await asyncio.gather(*[_receive(host) for host in pending], return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+
+    async def _fetch(self, artifact, host):
+        """
+        Download the artifact from the repo on host, check it against the published and reference checksum.
+        """
+        remote = await self._remote(host)
+        async with remote as conn:
+            _, stdout = await conn.execute(
+                f'mkdir -p {os.path.dirname(artifact.dest_path)} '
+                f'&& wget -q -t 120 -T 20 -O {artifact.part_path} {artifact.url} '
+                f'&& sha256sum {artifact.part_path} | cut -d " " -f 1 && stat -c %s {artifact.part_path} '
+                f'&& (wget -q -T 20 -O - {artifact.url}.sha256 2>/dev/null | cut -d " " -f 1; true)',
+                timeout=ARTIFACT_TIMEOUT)
+            checksum, size, *published = stdout.split()
+            expected = published[0] if published else artifact.checksum
+            if expected and checksum != expected:
+                await conn.execute(f'rm -f {artifact.part_path}', raise_when_error=False)
+                raise Exception(f'Artifact {artifact.name} from {artifact.url} on {host} has checksum {checksum}, '
+                                f'expected {expected}')
+            await conn.execute(f'mv -f {artifact.part_path} {artifact.dest_path}')
+
+        if not artifact.checksum:
+            artifact.checksum = checksum
+            artifact.size = int(size)
+        self.checksums[host][artifact.dest_path] = checksum
+
+    async def _push(self, artifact, source, target):
+        """
+        Copy the artifact from source to target with scp run on source, then check it on target.
+        """
+        src_remote = await self._remote(source)
+        dst_remote = await self._remote(target)
+        async with src_remote as src:
+            await src.execute(
+                f'scp -q -i {self._key_path} -P {dst_remote.port} -o BatchMode=yes '
+                f'-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null '
+                f'{artifact.dest_path} root@{self.instances[target].internal_ip}:{artifact.part_path}',
+                timeout=ARTIFACT_TIMEOUT)
+        async with dst_remote as dst:
+            status, _ = await dst.execute(
+                f'echo "{artifact.checksum}  {artifact.part_path}" | sha256sum -c --quiet '
+                f'&& mv -f {artifact.part_path} {artifact.dest_path}', raise_when_error=False)
+            if status:
+                await dst.execute(f'rm -f {artifact.part_path}', raise_when_error=False)
+                raise Exception(f'Artifact {artifact.name} pushed from {source} to {target} does not match '
+                                f'checksum {artifact.checksum}')
+        self.checksums[target][artifact.dest_path] = artifact.checksum
+
+    async def _revoke(self, host):
+        try:
+            remote = await self._remote(host)
+            async with remote as conn:
+                await conn.execute(f'rm -f {self._key_path} '
+                                   f'&& sed -i "/ {self._key_name}$/d" ~/.ssh/authorized_keys')
+        except Exception as e:
+            logger.warn(self.task, f'Remove artifact key {self._key_name} from {host} failed, Error: {e}')
@@ -0,0 +1,55 @@
+import json
+
+from oasis.db.service import competition_mq
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+
+EVENT_STREAM = config.get('manager', 'event_stream', fallback='event_stream')
+EVENT_MAXLEN = config.getint('manager', 'event_maxlen', fallback=10000)
+
+
+class EVENT:
+    JobStarted = 'JobStarted'
+    TaskDone = 'TaskDone'
+    TaskFailed = 'TaskFailed'
+    TaskRolled = 'TaskRolled'
+    TaskRollFailed = 'TaskRollFailed'
+
+
+async def publish_task_event(event, job_id, task_id, **kwargs):
+    """
+    Tell managers that a task changed its state, so the job can be advanced
+    immediately instead of waiting for the next sweep.
+    Must be called after the task status is committed to db.
+    """
+    await publish_job_event(event, job_id, task_id=task_id, **kwargs)
+
+
+async def publish_job_event(event, job_id, **kwargs):
+    """
+    Same for a job, e.g. a new job is Doing, must be called after the job status is committed.
+    """
+    event_dict = {'event': event, 'job_id': job_id}
+    event_dict.update(kwargs)
+    try:
+        await competition_mq.xadd(stream_id=EVENT_STREAM,
+                                  fields={b'event_msg': json.dumps(event_dict).encode('utf8')},
+                                  max_len=EVENT_MAXLEN)
+    except Exception as e:
+        # Manager sweep will pick the job up anyway
+        logger.error(f'Publish task event failed, event {event_dict}, Error: {e}')
+
+
+async def read_task_events(latest_id='$', count=100, timeout=None, pool=None):
+    async for event in competition_mq.xread_from(stream_id=EVENT_STREAM,
+                                                 latest_id=latest_id,
+                                                 count=count,
+                                                 timeout=timeout,
+                                                 pool=pool):
+        _, msg_id, fields = event
+        try:
+            event_dict = json.loads(fields.get('event_msg'))
+        except Exception as e:
+            logger.error(f'Invalid task event {msg_id}, fields {fields}, Error: {e}')
+            event_dict = {}
+        yield msg_id, event_dict
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from oasis.db.models import get_model_by_id
+from oasis.db.models.task import TaskModel
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+from oasis.worker.lease import report_progress
+
+FANOUT_CONCURRENCY = config.getint('worker', 'fanout_concurrency', fallback=20)
+FANOUT_TIMEOUT = config.getint('worker', 'fanout_timeout', fallback=1800)
+FANOUT_PROGRESS_INTERVAL = config.getint('worker', 'fanout_progress_interval', fallback=5)
+
+
+class FanOutError(Exception):
+    def __init__(self, name, failures, total):
+        self.failures = failures
+        details = '; '.join(f'{key}: {error}' for key, error in failures.items())
+        super().__init__(f'{name} failed on {len(failures)} / {total} hosts. {details}')
+
+
+class FanOut:
+    """
+    Run one operation on many hosts of a task, e.g. ssh into every new instance.
+
+    Concurrency:   at most `concurrency` hosts at a time, instead of gathering all of them,
+                   so a large cluster does not open hundreds of ssh handshakes and downloads.
+    Timeout:       every host gets `timeout` seconds.
+    Failures:      every host runs even if some fail, FanOutError lists all failed hosts.
+    Retry failed:  progress is kept in results['fan_out'][name] of the task row, when the task
+                   runs again hosts which already succeeded are skipped.
+
+        results = await FanOut(self, 'install_gringotts').run(
+            instances, self.remote_install_gringotts_agent, key=lambda instance: instance.id)
+    """
+
+    def __init__(self, task, name, *, concurrency=None, timeout=None, retry_failed=True):
+        self.task = task
+        self.name = name
+        self.concurrency = concurrency or FANOUT_CONCURRENCY
+        self.timeout = timeout or FANOUT_TIMEOUT
+        self.retry_failed = retry_failed
+        self.progress = None
+        self._task_results = {}
+        self._flushed_at = 0
+        self._flush_lock = asyncio.Lock()
+
+    async def _load(self):
+        if not self.task.task_id:
+            return {}
+        task_model = await get_model_by_id(TaskModel, self.task.task_id)
+        self._task_results = dict(task_model.results or {}) if task_model else {}
+        return self._task_results.get('fan_out', {}).get(self.name, {})
+
+    async def _flush(self, force=False):
+        report_progress(f'{self.name}: {len(self.progress["succeeded"])} / {self.progress["total"]} succeeded, '
+                        f'{len(self.progress["failed"])} failed, {self.progress["running"]} running')
+        if not self.task.task_id or (not force and self._flush_lock.locked()):
+            return
+        async with self._flush_lock:
+            if not force and time.monotonic() - self._flushed_at < FANOUT_PROGRESS_INTERVAL:
+                return
+            self._flushed_at = time.monotonic()
+            fan_out = dict(self._task_results.get('fan_out', {}), **{self.name: self.progress})
+            self._task_results['fan_out'] = fan_out
+            task_model = TaskModel()
+            task_model.id = self.task.task_id
+            try:
+                await task_model.update_columns({'results': self._task_results})
+            except Exception as e:
+                logger.error(f'Write fan out progress of task {self.task.task_id} failed, Error: {e}')
+
+    async def run(self, hosts, func, key=str):
+        """
+        Run func(host) for every host, return {key(host): result} of hosts run this time.
+        """
+        hosts = {key(host): host for host in hosts}
+        last = await self._load() if self.retry_failed else {}
+        succeeded = [k for k in last.get('succeeded', []) if k in hosts]
+        if succeeded:
+            logger.info(self.task, f'{self.name}: skip {len(succeeded)} hosts succeeded in the last run.')
+
+        self.progress = {'total': len(hosts), 'succeeded': succeeded, 'failed': {}, 'running': 0}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+
+        async def _run_one(host_key, host):
+            async with semaphore:
+                self.progress['running'] += 1
+                started_at = time.monotonic()
+                try:
+                    results[host_key] = await asyncio.wait_for(func(host), timeout=self.timeout)
+                    self.progress['succeeded'].append(host_key)
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        e = f'Timeout after {self.timeout} s'
+                    logger.error(self.task, f'{self.name} failed on {host_key} after '
+                                            f'{time.monotonic() - started_at:.1f} s, Error: {e}')
+                    self.progress['failed'][host_key] = str(e)
+                finally:
+                    self.progress['running'] -= 1
+            await self._flush()
+
+        await asyncio.gather(*[_run_one(host_key, host) for host_key, host in hosts.items()
+                               if host_key not in succeeded])
+        await self._flush(force=True)
+
+        if self.progress['failed']:
+            raise FanOutError(self.name, self.progress['failed'], len(hosts))
+        return results
@@ -0,0 +1,264 @@
+import asyncio
+from contextvars import ContextVar
+import json
+import re
+import time
+
+from oasis.db.models import get_model_by_id
+from oasis.db.models.job import JobModel
+from oasis.db.models.task import TaskModel
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+from oasis.utils.generator import gen_uuid4
+from oasis.utils.logger import logger
+from oasis.utils.redlock import unlock_cluster
+from oasis.worker.admission import admission
+from oasis.worker.events import EVENT
+from oasis.worker.events import publish_task_event
+
+LEASE_TIMEOUT = config.getint('worker', 'lease_timeout', fallback=60)
+LEASE_HEARTBEAT = config.getint('worker', 'lease_heartbeat', fallback=10)
+LEASES_KEY = '/oasis/task/leases/'
+
+# Lease of the task running in current asyncio task, used to report progress
+current_lease = ContextVar('current_lease', default=None)
+
+
+def _lease_key(task_id):
+    return f'/oasis/task/lease/{task_id}'
+
+
+def _owner_key(task_id):
+    return f'/oasis/task/lease/{task_id}/owner'
+
+
+# Lease scripts, KEYS[1] - owner key, KEYS[2] - lease key, KEYS[3] - leases index
+# Acquire and renew, ARGV[1] - owner token, ARGV[2] - task id, ARGV[3] - lease json, ARGV[4] - expire at, ARGV[5] - keep seconds
+# Return 1 if written, 0 if the lease is held by another owner
+_WRITE_LEASE = """
+    redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[5])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    redis.call('ZADD', KEYS[3], ARGV[4], ARGV[2])
+    return 1"""
+
+ACQUIRE_SCRIPT = """
+    if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[5]) then
+        return 0
+    end""" + _WRITE_LEASE
+
+RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end""" + _WRITE_LEASE
+
+# Same KEYS as ACQUIRE_SCRIPT
+# ARGV[1] - owner token, ARGV[2] - task id
+RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('ZREM', KEYS[3], ARGV[2])
+    return 1"""
+
+_script_sha1 = {}
+
+
+async def _eval(script, task_id, *args):
+    """
+    Run a lease script, loaded again if redis lost it. None if redis could not run it.
+    """
+    keys = [_owner_key(task_id), _lease_key(task_id), LEASES_KEY]
+    for _ in range(2):
+        if script not in _script_sha1:
+            _script_sha1[script] = await redis_client.script_load(re.sub(r'^\s+', '', script, flags=re.M).strip())
+        res = await redis_client.evalsha(_script_sha1[script], keys=keys, args=list(args))
+        if res is not None:
+            return res
+        _script_sha1.pop(script, None)
+    return None
+
+
+class TaskLease:
+    """
+    Renewable lease of a running task.
+
+    Worker holds the lease while the task runs and renews it every heartbeat,
+    lease data is kept in redis, and the expire time is indexed in LEASES_KEY,
+    so managers could find tasks whose worker stopped beating.
+
+    Ownership: a lease is taken only if no one holds it, with an owner token of this
+    delivery. Renew and release check the token, a worker which finds its lease taken
+    by another owner (e.g. requeued after a late heartbeat) cancels its run of the task.
+
+        lease = TaskLease(task_id, worker=..., stream=..., msg_id=..., task_msg=...)
+        if await lease.acquire():
+            lease.start()
+            ...
+            await lease.release()  # or lease.stop(), let manager requeue the task
+    """
+
+    def __init__(self, task_id, *, worker, consumer, stream, msg_id, task_msg,
+                 attempt=0, timeout=None, heartbeat=None):
+        self.task_id = task_id
+        self.worker = worker
+        self.consumer = consumer
+        self.stream = stream
+        self.msg_id = msg_id
+        self.task_msg = task_msg
+        self.attempt = attempt
+        self.timeout = timeout or LEASE_TIMEOUT
+        self.heartbeat = heartbeat or LEASE_HEARTBEAT
+        self.started_at = time.time()
+        self.heartbeat_at = None
+        self.progress = None
+        self.owner = f'{consumer}/{gen_uuid4()}'
+        self._beating = None
+        self._running = None
+
+    def to_dict(self):
+        return {
+            'task_id': self.task_id,
+            'worker': self.worker,
+            'consumer': self.consumer,
+            'stream': self.stream,
+            'msg_id': self.msg_id,
+            'task_msg': self.task_msg,
+            'owner': self.owner,
+            'attempt': self.attempt,
+            'started_at': self.started_at,
+            'heartbeat_at': self.heartbeat_at,
+            'expire_at': self.heartbeat_at + self.timeout,
+            'progress': self.progress,
+        }
+
+    async def _write(self, script):
+        self.heartbeat_at = time.time()
+        lease = self.to_dict()
+        # Keep lease data a little longer than its index, manager needs it to requeue
+        return await _eval(script, self.task_id, self.owner, self.task_id, json.dumps(lease),
+                           lease['expire_at'], self.timeout * 10)
+
+    async def acquire(self):
+        """
+        Take the lease, False if another worker holds it, None if redis could not be reached.
+        """
+        res = await self._write(ACQUIRE_SCRIPT)
+        return None if res is None else res == 1
+
+    async def renew(self):
+        """
+        False if the lease is held by another owner now.
+        """
+        res = await self._write(RENEW_SCRIPT)
+        if res is None:
+            raise Exception('Redis not available')
+        return res == 1
+
+    def start(self):
+        """
+        Start beating, the current asyncio task is cancelled if the lease is lost.
+        """
+        self._running = asyncio.current_task()
+        self._beating = asyncio.ensure_future(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                if not await self.renew():
+                    logger.error(f'Lease of task {self.task_id} is held by another owner, cancel running it')
+                    if self._running:
+                        self._running.cancel()
+                    return
+            except Exception as e:
+                # Lease expires if redis stays unavailable, manager will requeue the task
+                logger.error(f'Renew lease of task {self.task_id} failed, Error: {e}')
+
+    def stop(self):
+        """
+        Stop beating but keep the lease, it expires and the task is requeued by manager.
+        """
+        if self._beating:
+            self._beating.cancel()
+
+    async def release(self):
+        self.stop()
+        await drop_lease(self.task_id, owner=self.owner)
+
+
+def report_progress(progress):
+    """
+    Update progress of the running task, written with the next heartbeat.
+    """
+    lease = current_lease.get()
+    if lease:
+        lease.progress = progress
+
+
+async def get_leases(task_ids):
+    """
+    Return {task_id: lease dict} of running tasks.
+    """
+    if not task_ids:
+        return {}
+    leases = await redis_client.mget(*[_lease_key(task_id) for task_id in task_ids])
+    return {task_id: json.loads(lease) for task_id, lease in zip(task_ids, leases or []) if lease}
+
+
+async def claim_expired_leases(count=100):
+    """
+    Pop leases whose heartbeat stopped, only one manager could claim a lease.
+    Return [lease dict], only task_id is in the dict if lease data is already gone.
+    """
+    now = time.time()
+    task_ids = await redis_client.zrangebyscore(LEASES_KEY, max=now, offset=0, count=count)
+    expired = []
+    for task_id in task_ids or []:
+        if not await redis_client.zrem(LEASES_KEY, task_id):
+            continue
+        lease = await redis_client.get(_lease_key(task_id))
+        lease = json.loads(lease) if lease else {'task_id': task_id}
+        if lease.get('expire_at', 0) > now:
+            # Renewed just now, next heartbeat indexes it again
+            continue
+        expired.append(lease)
+    return expired
+
+
+async def drop_lease(task_id, owner=None):
+    """
+    Drop the lease of a task, only if it is still held by owner when given.
+    """
+    if owner:
+        return await _eval(RELEASE_SCRIPT, task_id, owner, task_id) == 1
+    await redis_client.zrem(LEASES_KEY, task_id)
+    await redis_client.delete(_owner_key(task_id), _lease_key(task_id))
+    return True
+
+
+async def fail_running_task(task_model, reason):
+    """
+    Fail a task that could not finish, e.g. poison message or lease expired too many times,
+    so the job rolls back or turns to Error instead of hanging in Doing.
+    """
+    if task_model.status == TaskModel.STATUS.Doing:
+        task_status, event = TaskModel.STATUS.Failed, EVENT.TaskFailed
+    elif task_model.status == TaskModel.STATUS.Rolling:
+        task_status, event = TaskModel.STATUS.RollFailed, EVENT.TaskRollFailed
+    else:
+        return
+
+    logger.error(f'Fail task {task_model.id} of job {task_model.job_id}, reason: {reason}')
+    await task_model.update_columns({'status': task_status, 'info': reason})
+    await drop_lease(task_model.id)
+    await admission.release([task_model.id])
+    job_model = await get_model_by_id(JobModel, model_id=task_model.job_id)
+    # Same as a task failed on worker, see Worker._doing_task
+    if task_status == TaskModel.STATUS.Failed and task_model.rollback_on_fail:
+        if job_model.status in (JobModel.STATUS.Doing, JobModel.STATUS.Error):
+            await job_model.update_columns({'status': JobModel.STATUS.Rolling})
+    elif job_model.status in (JobModel.STATUS.Doing, JobModel.STATUS.Rolling):
+        await job_model.update_columns({'status': JobModel.STATUS.Error})
+        await unlock_cluster(job_model.cluster_id, job_model.id)
+    await publish_task_event(event, job_model.id, task_model.id, cluster_id=job_model.cluster_id)
@@ -1,56 +1,234 @@
 import asyncio
 import json
 import signal
+import time
+import traceback
+import weakref
 
+from oasis.db.models import get_model_by_id
 from oasis.db.models import model_query
+from oasis.db.models.blob import BLOB_SWEEP_KEY
+from oasis.db.models.blob import task_blobs
+from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.job import JobModel
 from oasis.db.models.task import TaskModel
 from oasis.db.service import competition_mq
+from oasis.db.service import new_blocking_client
+from oasis.db.service import redis_client
+from oasis.utils.cache import AsyncCache
+from oasis.utils.config import config
+from oasis.utils.generator import gen_task_stream
+from oasis.utils.hashring import HashRing
+from oasis.utils.http import http_sessions
 from oasis.utils.logger import logger
 from oasis.utils.redlock import lock_cluster
-from oasis.utils.redlock import redlock
 from oasis.utils.redlock import unlock_cluster
 from oasis.utils.sdk import feishu_client
 from oasis.worker import TaskSendFeishu
-from oasis.worker.planner import get_next_rollbacks_from_db
-from oasis.worker.planner import get_next_tasks_from_db
+from oasis.worker.admission import admission
+from oasis.worker.events import read_task_events
+from oasis.worker.lease import claim_expired_leases
+from oasis.worker.lease import drop_lease
+from oasis.worker.lease import fail_running_task
+from oasis.worker.planner import get_next_rollbacks
+from oasis.worker.planner import get_next_tasks
+from oasis.worker.scheduler import scheduler
 from oasis.worker.tasks import del_job_context
-from oasis.worker.tasks import get_job_context
-from oasis.worker.tasks import set_job_context
+from oasis.worker.tasks import read_job_context
+from oasis.worker.tasks import write_job_context
 
 
 class Manager:
     def __init__(self, name, **conf):
         self.name = name
         self.stream = conf.get('stream', 'default_stream')
+        self.stream_maxlen = int(conf.get('stream_maxlen', 100000))
         self.interval = int(conf.get('interval', 10))
+        self.sweep_interval = int(conf.get('sweep_interval', 60))
+        self.event_timeout = int(conf.get('event_timeout', 5))
         self.enable = True
-        self.lock_key = conf.get('manager_lock', '/oasis/manager_lock/kes')
-        self.lock_iden = None
-        self.lock_timeout = self.interval * 3
+        self.members_key = conf.get('members_key', '/oasis/manager_members/kes')
+        self.heartbeat_interval = int(conf.get('heartbeat_interval', 2))
+        self.member_timeout = int(conf.get('member_timeout', 10))
+        self.members = []
+        self.ring = HashRing(n_num=int(conf.get('virtual_nodes', 64)))
+        self._last_sweep = 0
+        # Dropped once no check of the job holds it, whatever status the job ends in
+        self._job_locks = weakref.WeakValueDictionary()
+        # cluster_id -> ksc_user_id, for in-flight caps of account
+        self._accounts = AsyncCache(ttl=int(conf.get('account_ttl', 300)), refresh_ahead=0, maxsize=10000,
+                                    name='accounts')
+        # Tasks whose worker stopped renewing the lease are requeued, then failed
+        self.max_requeue = int(conf.get('max_requeue', 2))
+        self.worker_group = config.get('worker', 'group', fallback='group')
+
+    async def _keep_alive(self):
+        """
+        Register membership, all alive managers share jobs over a hash ring.
+        """
+        while self.enable:
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                logger.error(self, f'Manager heartbeat failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _heartbeat(self):
+        now = time.time()
+        await redis_client.zadd(self.members_key, now, self.name)
+        await redis_client.zremrangebyscore(self.members_key, max=now - self.member_timeout)
+        members = sorted(await redis_client.zrange(self.members_key) or [])
+        if self.name not in members:
+            # Redis unavailable, do not take jobs of others
+            members = []
+        if members == self.members:
+            return
+
+        logger.info(self, f'Manager members changed, {self.members} -> {members}, rebalance jobs.')
+        for gone in set(self.members) - set(members):
+            self.ring.remove_node(gone)
+        self.ring.add_node(*[joined for joined in members if joined not in self.members])
+        self.members = members
+        # Take over jobs of gone managers right now
+        self._last_sweep = 0
+
+    def _is_owner(self, job_id, cluster_id=None):
+        # Jobs of one cluster are serialized by cluster lock, keep them on the same manager
+        return self.ring.get_node(cluster_id or job_id) == self.name
 
     async def _start_manager(self):
-        logger.info(self, f'Start manager, name: {self.name}, stream: {self.stream}, interval: {self.interval}')
+        logger.info(self, f'Start manager, name: {self.name}, stream: {self.stream}, interval: {self.interval}, '
+                          f'sweep interval: {self.sweep_interval}')
         while self.enable:
-            if self.lock_iden:
-                ttl = await redlock.get_lock_ttl(self.lock_key, self.lock_iden)
-                if not ttl:
-                    logger.info(self, f'Acquire lock ttl failed! Lock key {self.lock_key}, '
-                                      f'identifier {self.lock_iden}, ttl {ttl}')
-                    self.lock_iden = None
-                    continue
-                await redlock.acquire_lock(self.lock_key, self.lock_timeout, self.lock_iden)
-                await self._check_jobs()
-            elif not await redlock.is_locked(self.lock_key):
-                self.lock_iden = await redlock.acquire_lock(self.lock_key, self.lock_timeout)
-                await self._check_jobs()
+            if self.name in self.members:
+                await self._drain_waiting()
+                await self._sweep_jobs()
+                await self._check_leases()
             else:
-                sleep_time = self.lock_timeout + self.interval
-                logger.info(self, f'Stand by {sleep_time} s...')
-                await asyncio.sleep(sleep_time)
+                logger.debug(self, f'Manager {self.name} not registered yet, stand by...')
 
             await asyncio.sleep(self.interval)
 
+    async def _sweep_blobs(self):
+        """
+        Delete blobs of task args and results no task references, by one manager every blob sweep interval.
+        """
+        while self.enable:
+            try:
+                if self.name in self.members and await redis_client.set(
+                        BLOB_SWEEP_KEY, self.name, expire=task_blobs.sweep_interval, exist='SET_IF_NOT_EXIST'):
+                    deleted = await task_blobs.sweep()
+                    logger.info(self, f'Sweep blobs, {deleted} deleted.')
+            except Exception as e:
+                logger.error(self, f'Sweep blobs failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+            await asyncio.sleep(self.interval)
+
+    async def _check_leases(self):
+        try:
+            expired_leases = await claim_expired_leases()
+        except Exception as e:
+            logger.error(self, f'Claim expired task leases failed, Error: {e}')
+            return
+        for lease in expired_leases:
+            try:
+                await self._expire_lease(lease)
+            except Exception as e:
+                logger.error(self, f'Handle expired lease {lease} failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+
+    async def _expire_lease(self, lease):
+        """
+        Worker of the task is gone or hangs, deliver the task again, fail it if requeued too many times.
+        """
+        task_id = lease.get('task_id')
+        task_model = await get_model_by_id(TaskModel, task_id)
+        if not task_model or task_model.status not in (TaskModel.STATUS.Doing, TaskModel.STATUS.Rolling):
+            await drop_lease(task_id)
+            return
+
+        attempt = int(lease.get('attempt') or 0) + 1
+        if not lease.get('task_msg') or attempt > self.max_requeue:
+            await fail_running_task(task_model, f'Lease expired, worker {lease.get("worker")}, '
+                                                f'last heartbeat {lease.get("heartbeat_at")}, '
+                                                f'progress {lease.get("progress")}, attempt {attempt}')
+            return
+
+        logger.info(self, f'Lease of task {task_id} expired, worker {lease.get("worker")}, '
+                          f'requeue it, attempt {attempt}')
+        # Old message is done with, worker reclaim must not deliver it again
+        await competition_mq.xack(lease['stream'], self.worker_group, lease['msg_id'])
+        # Before the new message, so the lease taken by the next worker is never dropped here.
+        # A worker still running with the old lease finds it gone and cancels its run.
+        await drop_lease(task_id, owner=lease.get('owner'))
+        task_dict = json.loads(lease['task_msg'])
+        task_dict['attempt'] = attempt
+        send_dict = json.dumps(task_dict)
+        await competition_mq.xadd(stream_id=lease['stream'], fields={b'task_msg': send_dict.encode('utf8')},
+                                  max_len=self.stream_maxlen)
+
+    async def _sweep_jobs(self):
+        """
+        Events from workers drive jobs forward, the periodic sweep is only a safety net
+        for lost events, e.g. manager restarted or redis failover.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        try:
+            await self._check_jobs()
+        except Exception as e:
+            logger.error(self, f'Sweep jobs failed, Error: {e}.\n'
+                               f'{traceback.format_exc()}')
+
+    async def _watch_events(self):
+        latest_id = '$'
+        blocking_client = new_blocking_client()
+        while self.enable:
+            if self.name not in self.members:
+                latest_id = '$'
+                await asyncio.sleep(self.interval)
+                continue
+
+            job_ids = []
+            try:
+                async for msg_id, event in read_task_events(latest_id=latest_id,
+                                                            timeout=self.event_timeout * 1000,
+                                                            pool=blocking_client):
+                    latest_id = msg_id
+                    job_id = event.get('job_id', None)
+                    cluster_id = event.get('cluster_id', None)
+                    if not job_id or job_id in job_ids:
+                        continue
+                    if cluster_id and not self._is_owner(job_id, cluster_id):
+                        continue
+                    job_ids.append(job_id)
+            except Exception as e:
+                logger.error(self, f'Read task events failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+                await asyncio.sleep(self.interval)
+                continue
+
+            if job_ids:
+                logger.debug(self, f'Receive task events of jobs {job_ids}')
+                # Finished tasks free in-flight slots, waiting jobs go first
+                await self._drain_waiting()
+                await asyncio.gather(*[self._check_job_by_id(job_id) for job_id in job_ids],
+                                     return_exceptions=True)
+
+    async def _check_job_by_id(self, job_id):
+        try:
+            job = await get_model_by_id(JobModel, job_id)
+            if not job or not self._is_owner(job.id, job.cluster_id):
+                return
+            if job.status in [JobModel.STATUS.Doing, JobModel.STATUS.Rolling]:
+                await self._check_job(job)
+        except Exception as e:
+            logger.error(self, f'Check job {job_id} failed, Error: {e}.\n'
+                               f'{traceback.format_exc()}')
+
     async def _check_jobs(self):
         logger.info(self, f'Start checking jobs...')
         jobs_query = model_query(JobModel)
@@ -58,75 +236,201 @@ class Manager:
                                              .in_([JobModel.STATUS.Doing, JobModel.STATUS.Rolling])
                                              ).query_all()
         for undone_job in undone_jobs:
+            if not self._is_owner(undone_job.id, undone_job.cluster_id):
+                continue
             logger.debug(self, f'==wuhsh==undone_jobs==>{undone_job.to_dict()}')
+            try:
+                await self._check_job(undone_job, sweep=True)
+            except Exception as e:
+                # One broken job must not stop the sweep of the others
+                logger.error(self, f'Check job {undone_job.id} failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
 
-            job_id = undone_job.id
-            cluster_id = undone_job.cluster_id
-            if undone_job.status == JobModel.STATUS.Doing:
-                next_exec_tasks = await get_next_tasks_from_db(job_id)
-                if next_exec_tasks == 'All Done':
-                    logger.info(self, f'job finished!')
-                    await undone_job.save({'status': JobModel.STATUS.Done})
-                    pre_job_context = await get_job_context(job_id)
-                    await del_job_context(job_id)
-                    await unlock_cluster(cluster_id, job_id)
-
-                    sub_jobs_query = model_query(JobModel)
-                    sub_jobs = await sub_jobs_query \
-                        .filter(JobModel.status == JobModel.STATUS.Init) \
-                        .filter(JobModel.parent_job == job_id) \
-                        .query_all()
-
-                    for sub_job in sub_jobs:
-                        await set_job_context(sub_job.id, pre_job_context)
-                        await sub_job.save({'status': JobModel.STATUS.Doing})
+    async def _check_job(self, undone_job, sweep=False):
+        job_id = undone_job.id
+        # Sweep and events may check the same job at the same time
+        job_lock = self._job_locks.setdefault(job_id, asyncio.Lock())
+        async with job_lock:
+            await self._advance_job(undone_job, sweep)
 
-                    continue
-                if next_exec_tasks:
-                    logger.info(self, f'Job {job_id}, send next exec tasks, {next_exec_tasks}')
-                    await lock_cluster(cluster_id, job_id)
-                    await self._send_tasks(next_exec_tasks, 'exec')
-
-            elif undone_job.status == JobModel.STATUS.Rolling:
-                query = model_query(TaskModel)
-                doing_tasks = await query.where(TaskModel.job_id == job_id).where(
-                    TaskModel.status == TaskModel.STATUS.Doing).query_all()
-                if doing_tasks:
-                    logger.info(self, f'Rollback job {job_id} waiting executing tasks to be done...')
-                    continue
+    async def _is_stalled(self, job_id, direction):
+        """
+        Nothing ready and nothing running, but job not finished.
+        Claimed tasks may be lost if manager crashed before sending them.
+        """
+        running_status = TaskModel.STATUS.Doing \
+            if direction == scheduler.DIRECTION.Exec else TaskModel.STATUS.Rolling
+        running_count = await model_query(TaskModel) \
+            .filter(TaskModel.job_id == job_id) \
+            .filter(TaskModel.status == running_status) \
+            .count()
+        if running_count:
+            return False
+        logger.info(self, f'Job {job_id} {direction} schedule stalled, rebuild from db.')
+        await scheduler.reset(job_id, direction)
+        return True
 
-                next_roll_tasks = await get_next_rollbacks_from_db(job_id)
-                if next_roll_tasks == 'All Rolled':
-                    logger.info(self, f'job rolled back!')
-                    await undone_job.save({'status': JobModel.STATUS.Rolled})
-                    await del_job_context(job_id)
-                    await unlock_cluster(cluster_id, job_id)
-                    await TaskSendFeishu(job_id=job_id, args={
-                        'state': feishu_client.STATE.ROLLED,
-                        'cluster_id': cluster_id,
-                    }).run()
-                    continue
-                if next_roll_tasks:
-                    logger.info(self, f'Job {job_id}, send next roll tasks, {next_roll_tasks}')
-                    if await lock_cluster(cluster_id, job_id):
-                        await self._send_tasks(next_roll_tasks, 'rollback')
+    async def _advance_job(self, undone_job, sweep=False):
+        job_id = undone_job.id
+        cluster_id = undone_job.cluster_id
+        if undone_job.status == JobModel.STATUS.Doing:
+            next_exec_tasks = await get_next_tasks(job_id)
+            if next_exec_tasks == [] and sweep and await self._is_stalled(job_id, scheduler.DIRECTION.Exec):
+                next_exec_tasks = await get_next_tasks(job_id)
+
+            if next_exec_tasks == 'All Done':
+                logger.info(self, f'job finished!')
+                await undone_job.update_columns({'status': JobModel.STATUS.Done})
+                await scheduler.reset(job_id)
+                # Raw fields, blobs are shared by ref
+                pre_job_context = await read_job_context(job_id)
+                await del_job_context(job_id)
+                await unlock_cluster(cluster_id, job_id)
+
+                sub_jobs_query = model_query(JobModel)
+                sub_jobs = await sub_jobs_query \
+                    .filter(JobModel.status == JobModel.STATUS.Init) \
+                    .filter(JobModel.parent_job == job_id) \
+                    .query_all()
+
+                for sub_job in sub_jobs:
+                    await write_job_context(sub_job.id, pre_job_context)
+                    await sub_job.update_columns({'status': JobModel.STATUS.Doing})
+                    await self._check_job(sub_job)
+
+                return True
+            if next_exec_tasks:
+                logger.info(self, f'Job {job_id}, send next exec tasks, {next_exec_tasks}')
+                await lock_cluster(cluster_id, job_id)
+                await self._send_tasks(undone_job, next_exec_tasks, 'exec')
+
+        elif undone_job.status == JobModel.STATUS.Rolling:
+            # Rollback schedule is built once executing tasks are done
+            next_roll_tasks = await get_next_rollbacks(job_id)
+            if next_roll_tasks == [] and sweep and await self._is_stalled(job_id, scheduler.DIRECTION.Rollback):
+                next_roll_tasks = await get_next_rollbacks(job_id)
+
+            if next_roll_tasks == 'All Rolled':
+                logger.info(self, f'job rolled back!')
+                await undone_job.update_columns({'status': JobModel.STATUS.Rolled})
+                await scheduler.reset(job_id)
+                await del_job_context(job_id)
+                await unlock_cluster(cluster_id, job_id)
+                await TaskSendFeishu(job_id=job_id, args={
+                    'state': feishu_client.STATE.ROLLED,
+                    'cluster_id': cluster_id,
+                }).run()
+                return True
+            if next_roll_tasks:
+                logger.info(self, f'Job {job_id}, send next roll tasks, {next_roll_tasks}')
+                if await lock_cluster(cluster_id, job_id):
+                    await self._send_tasks(undone_job, next_roll_tasks, 'rollback')
+                else:
+                    await scheduler.release(job_id, scheduler.DIRECTION.Rollback, next_roll_tasks)
+
+        return False
 
     async def _shutdown(self, sig, loop):
         logger.info(self, f'Start shutdown manager {self.name}, signal {sig.name}')
         self.enable = False
-        await redlock.release_lock(self.lock_key, self.lock_iden)
+        # Let other managers take over jobs right now
+        await redis_client.zrem(self.members_key, self.name)
+
+    async def _get_account(self, cluster_id):
+        if not cluster_id:
+            return ''
+
+        async def _load():
+            cluster = await get_model_by_id(ClusterModel, cluster_id)
+            return cluster.ksc_user_id if cluster else ''
+
+        return await self._accounts.get(cluster_id, _load)
+
+    async def _admit_tasks(self, job, tasks, direction):
+        """
+        Keep in-flight caps of account and cluster, tasks over the cap stay ready
+        and the job waits in fair queue of its lane. A job without cluster is its own
+        account and cluster, so such jobs never share a cap.
+        """
+        lane = admission.get_lane(job.name)
+        try:
+            account = await self._get_account(job.cluster_id) or f'job-{job.id}'
+            admitted = await admission.admit(account, job.cluster_id or f'job-{job.id}', tasks)
+            deferred = [task_id for task_id in tasks if task_id not in admitted]
+            if deferred:
+                await scheduler.release(job.id, direction, deferred)
+                await admission.defer(job.id, lane, account, len(deferred))
+                logger.info(self, f'Job {job.id} of account {account}, in-flight cap reached, '
+                                  f'defer tasks {deferred}')
+            else:
+                await admission.done_waiting(job.id, lane)
+        except Exception as e:
+            # Caps are best effort, never block jobs because of them
+            logger.error(self, f'Admit tasks of job {job.id} failed, send them all, Error: {e}')
+            admitted = tasks
+        return admitted
 
-    async def _send_tasks(self, tasks, task_type):
+    async def _drain_waiting(self):
+        """
+        Jobs deferred by in-flight caps, higher lanes and smaller fair queuing tags first.
+        """
+        try:
+            waiting = await admission.get_waiting()
+        except Exception as e:
+            logger.error(self, f'Get waiting jobs failed, Error: {e}')
+            return
+        for lane, job_id in waiting:
+            try:
+                job = await get_model_by_id(JobModel, job_id)
+                if not job or job.status not in [JobModel.STATUS.Doing, JobModel.STATUS.Rolling]:
+                    await admission.done_waiting(job_id, lane)
+                    continue
+                if self._is_owner(job.id, job.cluster_id):
+                    await self._check_job(job)
+            except Exception as e:
+                logger.error(self, f'Check waiting job {job_id} failed, Error: {e}.\n'
+                                   f'{traceback.format_exc()}')
+
+    async def _send_tasks(self, job, tasks, task_type):
+        if not tasks:
+            return
+        job_id = job.id
+        direction = scheduler.DIRECTION.Exec if task_type == 'exec' else scheduler.DIRECTION.Rollback
+        tasks = await self._admit_tasks(job, tasks, direction)
         if not tasks:
             return
-        for task_id in tasks:
-            task_model = TaskModel()
-            task_model.id = task_id
-            new_status = TaskModel.STATUS.Doing if task_type == 'exec' else TaskModel.STATUS.Rolling
-            await task_model.save({'status': new_status})
+        lane = admission.get_lane(job.name)
+        try:
+            stream_types = await scheduler.get_types(job_id, direction, tasks)
+        except Exception as e:
+            # Untyped tasks go to the default stream, which every worker type could run
+            logger.error(self, f'Get task types of job {job_id} failed, Error: {e}')
+            stream_types = {}
+        # Status of all tasks is committed by one statement before any of them is sent,
+        # workers only run tasks found Doing / Rolling
+        new_status = TaskModel.STATUS.Doing if task_type == 'exec' else TaskModel.STATUS.Rolling
+        try:
+            await TaskModel.update_all(tasks, {'status': new_status})
+        except Exception:
+            # Claimed tasks not sent should be ready again
+            await scheduler.release(job_id, direction, tasks)
+            await admission.release(tasks)
+            raise
 
-            send_dict = json.dumps({'task_id': task_id, 'task_type': task_type})
-            await competition_mq.xadd(stream_id=self.stream, fields={b'task_msg': send_dict.encode('utf8')})
+        messages = [(gen_task_stream(self.stream, stream_types.get(task_id), lane),
+                     {b'task_msg': json.dumps({'task_id': task_id, 'task_type': task_type}).encode('utf8')})
+                    for task_id in tasks]
+        try:
+            res = await competition_mq.xadd_many(messages, max_len=self.stream_maxlen)
+        except Exception as e:
+            res = [e] * len(tasks)
+        errors = {task_id: msg_id for task_id, msg_id in zip(tasks, res) if isinstance(msg_id, Exception)}
+        if errors:
+            # Sent again by the next check, status is written again then
+            unsent = list(errors)
+            logger.error(self, f'Send tasks {unsent} of job {job_id} failed, Error: {errors[unsent[0]]}')
+            await scheduler.release(job_id, direction, unsent)
+            await admission.release(unsent)
 
     def run(self):
         loop = asyncio.get_event_loop()
@@ -135,7 +439,11 @@ class Manager:
             loop.add_signal_handler(
                 s, lambda sd=s: asyncio.create_task(self._shutdown(s, loop)))
 
-        asyncio.get_event_loop().run_until_complete(self._start_manager())
+        asyncio.get_event_loop().run_until_complete(asyncio.gather(self._keep_alive(),
+                                                                   self._start_manager(),
+                                                                   self._watch_events(),
+                                                                   self._sweep_blobs()))
+        loop.run_until_complete(http_sessions.close())
 
         for s in signals:
             loop.remove_signal_handler(s)
@@ -1,8 +1,17 @@
 from copy import deepcopy
 
 from oasis.db.models import model_query
+from oasis.db.models.job import JobModel
 from oasis.db.models.task import TaskModel
+from oasis.db.service import mysql_client
+from oasis.utils.generator import gen_uuid4
+from oasis.utils.logger import logger
+from oasis.worker.events import EVENT
+from oasis.worker.events import publish_job_event
+from oasis.worker.scheduler import scheduler
 from oasis.worker.tasks import BaseTask
+from oasis.worker.tasks import RegisteredTasks
+from oasis.worker.tasks import set_job_context
 
 
 class Planner:
@@ -60,35 +69,81 @@ class Planner:
         return head_tasks
 
 
-async def save_task_graph(job_id, new_task_graph):
+def _prepare_task_graph(job_id, new_task_graph):
     """
-    Because task id is only generated while commit to db,
-    we should save next task id from tail to head.
-    Before task id is generated, use id(task) for tmp use.
+    Task ids are generated here instead of by db, so next task ids are known
+    before anything is written, and the whole graph is inserted at once.
+    Return exec graph and task types for the scheduler.
     """
-    task_tmp_id_dict = {
-        id(new_task): new_task for new_task in new_task_graph.keys()
-    }
+    for new_task in new_task_graph:
+        new_task.id = new_task.id or gen_uuid4()
+        new_task.job_id = job_id
+        task_clazz = RegisteredTasks.get(new_task.name)
+        if task_clazz:
+            new_task.type = task_clazz.type
 
-    task_tmp_graph = {}
     for new_task, new_task_next in new_task_graph.items():
-        tmp_next_list = [id(tmp_next) for tmp_next in new_task_next]
-        task_tmp_graph.setdefault(id(new_task), tmp_next_list)
+        new_task.next_tasks = [next_task.id for next_task in new_task_next]
+
+    exec_graph = {new_task.id: list(new_task.next_tasks) for new_task in new_task_graph}
+    task_types = {new_task.id: new_task.type or TaskModel.TYPE.ALL for new_task in new_task_graph}
+    return exec_graph, task_types
+
+
+async def save_task_graph(job_id, new_task_graph):
+    """
+    Save tasks of an existing job by one multi-row insert.
+    """
+    exec_graph, task_types = _prepare_task_graph(job_id, new_task_graph)
+    await TaskModel.pack_all(new_task_graph)
+    await mysql_client.insert_all(list(new_task_graph))
+    # In-degrees are computed only once here, then maintained by finished tasks
+    await scheduler.init(job_id, scheduler.DIRECTION.Exec, exec_graph, task_types)
 
-    planner = Planner(task_tmp_graph)
-    arrangements = planner.arrange_tasks()
-    # print('arrangement, ', arrangements)
 
-    task_name_id_dict = {}
-    while arrangements:
-        arr = arrangements.pop()
-        for a_id in arr:
-            a = task_tmp_id_dict.get(a_id)
-            a.job_id = job_id
-            a.next_tasks = [task_name_id_dict.get(next_task_id)
-                            for next_task_id in task_tmp_graph.get(a_id)]
-            await a.save()
-            task_name_id_dict.setdefault(a_id, a.id)
+async def save_jobs(jobs):
+    """
+    Save new jobs (e.g. a job and its sub jobs) with their task graphs in one transaction,
+    so a job is never committed without its sub jobs.
+    Job contexts, schedules and blobs of task args are written first, managers could not see the jobs before commit.
+
+    :param jobs: [(job, task graph, context or None)]
+    """
+    models = []
+    for job, new_task_graph, context in jobs:
+        job.id = job.id or gen_uuid4()
+        exec_graph, task_types = _prepare_task_graph(job.id, new_task_graph)
+        if context is not None:
+            await set_job_context(job.id, context)
+        await scheduler.init(job.id, scheduler.DIRECTION.Exec, exec_graph, task_types)
+        await TaskModel.pack_all(new_task_graph)
+        models.extend([job, *new_task_graph])
+    await mysql_client.insert_all(models)
+    for job, _, _ in jobs:
+        if job.status == JobModel.STATUS.Doing:
+            await publish_job_event(EVENT.JobStarted, job.id, cluster_id=job.cluster_id)
+    return [job for job, _, _ in jobs]
+
+
+async def get_next_tasks(job_id):
+    """
+    Pop ready tasks from incremental schedule, rebuild it from db if it is missing.
+    """
+    next_tasks = await scheduler.claim_ready(job_id, scheduler.DIRECTION.Exec)
+    if next_tasks is None:
+        logger.info(f'Exec schedule of job {job_id} not found, rebuild from db.')
+        next_tasks = await get_next_tasks_from_db(job_id)
+    return next_tasks
+
+
+async def get_next_rollbacks(job_id):
+    next_tasks = await scheduler.claim_ready(job_id, scheduler.DIRECTION.Rollback)
+    if next_tasks is None:
+        logger.info(f'Rollback schedule of job {job_id} not found, rebuild from db.')
+        next_tasks = await get_next_rollbacks_from_db(job_id)
+    elif next_tasks == 'All Done':
+        next_tasks = 'All Rolled'
+    return next_tasks
 
 
 async def get_next_tasks_from_db(job_id):
@@ -101,12 +156,25 @@ async def get_next_tasks_from_db(job_id):
     for status in task_status_dict.values():
         if status in [TaskModel.STATUS.Failed, TaskModel.STATUS.Rolling]:
             return []
-    task_graph = {task.id: task.next_tasks for task in res}
-    planner = Planner(task_graph)
-    next_tasks = planner.get_head_tasks()
+    task_graph = {task.id: [next_task for next_task in task.next_tasks or []
+                            if next_task in task_status_dict]
+                  for task in res}
+    degrees = {task_id: 0 for task_id in task_graph}
+    for next_tasks in task_graph.values():
+        for next_task in next_tasks:
+            degrees[next_task] += 1
     # Rolled tasks can re-send after error is fixed
-    next_tasks = [task for task in next_tasks
-                  if task_status_dict.get(task, '') in [TaskModel.STATUS.Init, TaskModel.STATUS.Rolled]]
+    ready = [task_id for task_id, degree in degrees.items()
+             if not degree and task_status_dict.get(task_id, '') in [TaskModel.STATUS.Init,
+                                                                     TaskModel.STATUS.Rolled]]
+    task_types = {task.id: task.type or TaskModel.TYPE.ALL for task in res}
+    await scheduler.init_state(job_id, scheduler.DIRECTION.Exec, task_graph, degrees, ready, task_types)
+    next_tasks = await scheduler.claim_ready(job_id, scheduler.DIRECTION.Exec)
+    if next_tasks is None:
+        # Redis unavailable, fall back to plain planner
+        planner = Planner({task.id: task.next_tasks for task in res})
+        next_tasks = [task for task in planner.get_head_tasks()
+                      if task_status_dict.get(task, '') in [TaskModel.STATUS.Init, TaskModel.STATUS.Rolled]]
     return next_tasks
 
 
@@ -142,10 +210,57 @@ def get_rolling_back_tasks(task_status_graph):
             }
 
 
+def _next_rollbacks(task_id, next_tasks_dict, rollback_ids):
+    """
+    Rollback tasks reachable from the task, walking on through tasks which need no rollback
+    (e.g. Init or Rolled), so A -> Init -> B still rolls B back before A.
+    """
+    found = []
+    visited = set()
+    stack = list(next_tasks_dict.get(task_id, []))
+    while stack:
+        next_task = stack.pop()
+        if next_task in visited:
+            continue
+        visited.add(next_task)
+        if next_task in rollback_ids:
+            found.append(next_task)
+        else:
+            stack.extend(next_tasks_dict.get(next_task, []))
+    return found
+
+
 async def get_next_rollbacks_from_db(job_id):
     query = model_query(TaskModel)
     res = await query.where(TaskModel.job_id == job_id).query_all()
-    task_status_graph = {task.id: {'next_tasks': task.next_tasks,
-                                   'status': task.status} for task in res}
-    next_tasks = get_rolling_back_tasks(task_status_graph)
+    task_status_dict = {task.id: task.status for task in res}
+    for status in task_status_dict.values():
+        # Wait executing tasks to be done before rolling back
+        if status in [TaskModel.STATUS.Doing, TaskModel.STATUS.Rolling, TaskModel.STATUS.RollFailed]:
+            return []
+
+    # Only done or failed tasks need rollback, a task is rolled back after all its next tasks
+    rollback_ids = [task_id for task_id, status in task_status_dict.items()
+                    if status in [TaskModel.STATUS.Failed, TaskModel.STATUS.Done]]
+    if not rollback_ids:
+        return 'All Rolled'
+    # Edges through tasks with nothing to roll back are kept, see _next_rollbacks
+    next_tasks_dict = {task.id: task.next_tasks or [] for task in res}
+    task_graph = {task_id: [] for task_id in rollback_ids}
+    degrees = {task_id: 0 for task_id in rollback_ids}
+    for task_id in rollback_ids:
+        for next_task in _next_rollbacks(task_id, next_tasks_dict, task_graph):
+            task_graph[next_task].append(task_id)
+            degrees[task_id] += 1
+    ready = [task_id for task_id, degree in degrees.items() if not degree]
+
+    await scheduler.reset(job_id, scheduler.DIRECTION.Exec)
+    task_types = {task.id: task.type or TaskModel.TYPE.ALL for task in res if task.id in task_graph}
+    await scheduler.init_state(job_id, scheduler.DIRECTION.Rollback, task_graph, degrees, ready, task_types)
+    next_tasks = await scheduler.claim_ready(job_id, scheduler.DIRECTION.Rollback)
+    if next_tasks is None:
+        # Redis unavailable, fall back to plain planner
+        task_status_graph = {task.id: {'next_tasks': task.next_tasks,
+                                       'status': task.status} for task in res}
+        next_tasks = get_rolling_back_tasks(task_status_graph)
     return next_tasks
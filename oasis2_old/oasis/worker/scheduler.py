@@ -0,0 +1,180 @@
+import json
+import re
+
+from oasis.db.service import redis_client
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+
+
+def _prepare(func):
+    async def __inner(self, *args, **kwargs):
+        if not self._init_sha1:
+            script = self.INIT_SCRIPT
+            script = re.sub(r'^\s+', '', script, flags=re.M).strip()
+            self._init_sha1 = await redis_client.script_load(script)
+
+            script = self.FINISH_SCRIPT
+            script = re.sub(r'^\s+', '', script, flags=re.M).strip()
+            self._finish_sha1 = await redis_client.script_load(script)
+
+        res = await func(self, *args, **kwargs)
+        return res
+
+    return __inner
+
+
+class Scheduler:
+    """
+    Incremental ready set of job tasks, kept in redis.
+
+    In-degrees are computed once when the graph is saved (or rebuilt from db when the state
+    is missing), then every finished task decrements its dependents, and tasks reaching zero
+    are moved into the ready set. Manager only pops the ready set, so its cost is proportional
+    to state changes instead of the number of tasks in flight.
+
+    Exec direction:     task depends on its previous tasks, finishing a task decrements next tasks.
+    Rollback direction: task depends on its next tasks, rolling a task decrements previous tasks.
+    """
+
+    class DIRECTION:
+        Exec = 'exec'
+        Rollback = 'rollback'
+
+    # KEYS[1] - degree hash, KEYS[2] - ready set, KEYS[3] - remain counter
+    # KEYS[4] - adjacency hash, KEYS[5] - finished set, KEYS[6] - task type hash
+    # ARGV[1] - json degrees, ARGV[2] - json adjacency (json encoded lists)
+    # ARGV[3] - json ready list, ARGV[4] - remain count, ARGV[5] - expire seconds
+    # ARGV[6] - json task types
+    INIT_SCRIPT = """
+        redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6])
+        for task_id, degree in pairs(cjson.decode(ARGV[1])) do
+            redis.call('HSET', KEYS[1], task_id, degree)
+        end
+        for task_id, adjacency in pairs(cjson.decode(ARGV[2])) do
+            redis.call('HSET', KEYS[4], task_id, adjacency)
+        end
+        for _, task_id in ipairs(cjson.decode(ARGV[3])) do
+            redis.call('SADD', KEYS[2], task_id)
+        end
+        for task_id, task_type in pairs(cjson.decode(ARGV[6])) do
+            redis.call('HSET', KEYS[6], task_id, task_type)
+        end
+        redis.call('SET', KEYS[3], ARGV[4])
+        for _, i in ipairs({1, 2, 3, 4, 6}) do
+            redis.call('EXPIRE', KEYS[i], ARGV[5])
+        end
+        return redis.status_reply('OK')"""
+
+    # Same KEYS as INIT_SCRIPT
+    # ARGV[1] - finished task id
+    # Return remain count, -1 if state not found
+    FINISH_SCRIPT = """
+        if redis.call('EXISTS', KEYS[3]) == 0 then
+            return -1
+        end
+        -- Not in the schedule, e.g. finished before it was rebuilt from db, remain does not count it
+        if redis.call('HEXISTS', KEYS[4], ARGV[1]) == 0 then
+            return tonumber(redis.call('GET', KEYS[3]))
+        end
+        if redis.call('SADD', KEYS[5], ARGV[1]) == 0 then
+            return tonumber(redis.call('GET', KEYS[3]))
+        end
+        redis.call('EXPIRE', KEYS[5], redis.call('TTL', KEYS[3]))
+        local adjacency = redis.call('HGET', KEYS[4], ARGV[1])
+        if adjacency then
+            for _, task_id in ipairs(cjson.decode(adjacency)) do
+                if redis.call('HINCRBY', KEYS[1], task_id, -1) == 0 then
+                    redis.call('SADD', KEYS[2], task_id)
+                end
+            end
+        end
+        return redis.call('DECR', KEYS[3])"""
+
+    def __init__(self, expire=None):
+        self.expire = expire or config.getint('manager', 'schedule_expire', fallback=7 * 86400)
+        self._init_sha1 = None
+        self._finish_sha1 = None
+
+    @staticmethod
+    def _keys(job_id, direction):
+        prefix = f'/scheduler/job/{job_id}/{direction}'
+        return [f'{prefix}/degree/', f'{prefix}/ready/', f'{prefix}/remain/',
+                f'{prefix}/adjacency/', f'{prefix}/finished/', f'{prefix}/type/']
+
+    @_prepare
+    async def init(self, job_id, direction, task_graph, task_types=None):
+        """
+        :param task_graph: {task_id: [dependent task ids]}, only unfinished tasks,
+                           dependents are decremented when the task finishes.
+        :param task_types: {task_id: TaskModel.TYPE}, used to route tasks to streams
+        """
+        degrees = {task_id: 0 for task_id in task_graph}
+        for dependents in task_graph.values():
+            for dependent in dependents:
+                degrees[dependent] = degrees.get(dependent, 0) + 1
+        ready = [task_id for task_id, degree in degrees.items() if degree == 0]
+        return await self.init_state(job_id, direction, task_graph, degrees, ready, task_types)
+
+    @_prepare
+    async def init_state(self, job_id, direction, task_graph, degrees, ready, task_types=None):
+        adjacency = {task_id: json.dumps(dependents) for task_id, dependents in task_graph.items()}
+        res = await redis_client.evalsha(
+            self._init_sha1,
+            keys=self._keys(job_id, direction),
+            args=[json.dumps(degrees), json.dumps(adjacency), json.dumps(ready),
+                  len(task_graph), self.expire, json.dumps(task_types or {})],
+        )
+        logger.debug(f'Init {direction} schedule of job {job_id}, ready {ready}, res {res}')
+        return res == 'OK'
+
+    @_prepare
+    async def finish(self, job_id, direction, task_id):
+        """
+        Return remain tasks count, -1 if schedule state not found.
+        """
+        res = await redis_client.evalsha(
+            self._finish_sha1,
+            keys=self._keys(job_id, direction),
+            args=[task_id],
+        )
+        return -1 if res is None else int(res)
+
+    async def claim_ready(self, job_id, direction, count=1000):
+        """
+        Pop ready tasks, only one manager could claim a task.
+        Return None if schedule state not found, 'All Done' if no task remains.
+        """
+        _, ready_key, remain_key, _, _, _ = self._keys(job_id, direction)
+        remain = await redis_client.get(remain_key)
+        if remain is None:
+            return None
+        if int(remain) <= 0:
+            return 'All Done'
+        return await redis_client.spop(ready_key, count=count) or []
+
+    async def release(self, job_id, direction, task_ids):
+        """
+        Put claimed tasks back, e.g. dispatching failed.
+        """
+        if not task_ids:
+            return
+        _, ready_key, _, _, _, _ = self._keys(job_id, direction)
+        await redis_client.sadd(ready_key, *task_ids)
+
+    async def get_types(self, job_id, direction, task_ids):
+        """
+        Return {task_id: task type}, None for unknown tasks.
+        """
+        if not task_ids:
+            return {}
+        type_key = self._keys(job_id, direction)[-1]
+        task_types = await redis_client.hmget(type_key, *task_ids) or [None] * len(task_ids)
+        return dict(zip(task_ids, task_types))
+
+    async def reset(self, job_id, direction=None):
+        directions = [direction] if direction else [self.DIRECTION.Exec, self.DIRECTION.Rollback]
+        keys = [key for d in directions for key in self._keys(job_id, d)]
+        await redis_client.delete(*keys)
+
+
+scheduler = Scheduler()
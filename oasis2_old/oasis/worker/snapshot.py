@@ -0,0 +1,118 @@
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from oasis.db.models import get_cluster_version
+from oasis.db.models import get_model_by_id
+from oasis.db.models.cluster import ClusterModel
+from oasis.db.service import redis_client
+from oasis.db.service.mysql import query_counter
+from oasis.utils.cache import AsyncCache
+from oasis.utils.config import config
+from oasis.utils.logger import logger
+
+JOB_QUERIES_EXPIRE = 7 * 24 * 3600
+
+
+def _job_queries_key(job_id):
+    return f'/oasis/job/queries/{job_id}'
+
+
+class ClusterSnapshots:
+    """
+    Cluster aggregates (cluster, instance groups, instances, plugins) read by the tasks of a job.
+
+    Loading a cluster joins all its instance groups, instances and plugins, and almost every
+    task of a job loads the same cluster again. The first load of a job is kept, keyed by
+    (job id, cluster id), and returned to the following tasks of the job on this worker.
+
+    Invalidation: every write of the aggregate through the model layer bumps the cluster
+    version in redis (see oasis.db.models.bump_cluster_version). A read checks the version
+    with one redis call and loads again when it changed, so writes made by other workers
+    or the api are seen as well. Writes outside the model layer are not seen.
+
+    Tasks declaring fresh_cluster = True always load from the database.
+
+    Snapshots are shared, change them only through save() / update_columns().
+
+    [worker]
+    snapshot_ttl = 600
+    snapshot_size = 200
+    """
+
+    def __init__(self):
+        self._cache = AsyncCache(ttl=config.getint('worker', 'snapshot_ttl', fallback=600), refresh_ahead=0,
+                                 maxsize=config.getint('worker', 'snapshot_size', fallback=200),
+                                 name='cluster snapshots')
+
+    async def get(self, job_id, cluster_id, fresh=False):
+        if not cluster_id:
+            return None
+        _count('cluster_reads')
+        # Read before loading, a write racing with the load leaves an older version on the snapshot
+        version = await get_cluster_version(cluster_id)
+
+        async def _load():
+            _count('cluster_loads')
+            cluster = await get_model_by_id(ClusterModel, cluster_id)
+            return (version, cluster) if cluster else None
+
+        if version is None or not job_id:
+            # Version unknown, nothing cached could be trusted
+            snapshot = await _load()
+            return snapshot[1] if snapshot else None
+
+        key = (job_id, cluster_id)
+        snapshot = await self._cache.get(key, _load, fresh=fresh)
+        if snapshot and snapshot[0] != version:
+            snapshot = await self._cache.get(key, _load, fresh=True)
+        if snapshot and snapshot[0] != version:
+            # Joined a load started at an older version, load by itself
+            snapshot = await _load()
+            if snapshot:
+                self._cache.set(key, snapshot)
+        return snapshot[1] if snapshot else None
+
+
+cluster_snapshots = ClusterSnapshots()
+
+
+def _count(field):
+    counter = query_counter.get()
+    if counter is not None:
+        counter[field] += 1
+
+
+@asynccontextmanager
+async def count_job_queries(job_id, task_name):
+    """
+    Count database statements and cluster reads of the task run inside, add them to the job.
+    """
+    counter = Counter()
+    token = query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        query_counter.reset(token)
+        if job_id and counter:
+            logger.info(f'Job [{job_id}] task {task_name} queries: {dict(counter)}')
+            key = _job_queries_key(job_id)
+            for field, count in counter.items():
+                await redis_client.hincrby(key, field, count)
+            await redis_client.expire(key, JOB_QUERIES_EXPIRE)
+
+
+async def get_job_queries(job_id):
+    """
+    Database statements of a job, with and without cluster snapshots.
+
+    Without snapshots every cluster read was a load, so before = queries - cluster_loads + cluster_reads.
+    """
+    counts = {k: int(v) for k, v in (await redis_client.hgetall(_job_queries_key(job_id)) or {}).items()}
+    queries = counts.get('queries', 0)
+    reads = counts.get('cluster_reads', 0)
+    loads = counts.get('cluster_loads', 0)
+    return {
+        'counts': counts,
+        'before': {'queries': queries - loads + reads, 'cluster_queries': reads},
+        'after': {'queries': queries, 'cluster_queries': loads},
+    }
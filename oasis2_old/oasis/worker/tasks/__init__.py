@@ -1,25 +1,72 @@
 from abc import ABC
 from abc import abstractmethod
-import json
 
+from oasis.db.models.task import TaskModel
 from oasis.db.service import redis_client
+from oasis.utils.blob import blob_store
 from oasis.utils.logger import logger
+from oasis.worker.snapshot import cluster_snapshots
 
 
-async def get_job_context(job_id):
-    res_dict = await redis_client.hgetall(f'/context/job/{job_id}/')
-    if type(res_dict) == dict:
-        res_dict = {k: json.loads(v) for k, v in res_dict.items()}
-    return res_dict
+def _job_context_key(job_id):
+    return f'/context/job/{job_id}/'
 
 
-async def set_job_context(job_id, values):
-    values = {k: json.dumps(v) for k, v in values.items()}
-    await redis_client.hmset_dict(f'/context/job/{job_id}/', **values)
+async def read_job_context(job_id, keys=None):
+    """
+    Raw JSON fields of the job context, only the given keys unless keys is None.
+    Large values are refs, see decode_job_context.
+    """
+    if keys is None:
+        return await redis_client.hgetall(_job_context_key(job_id)) or {}
+    keys = list(keys)
+    if not keys:
+        return {}
+    values = await redis_client.hmget(_job_context_key(job_id), *keys) or []
+    return {k: v for k, v in zip(keys, values) if v is not None}
+
+
+async def write_job_context(job_id, fields):
+    if fields:
+        # Blobs referenced by a job context live as long as the context, e.g. an Error job retried much later
+        await blob_store.hold(job_id, blob_store.refs(fields.values()))
+        await redis_client.hmset_dict(_job_context_key(job_id), **fields)
+
+
+async def decode_job_context(fields):
+    values = await blob_store.loads_many(list(fields.values()))
+    return dict(zip(fields, values))
+
+
+async def get_job_context(job_id, keys=None):
+    return await decode_job_context(await read_job_context(job_id, keys))
+
+
+async def set_job_context(job_id, values, origin=None):
+    """
+    Write values into the job context, values larger than the blob inline limit
+    (e.g. product_details) are stored once by content hash and referenced.
+
+    :param origin: raw fields as read by read_job_context, values which did not change are not written
+    :return: fields written
+    """
+    fields = {}
+    for k, v in values.items():
+        data, blob = blob_store.dumps(v)
+        if origin is not None and origin.get(k) == data:
+            continue
+        if blob:
+            # Before the ref, so a ref never points to a missing blob
+            await blob_store.put(*blob)
+        fields[k] = data
+    await write_job_context(job_id, fields)
+    return fields
 
 
 async def del_job_context(job_id):
-    await redis_client.expire(f'/context/job/{job_id}/', 0)
+    fields = await read_job_context(job_id)
+    await redis_client.expire(_job_context_key(job_id), 0)
+    await blob_store.release(job_id, blob_store.refs(fields.values()))
 
 
 def fill_task_args(args, res_dict):
@@ -30,6 +77,9 @@ def fill_task_args(args, res_dict):
     needed_args = [arg.replace('$$$', '') for arg in args
                    if arg.startswith('$$$')]
     for k, v in res_dict.items():
+        if k.startswith('_'):
+            # Kept in results of the task only, e.g. diagnostics, never passed on
+            continue
         args.setdefault(k, v)
         if k in needed_args:
             args.pop(f'$$${k}$$$')
@@ -38,7 +88,12 @@ def fill_task_args(args, res_dict):
 
 def check_task(func):
     async def _inner(self, *args, **kwargs):
-        self.context = await get_job_context(self.job_id)
+        keys = self.context_keys
+        if keys is not None:
+            # Placeholder args name the context keys they need
+            keys = set(keys) | {arg.replace('$$$', '') for arg in self.args if arg.startswith('$$$')}
+        context_fields = await read_job_context(self.job_id, keys)
+        self.context = await decode_job_context(context_fields)
         logger.debug(self, f'Init task {self.__class__.__name__}, got job context {self.context}')
 
         # Fill needed args from context
@@ -49,7 +104,10 @@ def check_task(func):
         logger.info(self, f'Finish task {self.__class__.__name__}, results {res}')
 
         if self.context:
-            await set_job_context(self.job_id, self.context)
+            # Only keys the task added or changed
+            written = await set_job_context(self.job_id, self.context, origin=context_fields)
+            if written:
+                logger.debug(self, f'Task {self.__class__.__name__} wrote job context {list(written)}')
         self.result = res
         return self.result
 
@@ -60,7 +118,7 @@ def check_rollback(func):
     async def _inner(self, *args, **kwargs):
         logger.info(self, f'Start rolling back task {self.__class__}, args {self.args}')
 
-        self.context = await get_job_context(self.job_id)
+        self.context = await get_job_context(self.job_id, self.context_keys)
 
         res = await func(self, *args, **kwargs)
 
@@ -80,6 +138,19 @@ async def set_rolled_instance(instance_id, cluster_id):
 
 
 class BaseTask(ABC):
+    # Stream type the task is routed to, see TaskModel.TYPE
+    type = TaskModel.TYPE.ALL
+
+    # Seconds a delivered task may stay unacked on an alive worker before it is
+    # delivered again, None for worker default
+    reclaim_idle = None
+
+    # True if the task must read the cluster from the database, not the snapshot of its job
+    fresh_cluster = False
+
+    # Job context keys the task reads, None for the whole context
+    context_keys = None
+
     def __init__(self, task_id=None, job_id=None, args=None, results=None):
         self.task_id = task_id
         self.job_id = job_id
@@ -87,6 +158,13 @@ class BaseTask(ABC):
         self.context = {}
         self.results = results if results else {}
 
+    async def get_cluster(self, cluster_id, fresh=None):
+        """
+        Cluster aggregate, from the snapshot of the job unless the task needs fresh data.
+        """
+        fresh = self.fresh_cluster if fresh is None else fresh
+        return await cluster_snapshots.get(self.job_id, cluster_id, fresh=fresh)
+
     @abstractmethod
     @check_task
     async def run(self):
@@ -82,7 +82,7 @@ class TaskInitClusterCreate(BaseTask):
             instance_group.update(ig)
             await instance_group.save()
 
-        cluster_model = await get_model_by_id(ClusterModel, cluster.id)
+        cluster_model = await self.get_cluster(cluster.id)
         if not cluster_model:
             raise Exception(f'Init Cluster Failed')
         self.results = cluster_model.to_dict(full_info=True)
@@ -91,7 +91,7 @@ class TaskInitClusterCreate(BaseTask):
     @check_rollback
     async def rollback(self):
         cluster_id = self.context.get('cluster_id', None)
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         await cluster.delete()
 
         return True
@@ -104,7 +104,7 @@ class TaskUpdateCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -133,6 +133,8 @@ class TaskUpdateCluster(BaseTask):
 
 
 class TaskInitClusterScale(BaseTask):
+    context_keys = ('cluster_id', 'order_id', 'scale_out_instance_groups')
+
     @check_task
     async def run(self):
         order_id = self.args.pop('order_id', None)
@@ -141,7 +143,7 @@ class TaskInitClusterScale(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -189,7 +191,7 @@ class TaskInitClusterScale(BaseTask):
     async def rollback(self):
         cluster_id = self.context.get('cluster_id', None)
         scale_out_instance_groups = self.args.get('scale_out_instance_groups', [])
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         extra_dict = dict(cluster.extra)
         extra_dict.pop('scale_out_order_id')
         await cluster.save({'extra': extra_dict,
@@ -1,18 +1,23 @@
 import asyncio
 
 from conf.infra_conf import VOLUME_TYPE_MAP
-from oasis.db.models import get_model_by_id
 from oasis.db.models import model_query
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.cluster_order import ClusterOrderModel
+from oasis.db.models.task import TaskModel
 from oasis.utils import sdk
+from oasis.utils.disk import DiskLayout
 from oasis.utils.logger import logger
+from oasis.utils.remote import ScriptBundle
+from oasis.worker.fanout import FanOut
 from oasis.worker.tasks import BaseTask
 from oasis.worker.tasks import check_rollback
 from oasis.worker.tasks import check_task
 
 
 class TaskCreateEbs(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids', 'order_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -22,7 +27,7 @@ class TaskCreateEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -87,6 +92,9 @@ class TaskCreateEbs(BaseTask):
 
 
 class TaskAttachEbs(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -95,7 +103,7 @@ class TaskAttachEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -126,7 +134,7 @@ class TaskAttachEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -158,6 +166,9 @@ class TaskAttachEbs(BaseTask):
 
 
 class TaskDetachEbs(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -165,7 +176,7 @@ class TaskDetachEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -191,6 +202,9 @@ class TaskDetachEbs(BaseTask):
 
 
 class TaskReattachEbs(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -198,7 +212,7 @@ class TaskReattachEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -229,6 +243,9 @@ class TaskReattachEbs(BaseTask):
 
 
 class TaskMountEbs(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -237,13 +254,13 @@ class TaskMountEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         ebs_client = getattr(sdk, f'ebs_client_{cluster.cluster_type.lower()}')
 
-        mount_tasks = []
+        resource_types = {}
         for instance_group in cluster.instance_groups:
             resource_type = instance_group.resource_type
             instance_type_code = instance_group.instance_type_code
@@ -255,10 +272,21 @@ class TaskMountEbs(BaseTask):
                 if instance_id not in new_instance_ids:
                     continue
 
-                mount_tasks.append(self.mount_ebs_and_wait(ebs_client, instance,
-                                                           resource_type, account_id))
+                resource_types[instance] = resource_type
 
-        await asyncio.gather(*mount_tasks)
+        # Volumes of all instances are waited for together, the poller describes them in batches
+        await ebs_client.wait_ebs_status(
+            [volume_id for instance, resource_type in resource_types.items()
+             if resource_type == 'KEC' for volume_id in instance.volumes or []],
+            expect_status=['in-use'],
+            unexpect_status=['error'],
+            account_id=account_id,
+        )
+
+        await FanOut(self, 'mount_ebs').run(
+            resource_types,
+            lambda instance: self.mount_ebs(ebs_client, instance, resource_types[instance], account_id),
+            key=lambda instance: instance.id)
 
         return True
 
@@ -267,90 +295,112 @@ class TaskMountEbs(BaseTask):
         # TODO rollback order
         return True
 
-    async def mount_ebs_and_wait(self, ebs_client, instance, resource_type, account_id):
+    async def mount_ebs(self, ebs_client, instance, resource_type, account_id):
+        """
+        Probe the disk layout once, plan the missing steps locally and run them in one bundle.
+        """
         logger.info(self, f'Start mount ebs, instance_id: {instance.instance_id}')
         remote = await instance.remote()
         async with remote as conn:
-            mount_point_prefix = '/mnt'
+            _, stdout = await conn.execute(DiskLayout.PROBE_CMD)
+            layout = DiskLayout.parse(stdout)
 
             # KEC Cloud-Ebs
             if resource_type == 'KEC' and instance.volumes:
-                for volume_id in instance.volumes:
-                    await ebs_client.wait_ebs_status(
-                        volume_id,
-                        expect_status=['in-use'],
-                        unexpect_status=['error'],
-                        account_id=account_id,
-                    )
                 device_path_list = await ebs_client.get_mount_point(instance.volumes, account_id=account_id)
 
             # EPC
             elif resource_type == 'EPC':
-                _, part_list = await conn.execute(
-                    "cat /proc/partitions | awk '{print $4}' | grep -v sda | grep sd",
-                    raise_when_error=False
-                )
-                if not part_list:
-                    return
-                device_path_list = [f'/dev/{part}' for part in part_list.split('\n')]
-
-                await conn.execute(r'sudo sed -i "/\/dev\/sdb/,+1d;:go;{P;N;D};N;bgo" /etc/fstab')
+                device_path_list = [f'/dev/{part}' for part in layout.partitions if 'sd' in part and 'sda' not in part]
 
             # KEC D4
             elif resource_type == 'D4':
-                _, part_list = await conn.execute(
-                    "cat /proc/partitions | awk '{print $4}' | grep -v vda | grep vd",
-                    raise_when_error=False
-                )
-                if not part_list:
-                    return
-                device_path_list = [f'/dev/{part}' for part in part_list.split('\n')]
+                device_path_list = [f'/dev/{part}' for part in layout.partitions if 'vd' in part and 'vda' not in part]
 
             # Local Ebs
             else:
                 device_path_list = ['/dev/vdb']
 
             logger.info(self, f'===device_path_list===>{device_path_list}')
+            if not device_path_list:
+                return
 
-            for volume_index, device_path in enumerate(device_path_list):
+            bundle = ScriptBundle(f'{self.task_id}-{instance.id}-mount-ebs')
+            plan = self.plan_mount(bundle, layout, device_path_list)
+            logger.info(self, f'Mount plan of instance {instance.instance_id}: {plan}')
+            if bundle.steps:
                 try:
-                    if volume_index == 0:
-                        mount_point = mount_point_prefix
-                    else:
-                        mount_point = f'{mount_point_prefix}{volume_index}'
-                    fs_opts = '-i 262144 -m 1 -O dir_index,extents,^has_journal'
-                    mount_opts = '-o data=writeback,noatime,nodiratime'
-                    fstab_str = f'{device_path}    {mount_point}    ext4    ' \
-                                f'data=writeback,noatime,nodiratime    0    0'
-
-                    exit_status, std_out = await conn.execute(f'df -h | grep {device_path} | wc -l',
-                                                              raise_when_error=False)
-                    if exit_status == 0 and int(std_out) == 0:
-                        exit_status, std_out = await conn.execute(f'sudo ls {mount_point}',
-                                                                  raise_when_error=False)
-                        if exit_status != 0:
-                            await conn.execute(f'sudo mkdir {mount_point}',
-                                               raise_when_error=False)
-                        await conn.execute(f'rm -rf {mount_point}')
-                        # TODO /etc/fstab
-
-                        await conn.execute(f'sudo mkdir -p {mount_point}')
-                        # epc need umount first
-                        if resource_type == 'EPC':
-                            await conn.execute(f'sudo umount {device_path}')
-                        await conn.execute(f'sudo mkfs.ext4 -F {fs_opts} {device_path}',
-                                           raise_when_error=False)
-                        await conn.execute(f'sudo mount {mount_opts} {device_path} {mount_point}')
-                        await conn.execute(f'sudo echo {fstab_str} >> /etc/fstab')
-                        await conn.execute(f'chmod 777 {mount_point}')
-                        await conn.execute(f'sudo mkdir -p {mount_point}/nginx/logs')
+                    await conn.run_bundle(bundle)
                 except Exception as e:
                     logger.error(f"Error mounting volume to instance {instance.instance_id}, Error: {e}")
                     raise Exception(f"Error mounting volume to instance {instance.instance_id}, {e}")
         logger.info(self, f'Finish mount ebs, instance_id: {instance.instance_id}')
 
+    @staticmethod
+    def plan_mount(bundle, layout, device_path_list):
+        """
+        Add the steps missing on the node to bundle, return {device path: action}.
+
+        Devices mounted somewhere else are left alone, devices formatted by an earlier run
+        (ext4 and their fstab line present) are mounted without mkfs, and fstab keeps exactly
+        one line per mounted device.
+        """
+        mount_point_prefix = '/mnt'
+        fs_opts = '-i 262144 -m 1 -O dir_index,extents,^has_journal'
+        mount_opts = '-o data=writeback,noatime,nodiratime'
+
+        plan = {}
+        fstab = list(layout.fstab)
+        for volume_index, device_path in enumerate(device_path_list):
+            if volume_index == 0:
+                mount_point = mount_point_prefix
+            else:
+                mount_point = f'{mount_point_prefix}{volume_index}'
+            fstab_str = f'{device_path}    {mount_point}    ext4    data=writeback,noatime,nodiratime    0    0'
+
+            mounted_at = layout.mount_point(device_path)
+            if mounted_at and mounted_at != mount_point:
+                plan[device_path] = f'in use at {mounted_at}'
+                continue
+            if mounted_at:
+                plan[device_path] = 'mounted'
+            else:
+                bundle.step(f'prepare {mount_point}', f'sudo rm -rf {mount_point} && sudo mkdir -p {mount_point}')
+                # Only disks formatted by oasis keep their data: ext4 with the fstab line written along
+                # with mkfs, a reused or reattached disk is formatted like a new one
+                formatted = layout.fstypes.get(device_path) == 'ext4' and \
+                    fstab_str.split() in [line.split() for line in layout.fstab]
+                if not formatted:
+                    bundle.step(f'mkfs {device_path}', f'sudo mkfs.ext4 -F {fs_opts} {device_path}',
+                                raise_when_error=False)
+                bundle.step(f'mount {device_path}', f'sudo mount {mount_opts} {device_path} {mount_point}')
+                bundle.step(f'chmod {mount_point}',
+                            f'chmod 777 {mount_point} && sudo mkdir -p {mount_point}/nginx/logs')
+                plan[device_path] = 'mount'
+
+            # Stale lines of the device or the mount point go, the wanted line is kept once
+            kept = False
+            lines = []
+            for line in fstab:
+                fields = line.split()
+                if fields == fstab_str.split() and not kept:
+                    kept = True
+                elif len(fields) >= 2 and not fields[0].startswith('#') and \
+                        (fields[0] == device_path or fields[1] == mount_point):
+                    continue
+                lines.append(line)
+            fstab = lines if kept else lines + [fstab_str]
+
+        if fstab != layout.fstab:
+            bundle.file('/etc/fstab.oasis', '\n'.join(fstab) + '\n', name='write fstab')
+            bundle.step('replace fstab', 'sudo cp -f /etc/fstab /etc/fstab.oasis.bak '
+                                         '&& sudo mv -f /etc/fstab.oasis /etc/fstab')
+        return plan
+
 
 class TaskDeleteEbs(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -358,7 +408,7 @@ class TaskDeleteEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -387,6 +437,8 @@ class TaskDeleteEbs(BaseTask):
 
 
 class TaskUpgradeEbs(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'is_upgrade_ebs', 'order_info_res', 'upgrade_instance_group')
 
     @check_task
     async def run(self):
@@ -395,7 +447,7 @@ class TaskUpgradeEbs(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,5 +1,5 @@
-from oasis.db.models import get_model_by_id
 from oasis.db.models.cluster import ClusterModel
+from oasis.db.models.task import TaskModel
 from oasis.utils.config import config
 from oasis.utils.convert import dict_snake2camel
 from oasis.utils.logger import logger
@@ -10,6 +10,8 @@ from oasis.worker.tasks import check_task
 
 
 class TaskGringottsLaunchCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -20,7 +22,7 @@ class TaskGringottsLaunchCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -63,7 +65,7 @@ class TaskGringottsGetEsFreeNodes(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -88,7 +90,7 @@ class TaskGringottsGetEsFreeNodes(BaseTask):
     @check_rollback
     async def rollback(self):
         cluster_id = self.context.get('cluster_id', None)
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
 
         if cluster:
             await cluster.save({'status': ClusterModel.STATUS.ACTIVE})
@@ -97,6 +99,8 @@ class TaskGringottsGetEsFreeNodes(BaseTask):
 
 
 class TaskGringottsScaleInCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -107,7 +111,7 @@ class TaskGringottsScaleInCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -135,6 +139,8 @@ class TaskGringottsScaleInCluster(BaseTask):
 
 
 class TaskGringottsScaleOutCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -145,7 +151,7 @@ class TaskGringottsScaleOutCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -185,6 +191,9 @@ class TaskGringottsScaleOutCluster(BaseTask):
 
 
 class TaskGringottsDeleteCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id')
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -195,7 +204,7 @@ class TaskGringottsDeleteCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -213,6 +222,9 @@ class TaskGringottsDeleteCluster(BaseTask):
 
 
 class TaskGringottsFreezeCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id')
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -223,7 +235,7 @@ class TaskGringottsFreezeCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -241,6 +253,9 @@ class TaskGringottsFreezeCluster(BaseTask):
 
 
 class TaskGringottsUnfreezeCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id')
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -251,7 +266,7 @@ class TaskGringottsUnfreezeCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -269,6 +284,8 @@ class TaskGringottsUnfreezeCluster(BaseTask):
 
 
 class TaskGringottsServiceControl(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -279,7 +296,7 @@ class TaskGringottsServiceControl(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -294,6 +311,8 @@ class TaskGringottsServiceControl(BaseTask):
 
 
 class TaskGringottsEnableXpack(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -304,7 +323,7 @@ class TaskGringottsEnableXpack(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -319,6 +338,8 @@ class TaskGringottsEnableXpack(BaseTask):
 
 
 class TaskGringottsDisableXpack(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -329,7 +350,7 @@ class TaskGringottsDisableXpack(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -344,6 +365,8 @@ class TaskGringottsDisableXpack(BaseTask):
 
 
 class TaskGringottsUpgradeCluster(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -354,7 +377,7 @@ class TaskGringottsUpgradeCluster(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -375,6 +398,8 @@ class TaskGringottsUpgradeCluster(BaseTask):
 
 
 class TaskGringottsSnapshotOn(BaseTask):
+    type = TaskModel.TYPE.POLY
+
     @check_task
     async def run(self):
         token = self.args.get('auth_token', None)
@@ -385,7 +410,7 @@ class TaskGringottsSnapshotOn(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,25 +1,38 @@
 import asyncio
+import time
 
-from oasis.db.models import get_model_by_id
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.cluster_order import ClusterOrderModel
 from oasis.db.models.instance import InstanceModel
 from oasis.db.models.instance_group import InstanceGroupModel
+from oasis.db.models.task import TaskModel
 from oasis.utils import sdk
+from oasis.utils.config import config
 from oasis.utils.generator import gen_uuid4
 from oasis.utils.logger import logger
+from oasis.utils.remote import tcp_check
 from oasis.utils.sdk import gringotts_client
 from oasis.utils.sdk.base import create_kec_instance_cluster
 from oasis.utils.sdk.base import instance_add
 from oasis.utils.sdk.charging.base import form_epc_param
 from oasis.utils.sdk.charging.base import form_kec_param
+from oasis.worker.fanout import FanOut
 from oasis.worker.tasks import BaseTask
 from oasis.worker.tasks import check_rollback
 from oasis.worker.tasks import check_task
 from oasis.worker.tasks import set_rolled_instance
 
+# Readiness probing of TaskCheckInstanceReady, all instances at once within one deadline
+READY_TIMEOUT = config.getint('worker', 'ready_timeout', fallback=1800)
+READY_CONCURRENCY = config.getint('worker', 'ready_concurrency', fallback=200)
+READY_BACKOFF_BASE = config.getint('worker', 'ready_backoff_base', fallback=5)
+READY_BACKOFF_CAP = config.getint('worker', 'ready_backoff_cap', fallback=60)
+
 
 class TaskCreateInstance(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids', 'order_id', 'product_details',
+                    'security_group_id', 'sub_orders')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -32,7 +45,7 @@ class TaskCreateInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -286,7 +299,7 @@ class TaskCreateInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -347,6 +360,9 @@ class TaskCreateInstance(BaseTask):
 
 
 class TaskStopInstance(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -354,7 +370,7 @@ class TaskStopInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -411,6 +427,9 @@ class TaskStopInstance(BaseTask):
 
 
 class TaskStartInstance(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -418,7 +437,7 @@ class TaskStartInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -475,6 +494,9 @@ class TaskStartInstance(BaseTask):
 
 
 class TaskDeleteInstance(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_groups', 'scale_in_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -482,7 +504,7 @@ class TaskDeleteInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -555,6 +577,8 @@ class TaskDeleteInstance(BaseTask):
 
 
 class TaskDeleteDataguard(BaseTask):
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -562,7 +586,7 @@ class TaskDeleteDataguard(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -590,6 +614,8 @@ class TaskDeleteDataguard(BaseTask):
 
 
 class TaskCreateSshKey(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'product')
+
     @check_task
     async def run(self):
         product = self.args.get('product', 'kes')
@@ -598,7 +624,7 @@ class TaskCreateSshKey(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -616,7 +642,7 @@ class TaskCreateSshKey(BaseTask):
         cluster_id = self.context.get('cluster_id', None)
         # Cluster may not start create yet
         try:
-            cluster = await get_model_by_id(ClusterModel, cluster_id)
+            cluster = await self.get_cluster(cluster_id)
             sks_client = getattr(sdk, f'sks_client_{product}')
 
             await sks_client.delete_key(key_id=cluster.management_keypair_id,
@@ -628,6 +654,8 @@ class TaskCreateSshKey(BaseTask):
 
 
 class TaskDeleteEpcKey(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'product')
+
     @check_task
     async def run(self):
         product = self.args.get('product', 'kes')
@@ -636,7 +664,7 @@ class TaskDeleteEpcKey(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -652,13 +680,16 @@ class TaskDeleteEpcKey(BaseTask):
 
 
 class TaskCheckInstanceReady(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('cluster_id',)
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -666,41 +697,63 @@ class TaskCheckInstanceReady(BaseTask):
         for ig in cluster.instance_groups:
             instances.extend(ig.instances)
 
-        for instance in instances:
-            retry = 3
-            while retry:
-                retry -= 1
-                try:
-                    logger.info(f'Try remote ssh to instance [{instance.instance_id}] {instance.instance_name}')
-                    remote = await instance.remote()
-                    async with remote as conn:
-                        await conn.execute('ls')
-                    break
-                except:
-                    logger.warn(f'Remote ssh to instance [{instance.instance_id}] {instance.instance_name} failed, '
-                                f'retry {3 - retry} / 3 times.')
-                    # EPC is very slow
-                    await asyncio.sleep(120)
-                    if retry == 0:
-                        raise Exception(f'Remote ssh to instance '
-                                        f'[{instance.instance_id}] {instance.instance_name} failed.')
+        deadline = time.monotonic() + READY_TIMEOUT
+        ready = await FanOut(self, 'check_instance_ready', concurrency=READY_CONCURRENCY, timeout=READY_TIMEOUT).run(
+            instances, lambda instance: self.wait_instance_ready(instance, deadline),
+            key=lambda instance: instance.id)
+        logger.info(self, f'Check instance ready ==seconds, attempts==> {ready}')
 
-        return {'cluster_id': cluster_id}
+        # Timings of every host stay in results of this task, see fill_task_args
+        return {'cluster_id': cluster_id, '_ready': ready}
 
     @check_rollback
     async def rollback(self):
         # TODO rollback order
         return True
 
+    async def wait_instance_ready(self, instance, deadline):
+        """
+        Probe tcp port then ssh until the instance answers, return seconds and attempts it took.
+        """
+        started_at = time.monotonic()
+        remote = await instance.remote()
+        interval = READY_BACKOFF_BASE
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                await tcp_check(remote.ip, remote.port)
+                logger.info(f'Try remote ssh to instance [{instance.instance_id}] {instance.instance_name}')
+                async with remote as conn:
+                    await conn.execute('ls')
+                break
+            except Exception as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f'Remote ssh to instance [{instance.instance_id}] {instance.instance_name} '
+                                    f'failed after {attempts} attempts, Error: {e}')
+                logger.warn(f'Remote ssh to instance [{instance.instance_id}] {instance.instance_name} failed, '
+                            f'attempt {attempts}, retry in {min(interval, remaining):.0f} s, Error: {e}')
+                # EPC is very slow, back off up to the cap
+                await asyncio.sleep(min(interval, remaining))
+                interval = min(interval * 2, READY_BACKOFF_CAP)
+
+        seconds = round(time.monotonic() - started_at, 1)
+        logger.info(self, f'Instance [{instance.instance_id}] {instance.instance_name} is ready, '
+                          f'{seconds} s, {attempts} attempts.')
+        return {'seconds': seconds, 'attempts': attempts}
+
 
 class TaskUpdateInstanceStatus(BaseTask):
+    context_keys = ('cluster_id', 'status')
+
     @check_task
     async def run(self):
         cluster_id = self.args.pop('cluster_id', None)
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -720,6 +773,8 @@ class TaskUpdateInstanceStatus(BaseTask):
 
 
 class TaskUpgradeInstance(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'cluster_id', 'is_upgrade_ebs', 'is_upgrade_kec', 'upgrade_instance_group')
 
     @check_task
     async def run(self):
@@ -728,7 +783,7 @@ class TaskUpgradeInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -796,6 +851,9 @@ class TaskUpgradeInstance(BaseTask):
 
 
 class TaskRollingRestart(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('account_id', 'auth_token', 'cluster_id', 'is_upgrade_kec', 'restart_instance_id')
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -806,7 +864,7 @@ class TaskRollingRestart(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,12 +1,13 @@
-from oasis.db.models import get_model_by_id
-from oasis.db.models.cluster import ClusterModel
 from oasis.utils.sdk import eagles_client
+from oasis.worker.fanout import FanOut
 from oasis.worker.tasks import BaseTask
 from oasis.worker.tasks import check_rollback
 from oasis.worker.tasks import check_task
 
 
 class TaskAddClusterMonitor(BaseTask):
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -14,7 +15,7 @@ class TaskAddClusterMonitor(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -29,6 +30,8 @@ class TaskAddClusterMonitor(BaseTask):
 
 
 class TaskAddInstanceMonitor(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -36,25 +39,29 @@ class TaskAddInstanceMonitor(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         new_instance_ids = self.args.get('new_instance_ids', [])
 
-        for ig in cluster.instance_groups:
-            for instance in ig.instances:
-                if instance.instance_id in new_instance_ids:
-                    await eagles_client.service_add_instances_monitor(
-                        cluster_id,
-                        cluster.name,
-                        instance.id,
-                        instance.instance_name,
-                        instance.internal_ip,
-                        cluster.cluster_type,
-                        ig.instance_group_type,
-                        account_id=account_id,
-                    )
+        async def _add_monitor(ig_instance):
+            ig, instance = ig_instance
+            await eagles_client.service_add_instances_monitor(
+                cluster_id,
+                cluster.name,
+                instance.id,
+                instance.instance_name,
+                instance.internal_ip,
+                cluster.cluster_type,
+                ig.instance_group_type,
+                account_id=account_id,
+            )
+
+        await FanOut(self, 'add_instance_monitor').run(
+            [(ig, instance) for ig in cluster.instance_groups for instance in ig.instances
+             if instance.instance_id in new_instance_ids],
+            _add_monitor, key=lambda ig_instance: ig_instance[1].id)
 
         return {'cluster_id': cluster_id}
 
@@ -64,6 +71,8 @@ class TaskAddInstanceMonitor(BaseTask):
 
 
 class TaskRemoveClusterMonitor(BaseTask):
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -71,7 +80,7 @@ class TaskRemoveClusterMonitor(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -86,6 +95,8 @@ class TaskRemoveClusterMonitor(BaseTask):
 
 
 class TaskRemoveInstanceMonitor(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -95,22 +106,29 @@ class TaskRemoveInstanceMonitor(BaseTask):
 
         scale_in_instance_ids = self.args.get('scale_in_instance_ids', None)
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
+        ig_instance_ids = {}
         for ig in cluster.instance_groups:
             instance_ids = []
             for instance in ig.instances:
                 if not scale_in_instance_ids or instance.instance_id in scale_in_instance_ids:
                     instance_ids.append(instance.id)
             if instance_ids:
-                await eagles_client.service_remove_instance_monitor(
-                    instance_ids,
-                    cluster.cluster_type,
-                    ig.instance_group_type,
-                    account_id=account_id,
-                )
+                ig_instance_ids[ig.id] = (ig, instance_ids)
+
+        async def _remove_monitor(ig_id):
+            ig, instance_ids = ig_instance_ids[ig_id]
+            await eagles_client.service_remove_instance_monitor(
+                instance_ids,
+                cluster.cluster_type,
+                ig.instance_group_type,
+                account_id=account_id,
+            )
+
+        await FanOut(self, 'remove_instance_monitor').run(list(ig_instance_ids), _remove_monitor)
 
         return {'cluster_id': cluster_id}
 
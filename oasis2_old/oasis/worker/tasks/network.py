@@ -1,9 +1,7 @@
 from datetime import datetime
 from conf.infra_conf import DEFAULT_LINK, TAG_REP
 
-from oasis.db.models import get_model_by_id
 from oasis.db.models import model_query
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.eip import EIPModel
 from oasis.utils import sdk
 from oasis.utils.config import config
@@ -18,6 +16,8 @@ from oasis.worker.tasks import check_task
 
 
 class TaskCreateSecurityGroup(BaseTask):
+    context_keys = ('cluster_id', 'product', 'security_group_id', 'tenant_id')
+
     @check_task
     async def run(self):
         product = self.args.get('product', '')
@@ -25,7 +25,7 @@ class TaskCreateSecurityGroup(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -54,6 +54,8 @@ class TaskCreateSecurityGroup(BaseTask):
 
 # 历史集群没有安全组ID，为了适应历史集群，增加此任务
 class TaskGetSecurityGroup(BaseTask):
+    context_keys = ('cluster_id', 'product', 'security_group_id', 'tenant_id')
+
     @check_task
     async def run(self):
         product = self.args.get('product', '')
@@ -61,7 +63,7 @@ class TaskGetSecurityGroup(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -89,13 +91,15 @@ class TaskGetSecurityGroup(BaseTask):
 
 
 class TaskCreateControlSecurityGroup(BaseTask):
+    context_keys = ('cluster_id', 'tenant_id')
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -118,6 +122,8 @@ class TaskCreateControlSecurityGroup(BaseTask):
 
 
 class TaskCreateSubnet(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'product', 'security_group_id', 'tenant_id')
+
     @check_task
     async def run(self):
         product = self.args.get('product', '')
@@ -127,7 +133,7 @@ class TaskCreateSubnet(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -208,6 +214,8 @@ class TaskCreateSubnet(BaseTask):
 
 class TaskCreateInnerLB(BaseTask):
     # ELB for ssh to 1505
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids', 'tenant_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -217,7 +225,7 @@ class TaskCreateInnerLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -262,7 +270,7 @@ class TaskCreateInnerLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -275,6 +283,9 @@ class TaskCreateInnerLB(BaseTask):
 
 
 class TaskCreateEIP(BaseTask):
+    context_keys = ('account_id', 'allocation_id', 'cluster_id', 'eip_band_width', 'eip_charge_type',
+                    'eip_line_id', 'eip_purchase_time', 'ip_addr', 'project_id', 'sub_orders')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -292,7 +303,7 @@ class TaskCreateEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -372,7 +383,7 @@ class TaskCreateEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -395,6 +406,9 @@ class TaskCreateEIP(BaseTask):
 
 
 class TaskCreateSLB(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'load_balancer_type', 'private_ip_address', 'sub_orders',
+                    'subnet_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -415,7 +429,7 @@ class TaskCreateSLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -443,7 +457,7 @@ class TaskCreateSLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -461,6 +475,8 @@ class TaskCreateSLB(BaseTask):
 
 
 class TaskAllocateEIP2SLB(BaseTask):
+    context_keys = ('account_id', 'allocation_id', 'cluster_id', 'slb_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -475,7 +491,7 @@ class TaskAllocateEIP2SLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -550,7 +566,7 @@ class TaskAllocateEIP2SLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -589,6 +605,7 @@ class TaskAllocateEIP2SLB(BaseTask):
 
 
 class TaskScaleInReleaseSlb(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_ids', 'unbind_slb_type')
 
     @check_task
     async def run(self):
@@ -599,7 +616,7 @@ class TaskScaleInReleaseSlb(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -672,6 +689,7 @@ class TaskScaleInReleaseSlb(BaseTask):
 
 
 class TaskScaleOutBindSlb(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'new_instance_ids')
 
     @check_task
     async def run(self):
@@ -682,7 +700,7 @@ class TaskScaleOutBindSlb(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -744,6 +762,8 @@ class TaskScaleOutBindSlb(BaseTask):
 
 
 class TaskBindPrivateSLB(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'private_ip_address', 'slb_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -758,7 +778,7 @@ class TaskBindPrivateSLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -829,7 +849,7 @@ class TaskBindPrivateSLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -857,6 +877,8 @@ class TaskBindPrivateSLB(BaseTask):
 
 
 class TaskDisassociateEIP(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'is_delete')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -866,7 +888,7 @@ class TaskDisassociateEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -948,6 +970,8 @@ class TaskDisassociateEIP(BaseTask):
 
 
 class TaskDeleteSLB(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'is_delete', 'unbind_slb_type')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -964,7 +988,7 @@ class TaskDeleteSLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1037,6 +1061,8 @@ class TaskDeleteSLB(BaseTask):
 
 
 class TaskProvisionControlSecurityGroup(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'control_security_group_id', 'new_instance_ids', 'tenant_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -1047,7 +1073,7 @@ class TaskProvisionControlSecurityGroup(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1069,6 +1095,9 @@ class TaskProvisionControlSecurityGroup(BaseTask):
 
 
 class TaskBindInternalEIP(BaseTask):
+    context_keys = ('account_id', 'band_width', 'charge_type', 'cluster_id', 'inner_eip_order_id', 'line_id',
+                    'new_instance_ids', 'project_id', 'purchase_time')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -1084,7 +1113,7 @@ class TaskBindInternalEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1157,7 +1186,7 @@ class TaskBindInternalEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1171,6 +1200,8 @@ class TaskBindInternalEIP(BaseTask):
 
 
 class TaskReleaseInternalEIP(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -1179,7 +1210,7 @@ class TaskReleaseInternalEIP(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1235,6 +1266,8 @@ class TaskReleaseInternalEIP(BaseTask):
 
 
 class TaskDeleteInnerLB(BaseTask):
+    context_keys = ('cluster_id', 'scale_in_instance_ids', 'tenant_id')
+
     @check_task
     async def run(self):
         tenant_id = self.args.get('tenant_id', '')
@@ -1243,7 +1276,7 @@ class TaskDeleteInnerLB(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,5 +1,6 @@
 from oasis.db.models import model_query
 from oasis.db.models.notification import NotificationModel
+from oasis.db.models.task import TaskModel
 from oasis.utils.config import config
 from oasis.utils.logger import logger
 from oasis.utils.sdk import feishu_client
@@ -10,6 +11,8 @@ from oasis.worker.tasks import check_task
 
 
 class TaskSendFeishu(BaseTask):
+    reclaim_idle = 300
+
     @check_task
     async def run(self):
         try:
@@ -31,6 +34,10 @@ class TaskSendFeishu(BaseTask):
 
 
 class TaskSendScaleNotification(BaseTask):
+    type = TaskModel.TYPE.PUBLIC
+
+    reclaim_idle = 300
+
     # https://wiki.op.ksyun.com/pages/viewpage.action?pageId=151474732
     @check_task
     async def run(self):
@@ -1,9 +1,7 @@
 from conf.charge_conf import MAIN_INSTANCE_POLICY
 from conf.charge_conf import PRODUCT_GROUP_ID_MAP
 from conf.charge_conf import PRODUCT_GROUP_MAP
-from oasis.db.models import get_model_by_id
 from oasis.db.models import model_query
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.cluster_order import ClusterOrderModel
 from oasis.utils import sdk
 from oasis.utils.exceptions import ChargeException
@@ -64,6 +62,8 @@ class TaskUpgradeProduct(BaseTask):
 
 
 class TaskCreateOrder(BaseTask):
+    context_keys = ('account_id', 'cluster_type', 'order_id', 'order_product_details', 'sub_orders')
+
     @check_task
     async def run(self):
         order_id = self.args.get('order_id', None)
@@ -151,6 +151,10 @@ class TaskCreateOrder(BaseTask):
 
 
 class TaskDeleteServiceInstance(BaseTask):
+    # Billing reads the cluster as it is now
+    fresh_cluster = True
+    context_keys = ('account_id', 'cluster_id', 'scale_in_instance_ids')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -159,7 +163,7 @@ class TaskDeleteServiceInstance(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -188,6 +192,10 @@ class TaskDeleteServiceInstance(BaseTask):
 
 
 class TaskNotifyOrder(BaseTask):
+    # Billing reads the cluster as it is now
+    fresh_cluster = True
+    context_keys = ('account_id', 'cluster_id', 'order_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', None)
@@ -196,7 +204,7 @@ class TaskNotifyOrder(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -311,6 +319,9 @@ class TaskInitUpgradeOrder(BaseTask):
     升配流程与新建（扩容）不同，不需要等待业务线实例ID（新建）。
     所以可以预先加入cluster_order
     '''
+    # Billing reads the cluster as it is now
+    fresh_cluster = True
+    context_keys = ('cluster_id', 'order_id', 'product', 'upgrade_instance_group')
 
     @check_task
     async def run(self):
@@ -322,7 +333,7 @@ class TaskInitUpgradeOrder(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -404,6 +415,9 @@ class TaskInitUpgradeOrder(BaseTask):
 
 
 class TaskNotifyOrderForUpgrade(BaseTask):
+    # Billing reads the cluster as it is now
+    fresh_cluster = True
+    context_keys = ('cluster_id', 'order_id', 'order_info_res')
 
     @check_task
     async def run(self):
@@ -412,7 +426,7 @@ class TaskNotifyOrderForUpgrade(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -2,9 +2,7 @@ import asyncio
 import traceback
 from conf.infra_conf import TAG_REP
 
-from oasis.db.models import get_model_by_id
 from oasis.db.models import model_query
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.eip import EIPModel
 from oasis.utils import sdk
 from oasis.utils.logger import logger
@@ -15,6 +13,8 @@ from oasis.worker.tasks import check_task
 
 
 class TaskReplaceResourcesTags(BaseTask):
+    context_keys = ('account_id', 'cluster_id', 'exec_mode', 'new_instance_ids', 'tags')
+
     @check_task
     async def run(self):
         '''
@@ -54,7 +54,7 @@ class TaskReplaceResourcesTags(BaseTask):
             if not cluster_id:
                 raise Exception('Please specify cluster_id')
 
-            cluster = await get_model_by_id(ClusterModel, cluster_id)
+            cluster = await self.get_cluster(cluster_id)
             if not cluster:
                 raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -140,6 +140,8 @@ class TaskReplaceResourcesTags(BaseTask):
 
 
 class TaskDeleteClusterDefaultTags(BaseTask):
+    context_keys = ('account_id', 'cluster_id')
+
     @check_task
     async def run(self):
         account_id = self.args.get('account_id', '')
@@ -148,7 +150,7 @@ class TaskDeleteClusterDefaultTags(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,6 +1,6 @@
 from oasis.db.models import get_model_by_id
-from oasis.db.models.cluster import ClusterModel
 from oasis.db.models.es_plugin import EsPluginModel
+from oasis.db.models.task import TaskModel
 from oasis.utils.config import config
 from oasis.utils.logger import logger
 from oasis.utils.sdk import gringotts_client
@@ -17,7 +17,7 @@ class TaskUpdateUserPlugin(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -47,13 +47,15 @@ class TaskUpdateUserPlugin(BaseTask):
 
 
 class TaskDeleteKs3UserPlugin(BaseTask):
+    context_keys = ('cluster_id', 'plugin_id', 'request_id')
+
     @check_task
     async def run(self):
         cluster_id = self.args.pop('cluster_id', None)
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -89,13 +91,15 @@ class TaskDeleteKs3UserPlugin(BaseTask):
 
 
 class TaskDeleteKs3UserPlugins(BaseTask):
+    context_keys = ('cluster_id', 'plugins', 'request_id')
+
     @check_task
     async def run(self):
         cluster_id = self.args.pop('cluster_id', None)
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -128,6 +132,9 @@ class TaskDeleteKs3UserPlugins(BaseTask):
 
 
 class TaskGringottsInstallUserPlugin(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id', 'ks3_plugin_address', 'plugin_id')
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -138,7 +145,7 @@ class TaskGringottsInstallUserPlugin(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -175,6 +182,9 @@ class TaskGringottsInstallUserPlugin(BaseTask):
 
 
 class TaskGringottsUninstallUserPlugin(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id', 'ks3_plugin_address', 'plugin_id')
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -185,7 +195,7 @@ class TaskGringottsUninstallUserPlugin(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -222,6 +232,9 @@ class TaskGringottsUninstallUserPlugin(BaseTask):
 
 
 class TaskGringottsDeleteUserPlugin(BaseTask):
+    type = TaskModel.TYPE.POLY
+    context_keys = ('auth_token', 'cluster_id', 'ks3_plugin_address', 'plugin_id')
+
     @check_task
     async def run(self):
         token = self.args.pop('auth_token', None)
@@ -232,7 +245,7 @@ class TaskGringottsDeleteUserPlugin(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -1,18 +1,39 @@
-import asyncio
 from uuid import uuid4
 
-from oasis.db.models import get_model_by_id
-from oasis.db.models.cluster import ClusterModel
+from oasis.db.models.task import TaskModel
 from oasis.utils.config import base_nginx_conf, base_gringotts_repo
 from oasis.utils.config import config
 from oasis.utils.generator import generate_instance_hosts
 from oasis.utils.logger import logger
+from oasis.utils.remote import ScriptBundle
+from oasis.worker.artifacts import Artifact
+from oasis.worker.artifacts import ArtifactDistributor
+from oasis.worker.fanout import FanOut
 from oasis.worker.tasks import BaseTask
 from oasis.worker.tasks import check_rollback
 from oasis.worker.tasks import check_task
 
 
+def gringotts_artifacts(repo):
+    """
+    Files TaskInstallGringottsAgent downloads, at the paths the install bundle reads them from.
+    """
+    return [
+        Artifact('nginx installer', f'{repo}third-software/nginx/add_kes_nginx.sh', '/tmp/add_kes_nginx.sh'),
+        Artifact('gringotts agent', f'{repo}gringotts/gringotts-agent/latest/gringotts-agent.latest.rpm',
+                 '/tmp/gringotts-agent.latest.rpm'),
+        Artifact('gringotts collector', f'{repo}gringotts/gringotts-agent/latest/gringotts-collector.latest.rpm',
+                 '/tmp/gringotts-collector.latest.rpm'),
+        Artifact('supervisor installer', f'{repo}third-software/supervisor/supervisor-kes.sh',
+                 '/tmp/supervisor-kes.sh'),
+        Artifact('jdk', f'{repo}third-software/jdk/jdk.tar.gz', '/tmp/jdk.tar.gz'),
+    ]
+
+
 class TaskInstallGringottsAgent(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('cluster_id', 'new_instance_ids')
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
@@ -20,74 +41,99 @@ class TaskInstallGringottsAgent(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
         gringotts_repo_url_prefix = config.get('gringotts', 'gringotts_repo_url_prefix')
-        tasks = []
+        instance_subnets = []
         for ig in cluster.instance_groups:
             for instance in ig.instances:
                 if new_instance_ids and instance.instance_id not in new_instance_ids:
                     continue
-                logger.info(self, f'Remote install gringotts on new instance {instance.id}, start.')
-                tasks.append(self.remote_install_gringotts_agent(instance, gringotts_repo_url_prefix))
+                instance_subnets.append((instance, ig.vpc_subnet_id))
+
+        # peer: artifacts are downloaded once per subnet and pushed node to node before installing.
+        # direct: every node downloads from the repo.
+        distributed = config.get('gringotts', 'artifact_distribution', fallback='peer') == 'peer'
+        artifacts = None
+        if distributed:
+            distributor = ArtifactDistributor(self, gringotts_artifacts(gringotts_repo_url_prefix))
+            artifacts = await distributor.distribute(instance_subnets)
+            logger.info(self, f'Install gringotts ==distributed artifacts==> {artifacts}')
 
-        await asyncio.gather(*tasks)
+        await FanOut(self, 'install_gringotts').run(
+            [instance for instance, _ in instance_subnets],
+            lambda instance: self.remote_install_gringotts_agent(instance, gringotts_repo_url_prefix, distributed),
+            key=lambda instance: instance.id)
+
+        # Bytes fetched, pushed and saved per artifact stay in results of this task, see fill_task_args
+        return {'_artifacts': artifacts}
 
     @check_rollback
     async def rollback(self):
         return True
 
-    async def remote_install_gringotts_agent(self, instance, gringotts_repo_url_prefix):
+    async def remote_install_gringotts_agent(self, instance, gringotts_repo_url_prefix, distributed=False):
         logger.info(self, f'Remote install gringotts on new instance {instance.id}, start.')
         remote = await instance.remote()
 
+        repo = gringotts_repo_url_prefix
+        bundle = ScriptBundle(f'{self.task_id}-{instance.id}-install-gringotts')
+        # install nginx
+        if not distributed:
+            bundle.step('download nginx installer', f'rm -rf /tmp/add_kes_nginx.sh;sudo wget -N -t 120 -T 20 {repo}'
+                                                    f'third-software/nginx/add_kes_nginx.sh -P /tmp/')
+        bundle.step('install nginx', f'sudo sh /tmp/add_kes_nginx.sh {repo}third-software/nginx/nginx.tar.gz '
+                                     f'>> /tmp/install_nginx.log', raise_when_error=False)
+
+        # install gg agent/collector & supervisor
+        bundle.step('backup agent rpm', 'sudo mv /usr/local/src/gringotts-agent.latest.rpm '
+                                        '/usr/local/src/gringotts-agent.latest.rpm.old',
+                    raise_when_error=False)
+        if not distributed:
+            bundle.step('download agent', f'sudo wget -c -t 120 -T 20 {repo}gringotts/gringotts-agent/latest/'
+                                          f'gringotts-agent.latest.rpm -P /tmp/')
+            bundle.step('download collector', f'sudo wget -c -t 120 -T 20 {repo}gringotts/gringotts-agent/latest/'
+                                              f'gringotts-collector.latest.rpm -P /tmp/')
+        bundle.step('touch nodeinfo', 'sudo touch /etc/nodeinfo')
+        bundle.step('install agent', 'sudo rpm -U --force /tmp/gringotts-agent.latest.rpm')
+        bundle.step('install collector', 'sudo rpm -U --force /tmp/gringotts-collector.latest.rpm')
+        bundle.step('yum clean', 'sudo yum clean all')
+        bundle.step('yum makecache', 'sudo yum makecache')
+        if not distributed:
+            bundle.step('download supervisor installer', f'rm -rf /tmp/supervisor.sh;sudo wget -N -t 120 -T 20 {repo}'
+                                                         f'third-software/supervisor/supervisor-kes.sh  -P /tmp/')
+        bundle.step('install supervisor', f'sudo sh /tmp/supervisor-kes.sh {repo} >> /tmp/install_supervisor.log',
+                    raise_when_error=False)
+
+        # force agent restart again, guarantee nodeinfo is loaded
+        bundle.step('restart agent', 'supervisorctl restart gringotts-agent')
+        bundle.step('restart collector', 'supervisorctl restart gringotts-collector', raise_when_error=False)
+
+        # install jdk
+        if not distributed:
+            bundle.step('download jdk', f'rm -rf /tmp/jdk.tar.gz;sudo wget -N -t 120 -T 20 {repo}'
+                                        f'third-software/jdk/jdk.tar.gz  -P /tmp/')
+        bundle.step('unpack jdk', 'tar -zxf /tmp/jdk.tar.gz -C /mnt/')
+        bundle.step('export java home', 'sed -i "/export JAVA_HOME/d" /etc/profile && '
+                                        'echo "export JAVA_HOME=/mnt/jdk" >> /etc/profile')
+        bundle.step('export classpath', 'sed -i "/export CLASSPATH/d" /etc/profile && '
+                                        'echo "export CLASSPATH=.:\\$JAVA_HOME/lib/dt.jar:\\$JAVA_HOME/lib/tools.jar:'
+                                        '\\$JAVA_HOME/jre/lib/rt.jar" >> /etc/profile')
+        bundle.step('export path', 'sed -i "/export PATH/d" /etc/profile && '
+                                   'echo "export PATH=\\$PATH:\\$JAVA_HOME/bin" >> /etc/profile')
+
         async with remote as conn:
-            # install nginx
-            await conn.execute(f'rm -rf /tmp/add_kes_nginx.sh;sudo wget -N -t 120 -T 20 {gringotts_repo_url_prefix}'
-                               f'third-software/nginx/add_kes_nginx.sh -P /tmp/')
-            await conn.execute(f'sudo sh /tmp/add_kes_nginx.sh {gringotts_repo_url_prefix}third-software/nginx/nginx.tar.gz >> /tmp/install_nginx.log', raise_when_error=False)
-
-            # install gg agent/collector & supervisor
-            await conn.execute('sudo mv /usr/local/src/gringotts-agent.latest.rpm '
-                               '/usr/local/src/gringotts-agent.latest.rpm.old',
-                               raise_when_error=False)
-            await conn.execute(f'sudo wget -c -t 120 -T 20 {gringotts_repo_url_prefix}gringotts/'
-                               f'gringotts-agent/latest/'
-                               f'gringotts-agent.latest.rpm -P /tmp/')
-            await conn.execute(f'sudo wget -c -t 120 -T 20 {gringotts_repo_url_prefix}gringotts/'
-                               f'gringotts-agent/latest/'
-                               f'gringotts-collector.latest.rpm -P /tmp/')
-            await conn.execute('sudo touch /etc/nodeinfo')
-            await conn.execute('sudo rpm -U --force /tmp/gringotts-agent.latest.rpm')
-            await conn.execute('sudo rpm -U --force /tmp/gringotts-collector.latest.rpm')
-            await conn.execute('sudo yum clean all')
-            await conn.execute('sudo yum makecache')
-            await conn.execute(f'rm -rf /tmp/supervisor.sh;sudo wget -N -t 120 -T 20 {gringotts_repo_url_prefix}'
-                               f'third-software/supervisor/supervisor-kes.sh  -P /tmp/')
-            await conn.execute(f'sudo sh /tmp/supervisor-kes.sh {gringotts_repo_url_prefix} >> /tmp/install_supervisor.log', raise_when_error=False)
-            
-            # force agent restart again, guarantee nodeinfo is loaded
-            await conn.execute('supervisorctl restart gringotts-agent', raise_when_error=True)
-            await conn.execute('supervisorctl restart gringotts-collector', raise_when_error=False)
-
-            # install jdk
-            await conn.execute(f'rm -rf /tmp/jdk.tar.gz;sudo wget -N -t 120 -T 20 {gringotts_repo_url_prefix}'
-                               f'third-software/jdk/jdk.tar.gz  -P /tmp/')
-            await conn.execute('tar -zxf /tmp/jdk.tar.gz -C /mnt/')
-            await conn.execute(f'sed -i "/export JAVA_HOME/d" /etc/profile')
-            await conn.execute(f'echo "export JAVA_HOME=/mnt/jdk" >> /etc/profile')
-            await conn.execute(f'sed -i "/export CLASSPATH/d" /etc/profile')
-            await conn.execute(f'echo "export CLASSPATH=.:\$JAVA_HOME/lib/dt.jar:\$JAVA_HOME/lib/tools.jar:\$JAVA_HOME/jre/lib/rt.jar" >> /etc/profile')
-            await conn.execute(f'sed -i "/export PATH/d" /etc/profile')
-            await conn.execute(f'echo "export PATH=\$PATH:\$JAVA_HOME/bin" >> /etc/profile')
-            await conn.execute(f'source /etc/profile')
+            await conn.run_bundle(bundle)
 
         logger.info(self, f'Remote install gringotts on new instance {instance.id}, finished.')
 
 
 class TaskConfigHostname(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('cluster_id', 'new_instance_ids')
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
@@ -95,7 +141,7 @@ class TaskConfigHostname(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -119,20 +165,17 @@ class TaskConfigHostname(BaseTask):
         total_hosts_file = generate_instance_hosts(old_instances + new_instances, test_env=test_env)
         new_hosts_file = generate_instance_hosts(new_instances)
 
-        new_instance_tasks = []
-        old_instance_tasks = []
+        new_ids = {instance.id for instance in new_instances}
 
-        # For all new instance
-        for instance in new_instances:
-            new_instance_tasks.append(self.remote_config_new_instance(instance, total_hosts_file,
-                                                                      cluster_id, gringotts_env))
+        async def _config(instance):
+            # For all new instance
+            if instance.id in new_ids:
+                return await self.remote_config_new_instance(instance, total_hosts_file, cluster_id, gringotts_env)
+            # For all old instances
+            return await self.remote_config_old_instance(instance, new_hosts_file, cluster_id, gringotts_env)
 
-        # For all old instances
-        for instance in old_instances:
-            old_instance_tasks.append(self.remote_config_old_instance(instance, new_hosts_file,
-                                                                      cluster_id, gringotts_env))
-
-        await asyncio.gather(*new_instance_tasks, *old_instance_tasks)
+        await FanOut(self, 'config_hostname').run(new_instances + old_instances, _config,
+                                                  key=lambda instance: instance.id)
 
     @check_rollback
     async def rollback(self):
@@ -144,44 +187,46 @@ class TaskConfigHostname(BaseTask):
         instance_fqdn = f'{instance.instance_name}.ksc.com'
         logger.info(self, f'Start remote config hostname on new instance {instance_id}, {instance_fqdn}.')
 
+        _nodeinfo = []
+        _nodeinfo.append(f"node_id\t{instance_id}")
+        _nodeinfo.append(f"node_group_id\t{instance_group_id}")
+        _nodeinfo.append(f"cluster_id\t{cluster_id}")
+        _nodeinfo.append(f"env {gringotts_env}")
+
+        # region 这是一个补丁，用来修复KES端口被通信端口占用的问题
+        # 在合并入KMR之后，这个补丁应当被去除。
+        # 目前银河KES也用上了userdata脚本，所以下面代码合并入userdata脚本，可以去掉了...
+        # bundle.step('reserve ports', f'echo -e "\n# KMR jmx_exporter'
+        #                              '\nnet.ipv4.ip_local_reserved_ports = 1320,8633,9000-9500\n"'
+        #                              ' >> /etc/sysctl.conf && sysctl -p;')
+
+        # endregion
+        bundle = ScriptBundle(f'{self.task_id}-{instance_id}-config-hostname')
+        bundle.file('etc-hosts', total_hosts_file)
+        bundle.step('set hostname', f'sudo hostname {instance_fqdn}')
+        bundle.step('write hostname', f'sudo echo {instance_fqdn} > /etc/hostname ')
+        bundle.step('replace hosts', 'sudo mv etc-hosts /etc/hosts')
+
+        bundle.step('set shell', 'sudo usermod -s /bin/bash $USER')
+
+        bundle.file('etc-nodeinfo', "\n".join(_nodeinfo))
+        bundle.step('replace nodeinfo', 'sudo mv -f etc-nodeinfo /etc/nodeinfo')
+
+        # 替换为公有云镜像，KEC预装不在提供supervisorctl。需要先执行TaskInstallGringottsAgent
+        # bundle.step('restart agent', 'supervisorctl restart gringotts-agent')
+
+        # # update nginx conf
+        # bundle.file('nginx-conf', base_nginx_conf)
+        # bundle.step('replace nginx conf', 'sudo mv nginx-conf /etc/nginx/nginx.conf')
+        # bundle.step('reload nginx', 'sudo nginx -s reload')
+
+        # update gringotts.repo for yum repos
+        bundle.file('gringotts-repo', base_gringotts_repo)
+        bundle.step('replace gringotts repo', 'sudo mv gringotts-repo /etc/yum.repos.d/gringotts.repo')
+
         remote = await instance.remote()
         async with remote as conn:
-            # region 这是一个补丁，用来修复KES端口被通信端口占用的问题
-            # 在合并入KMR之后，这个补丁应当被去除。
-            # 目前银河KES也用上了userdata脚本，所以下面代码合并入userdata脚本，可以去掉了...
-            # await conn.execute(f'echo -e "\n# KMR jmx_exporter'
-            #                    '\nnet.ipv4.ip_local_reserved_ports = 1320,8633,9000-9500\n"'
-            #                    ' >> /etc/sysctl.conf && sysctl -p;')
-
-            # endregion
-            await conn.write_file('etc-hosts', total_hosts_file)
-            await conn.execute(f'sudo hostname {instance_fqdn}')
-            await conn.execute(f'sudo echo {instance_fqdn} > /etc/hostname ')
-            await conn.execute('sudo mv etc-hosts /etc/hosts')
-
-            await conn.execute('sudo usermod -s /bin/bash $USER')
-
-            _nodeinfo = []
-            _nodeinfo.append(f"node_id\t{instance_id}")
-            _nodeinfo.append(f"node_group_id\t{instance_group_id}")
-            _nodeinfo.append(f"cluster_id\t{cluster_id}")
-            _nodeinfo.append(f"env {gringotts_env}")
-
-            await conn.write_file('etc-nodeinfo', "\n".join(_nodeinfo))
-            await conn.execute('sudo mv -f etc-nodeinfo /etc/nodeinfo')
-
-            # 替换为公有云镜像，KEC预装不在提供supervisorctl。需要先执行TaskInstallGringottsAgent
-            # await asyncio.sleep(10)
-            # await conn.execute('supervisorctl restart gringotts-agent', raise_when_error=True)
-
-            # # update nginx conf
-            # await conn.write_file('nginx-conf', base_nginx_conf)
-            # await conn.execute('sudo mv nginx-conf /etc/nginx/nginx.conf')
-            # await conn.execute('sudo nginx -s reload')
-
-            # update gringotts.repo for yum repos
-            await conn.write_file('gringotts-repo', base_gringotts_repo)
-            await conn.execute('sudo mv gringotts-repo /etc/yum.repos.d/gringotts.repo')
+            await conn.run_bundle(bundle)
 
         logger.info(self, f'Finish remote config hostname on new instance {instance_id}, {instance_fqdn}.')
 
@@ -190,27 +235,32 @@ class TaskConfigHostname(BaseTask):
         instance_id = instance.id
         instance_fqdn = f'{instance.instance_name}.ksc.com'
         logger.info(self, f'Start remote config hostname on old instance {instance_id}, {instance_fqdn}.')
-        remote = await instance.remote()
-        async with remote as conn:
-            await conn.write_file('etc-hosts1', new_hosts_file)
-            await conn.execute(
-                'sudo cat /etc/hosts >> etc-hosts1;sudo sort -k 2 -u etc-hosts1 > /etc/hosts')
-            await conn.execute('sudo rm -f etc-hosts1')
+        _nodeinfo = []
+        _nodeinfo.append(f"node_id\t{instance_id}")
+        _nodeinfo.append(f"node_group_id\t{instance_group_id}")
+        _nodeinfo.append(f"cluster_id\t{cluster_id}")
+        _nodeinfo.append(f"env {gringotts_env}")
 
-            await conn.execute('sudo usermod -s /bin/bash $USER')
+        bundle = ScriptBundle(f'{self.task_id}-{instance_id}-config-hostname')
+        bundle.file('etc-hosts1', new_hosts_file)
+        bundle.step('merge hosts', 'sudo cat /etc/hosts >> etc-hosts1;sudo sort -k 2 -u etc-hosts1 > /etc/hosts')
+        bundle.step('remove hosts', 'sudo rm -f etc-hosts1')
 
-            _nodeinfo = []
-            _nodeinfo.append(f"node_id\t{instance_id}")
-            _nodeinfo.append(f"node_group_id\t{instance_group_id}")
-            _nodeinfo.append(f"cluster_id\t{cluster_id}")
-            _nodeinfo.append(f"env {gringotts_env}")
+        bundle.step('set shell', 'sudo usermod -s /bin/bash $USER')
 
-            await conn.write_file('etc-nodeinfo', "\n".join(_nodeinfo))
-            await conn.execute('sudo mv -f etc-nodeinfo /etc/nodeinfo')
+        bundle.file('etc-nodeinfo', "\n".join(_nodeinfo))
+        bundle.step('replace nodeinfo', 'sudo mv -f etc-nodeinfo /etc/nodeinfo')
+
+        remote = await instance.remote()
+        async with remote as conn:
+            await conn.run_bundle(bundle)
         logger.info(self, f'Finish remote config hostname on old instance {instance_id}, {instance_fqdn}.')
 
 
 class TaskConfigNic(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('cluster_id', 'instance_ids', 'nic', 'routes')
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
@@ -221,7 +271,7 @@ class TaskConfigNic(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -231,12 +281,9 @@ class TaskConfigNic(BaseTask):
                 if instance.instance_id in instance_ids:
                     new_instances.append(instance)
 
-        new_instance_tasks = []
-
-        for instance in new_instances:
-            new_instance_tasks.append(self.remote_config_nic(instance, nic, routes))
-
-        await asyncio.gather(*new_instance_tasks)
+        await FanOut(self, 'config_nic').run(
+            new_instances, lambda instance: self.remote_config_nic(instance, nic, routes),
+            key=lambda instance: instance.id)
 
     @check_rollback
     async def rollback(self):
@@ -273,6 +320,9 @@ TYPE=Ethernet
 
 
 class TaskAddIptablesRules(BaseTask):
+    type = TaskModel.TYPE.INNER
+    context_keys = ('cluster_id', 'instances')
+
     @check_task
     async def run(self):
         cluster_id = self.args.get('cluster_id', None)
@@ -281,7 +331,7 @@ class TaskAddIptablesRules(BaseTask):
         if not cluster_id:
             raise Exception('Please specify cluster_id')
 
-        cluster = await get_model_by_id(ClusterModel, cluster_id)
+        cluster = await self.get_cluster(cluster_id)
         if not cluster:
             raise Exception(f'Cluster not found, id {cluster_id}')
 
@@ -290,15 +340,13 @@ class TaskAddIptablesRules(BaseTask):
             for instance_rule in instances
         }
 
-        new_instance_tasks = []
-        for ig in cluster.instance_groups:
-            for instance in ig.instances:
-                instance_id = instance.instance_id
-                if instance_id not in instance_rule_dict:
-                    continue
-                new_instance_tasks.append(self.remote_add_iptables_rule(instance, instance_rule_dict.get(instance_id)))
+        new_instances = [instance for ig in cluster.instance_groups for instance in ig.instances
+                         if instance.instance_id in instance_rule_dict]
 
-        await asyncio.gather(*new_instance_tasks)
+        await FanOut(self, 'add_iptables_rules').run(
+            new_instances,
+            lambda instance: self.remote_add_iptables_rule(instance, instance_rule_dict.get(instance.instance_id)),
+            key=lambda instance: instance.id)
 
     @check_rollback
     async def rollback(self):